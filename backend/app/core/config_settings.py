@@ -1,6 +1,6 @@
 import os
 from functools import lru_cache
-from typing import List
+from typing import Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -15,9 +15,127 @@ class Settings(BaseSettings):
     ALLOW_METHODS: List[str]
     ALLOW_HEADERS: List[str]
     APP_DEBUG: bool
-    S3_BUCKET_NAME: str
-    AWS_ACCESS_KEY_ID_VALUE: str
-    AWS_SECRET_ACCESS_KEY_VALUE: str
+    # Only required by the S3 storage backend
+    S3_BUCKET_NAME: Optional[str] = None
+    AWS_ACCESS_KEY_ID_VALUE: Optional[str] = None
+    AWS_SECRET_ACCESS_KEY_VALUE: Optional[str] = None
+
+    # Where finished downloads are kept: "s3", or "local" to serve them from this host via /files
+    STORAGE_BACKEND: str = "s3"
+    LOCAL_STORAGE_DIR: str = "storage"
+    LOCAL_STORAGE_BASE_URL: str = "http://localhost:8000/app/v1/files"
+    LOCAL_STORAGE_SECRET: Optional[str] = None
+
+    # S3 client. S3_ENDPOINT_URL points the client at an S3-compatible stand-in (MinIO, moto) for local runs.
+    AWS_REGION: Optional[str] = None
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_CONNECT_TIMEOUT: int = 5
+    S3_READ_TIMEOUT: int = 60
+    S3_MAX_ATTEMPTS: int = 3
+
+    # Metadata cache (yt-dlp info dicts keyed by video ID)
+    INFO_CACHE_MAX_SIZE: int = 256
+    INFO_CACHE_TTL: int = 1800
+    # Cache-Control max-age of GET /formats/{video_id} responses, for browsers, CDNs and reverse proxies
+    FORMATS_CACHE_MAX_AGE: int = 300
+
+    # yt-dlp backend: "inprocess" runs YoutubeDL on worker threads, "subprocess" spawns the CLI per call
+    YTDLP_ENGINE: str = "inprocess"
+    YTDLP_ENGINE_WORKERS: int = 4
+
+    # Download tuning applied to every video and audio download. The *_MAX values cap per-request overrides.
+    YTDLP_CONCURRENT_FRAGMENTS: int = 4
+    YTDLP_MAX_CONCURRENT_FRAGMENTS: int = 16
+    YTDLP_HTTP_CHUNK_SIZE: Optional[int] = 10 * 1024 * 1024
+    YTDLP_MAX_HTTP_CHUNK_SIZE: int = 50 * 1024 * 1024
+    YTDLP_BUFFER_SIZE: Optional[int] = None
+    YTDLP_MAX_BUFFER_SIZE: int = 16 * 1024 * 1024
+    YTDLP_RATE_LIMIT: Optional[int] = None
+    YTDLP_EXTERNAL_DOWNLOADER: Optional[str] = None
+    YTDLP_EXTERNAL_DOWNLOADER_ARGS: List[str] = []
+    YTDLP_ALLOWED_EXTERNAL_DOWNLOADERS: List[str] = []
+
+    # Download job queue
+    JOB_WORKERS: int = 2
+    JOB_QUEUE_MAX_SIZE: int = 100
+    JOB_RETENTION: int = 3600
+
+    # Job store shared by API processes and workers: memory (this process only) | sqlite | redis.
+    # With sqlite or redis, `python -m app.worker` processes claim jobs from the store, and the API
+    # only enqueues them when API_RUN_WORKERS is false. Workers hold a lease on each job and renew it
+    # every heartbeat; jobs whose lease expires are retried up to JOB_MAX_ATTEMPTS times.
+    JOB_STORE: str = "memory"
+    JOB_STORE_SQLITE_PATH: str = "jobs.db"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_KEY_PREFIX: str = "ytdl"
+    API_RUN_WORKERS: bool = True
+    JOB_LEASE_SECONDS: float = 30
+    JOB_HEARTBEAT_INTERVAL: float = 1
+    JOB_POLL_INTERVAL: float = 0.5
+    JOB_MAX_ATTEMPTS: int = 3
+
+    # Scratch space for downloads in progress. Each download reserves its estimated size
+    # (format filesize * factor, or the default when unknown) against the quota before it starts.
+    SCRATCH_DIR: str = "downloads"
+    SCRATCH_QUOTA_BYTES: int = 20 * 1024 * 1024 * 1024
+    SCRATCH_MIN_FREE_BYTES: int = 1024 * 1024 * 1024
+    SCRATCH_DEFAULT_RESERVATION: int = 512 * 1024 * 1024
+    SCRATCH_RESERVATION_FACTOR: float = 2.0
+    SCRATCH_WAIT_TIMEOUT: int = 300
+    SCRATCH_SWEEP_INTERVAL: int = 600
+    SCRATCH_ORPHAN_TTL: int = 6 * 3600
+
+    # Rate limiting per client (an X-API-Key listed in CLIENT_WEIGHTS, or else the client IP). Token buckets refill
+    # at the per-minute rate and hold up to the burst size; exhausted clients get 429 with Retry-After.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_DOWNLOADS_PER_MINUTE: float = 30
+    RATE_LIMIT_DOWNLOAD_BURST: int = 10
+    RATE_LIMIT_REQUESTS_PER_MINUTE: float = 300
+    RATE_LIMIT_REQUEST_BURST: int = 60
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = False
+    # Fair-queueing weight per API key: a weight of 3 gets three jobs per round-robin turn. Only keys listed
+    # here identify a client; requests with any other key are treated like requests without one.
+    CLIENT_WEIGHTS: Dict[str, int] = {}
+
+    # Admission control: new jobs are refused with 429 past these limits. ADMISSION_MAX_BANDWIDTH is the
+    # combined download speed of running jobs in bytes per second (unset disables the check).
+    ADMISSION_MAX_JOBS_PER_CLIENT: int = 8
+    ADMISSION_MAX_QUEUED_JOBS: int = 50
+    ADMISSION_MAX_BANDWIDTH: Optional[int] = None
+
+    # Playlist/channel batches
+    BATCH_MAX_PARALLEL: int = 4
+    BATCH_MAX_ENTRIES: int = 500
+    BATCH_STATE_DIR: str = "batches"
+
+    # Upload pipeline: "file" downloads to disk then uploads, "stream" pipes ffmpeg output
+    # straight into an S3 multipart upload while the download is still running.
+    UPLOAD_MODE: str = "file"
+    S3_MULTIPART_PART_SIZE: int = 16 * 1024 * 1024
+    S3_MULTIPART_CONCURRENCY: int = 4
+
+    # Retries of transient failures (network errors, expired media URLs, S3 throttling) per pipeline stage.
+    # Attempt n waits a random time up to min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (n - 1)). Retried
+    # downloads resume from their .part files and retried S3 uploads from their completed parts.
+    RETRY_EXTRACT_ATTEMPTS: int = 3
+    RETRY_DOWNLOAD_ATTEMPTS: int = 4
+    RETRY_UPLOAD_ATTEMPTS: int = 5
+    RETRY_BASE_DELAY: float = 1.0
+    RETRY_MAX_DELAY: float = 30.0
+
+    # Post-processing: streams already in the requested codecs are copied or remuxed; only the rest are
+    # transcoded, at most TRANSCODE_MAX_CONCURRENT at a time per worker (unset: one per CPU core).
+    TRANSCODE_MAX_CONCURRENT: Optional[int] = None
+
+    # Index of already uploaded renditions (S3 is still checked with HEAD on a miss)
+    RESULT_INDEX_MAX_SIZE: int = 10000
+    RESULT_INDEX_TTL: int = 3600
+
+    # Readiness probe (/ready): dependency checks run in the background every READINESS_INTERVAL
+    # seconds (every 5 while not ready), each given READINESS_TIMEOUT seconds.
+    READINESS_INTERVAL: float = 30
+    READINESS_TIMEOUT: float = 10
 
     class Config:
         """
@@ -1,3 +1,26 @@
 class YouTubeDownloadError(Exception):
     """Custom exception for YouTube download related errors"""
-    pass
\ No newline at end of file
+    pass
+
+
+class JobQueueFullError(Exception):
+    """Raised when the download job queue cannot accept more jobs"""
+    pass
+
+
+class RateLimitExceededError(Exception):
+    """Raised when a client is over its rate limit or the server is at capacity"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobNotFoundError(Exception):
+    """Raised when a download job ID is unknown or has expired"""
+    pass
+
+
+class ScratchSpaceError(YouTubeDownloadError):
+    """Raised when there is not enough scratch disk space to start a download"""
+    pass
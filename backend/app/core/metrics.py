@@ -0,0 +1,71 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Pipeline stages span a few milliseconds (presign) to many minutes (download of a long video).
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "media_stage_duration_seconds",
+    "Time spent in each stage of the download pipeline",
+    ["stage", "format"],
+    buckets=STAGE_BUCKETS,
+)
+JOBS = Counter("media_jobs_total", "Finished download jobs", ["type", "status"])
+JOB_QUEUE_DEPTH = Gauge("media_job_queue_depth", "Download jobs waiting for a worker")
+ACTIVE_WORKERS = Gauge("media_active_workers", "Download workers currently running a job")
+BYTES_TRANSFERRED = Counter(
+    "media_bytes_transferred_total",
+    "Bytes downloaded from the source and written to storage",
+    ["direction", "format"],
+)
+CACHE_REQUESTS = Counter("media_cache_requests_total", "Cache lookups by outcome (hit or miss)", ["cache", "result"])
+SUBPROCESS_SPAWNS = Counter("media_subprocess_spawns_total", "Processes started by the service", ["command"])
+POSTPROCESS_JOBS = Counter(
+    "media_postprocess_total", "Downloads by post-processing path (copy, remux or transcode)", ["path", "format"]
+)
+POSTPROCESS_CPU_SECONDS = Counter(
+    "media_postprocess_cpu_seconds_total", "CPU time spent by ffmpeg post-processing", ["path", "format"]
+)
+RETRIES = Counter("media_retries_total", "Pipeline stage attempts retried after a transient failure", ["stage"])
+TRANSCODES_RUNNING = Gauge("media_transcodes_running", "ffmpeg transcodes currently holding a CPU slot")
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_stage(stage: str, seconds: float, output_format: str = "none", job=None) -> None:
+    """Record the duration of a pipeline stage, globally and on the job it belongs to"""
+    STAGE_SECONDS.labels(stage=stage, format=output_format).observe(seconds)
+    if job is not None:
+        job.add_timing(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, output_format: str = "none", job=None) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, output_format, job)
+
+
+def record_spawn(command: str) -> None:
+    SUBPROCESS_SPAWNS.labels(command=command).inc()
+
+
+def record_postprocess(path: str, cpu_seconds: float, output_format: str = "none", job=None) -> None:
+    """Record the post-processing path of a download and the CPU time ffmpeg spent on it"""
+    POSTPROCESS_JOBS.labels(path=path, format=output_format).inc()
+    POSTPROCESS_CPU_SECONDS.labels(path=path, format=output_format).inc(cpu_seconds)
+    if job is not None:
+        job.add_timing("postprocess_cpu", cpu_seconds)
@@ -0,0 +1,132 @@
+import asyncio
+import shutil
+import threading
+from typing import Any, Optional
+
+from fastapi import Request
+from loguru import logger
+
+from .core.metrics import ACTIVE_WORKERS, JOB_QUEUE_DEPTH
+from .services.batch_service import BatchService
+from .services.health_service import ReadinessProbe
+from .services.job_service import DistributedJobManager, JobManager, create_job_manager
+from .services.storage_service import StorageBackend
+from .services.youtube_service import YouTubeService
+
+
+class Services:
+    """
+    The application's long-lived services, created on first use rather than at import time.
+
+    One instance lives on app.state for the lifetime of the application (see the lifespan in main.py)
+    and request handlers get it through FastAPI dependencies. Creating it does no I/O; start() builds
+    the services off the event loop and checks their dependencies in the background.
+    """
+
+    def __init__(self):
+        self._youtube = None
+        self._jobs = None
+        self._batches = None
+        self._lock = threading.Lock()
+        self.readiness = ReadinessProbe({
+            "yt_dlp": self._check_yt_dlp,
+            "ffmpeg": self._check_ffmpeg,
+            "storage": self._check_storage,
+            "scratch": self._check_scratch,
+            "job_store": self._check_job_store,
+        })
+        self._startup: Optional[asyncio.Task] = None
+
+    @property
+    def youtube(self) -> YouTubeService:
+        if self._youtube is None:
+            with self._lock:
+                if self._youtube is None:
+                    self._youtube = YouTubeService()
+        return self._youtube
+
+    @property
+    def jobs(self) -> JobManager:
+        if self._jobs is None:
+            youtube = self.youtube
+            with self._lock:
+                if self._jobs is None:
+                    self._jobs = create_job_manager(youtube.run_job)
+        return self._jobs
+
+    @property
+    def batches(self) -> BatchService:
+        if self._batches is None:
+            youtube, jobs = self.youtube, self.jobs
+            with self._lock:
+                if self._batches is None:
+                    self._batches = BatchService(youtube.engine, jobs.submit, youtube.storage)
+        return self._batches
+
+    @property
+    def storage(self) -> StorageBackend:
+        return self.youtube.storage
+
+    def start(self) -> None:
+        """Build the services and check their dependencies in the background, without delaying startup"""
+        if self._startup is None:
+            self._startup = asyncio.create_task(self._start())
+
+    async def _start(self) -> None:
+        try:
+            # Constructing the services may block (e.g. importing boto3), so it happens on a worker
+            # thread; the background tasks they own are started on the event loop afterwards.
+            await asyncio.to_thread(lambda: self.batches)
+            self.youtube.scratch.start()
+            self.jobs.start()
+            JOB_QUEUE_DEPTH.set_function(lambda: self.jobs.queue_depth)
+            ACTIVE_WORKERS.set_function(lambda: self.jobs.active_workers)
+        except Exception as e:
+            # The readiness checks keep reporting the failure.
+            logger.error(f"Failed to start services: {e}")
+        self.readiness.start()
+
+    async def _check_yt_dlp(self) -> str:
+        # Spawns a process with the CLI engine; the in-process engine answers from the imported package.
+        return await asyncio.to_thread(self.youtube.engine.version)
+
+    async def _check_ffmpeg(self) -> str:
+        path = shutil.which("ffmpeg")
+        if path is None:
+            raise RuntimeError("ffmpeg was not found on PATH")
+        return path
+
+    async def _check_storage(self) -> bool:
+        return await self.storage.is_available()
+
+    async def _check_scratch(self) -> bool:
+        scratch = self.youtube.scratch
+        free_bytes = (await asyncio.to_thread(shutil.disk_usage, scratch.root)).free
+        if free_bytes < scratch.min_free_bytes:
+            raise RuntimeError(f"Only {free_bytes} bytes free on the scratch disk")
+        return True
+
+    async def _check_job_store(self) -> Any:
+        if not isinstance(self.jobs, DistributedJobManager):
+            return True
+        stats = await self.jobs.store.stats()
+        return f"{stats['queued']} queued, {stats['running']} running"
+
+    async def close(self) -> None:
+        if self._startup is not None:
+            self._startup.cancel()
+            await asyncio.gather(self._startup, return_exceptions=True)
+        await self.readiness.stop()
+        if self._jobs is not None:
+            await self._jobs.shutdown()
+        if self._youtube is not None:
+            await self._youtube.scratch.stop()
+            self._youtube.storage.close()
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def get_storage(request: Request) -> StorageBackend:
+    return get_services(request).storage
@@ -1,13 +1,44 @@
 import os
+import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from .core.config_settings import settings
+from .core.metrics import HTTP_REQUEST_SECONDS
+from .dependencies import Services, get_services
+from .routers.files_router import files_router
 from .routers.youtube_router import yt_router
 
-app = FastAPI(debug=settings.APP_DEBUG)
+
+def _read_version() -> str:
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.path.join(BASE_DIR, 'VERSION'), 'r') as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        return "unknown"
+
+
+# Read once: the file does not change while the process runs.
+VERSION = _read_version()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Services are built and checked in the background, so the server accepts requests right away
+    # and reports readiness on /ready once its dependencies are reachable.
+    app.state.services = Services()
+    app.state.services.start()
+    yield
+    await app.state.services.close()
+
+
+app = FastAPI(debug=settings.APP_DEBUG, lifespan=lifespan)
 
 # app = FastAPI()
 app.add_middleware(
@@ -19,19 +50,31 @@ app.add_middleware(
 )
 
 app.include_router(yt_router, prefix="/app/v1")
+app.include_router(files_router, prefix="/app/v1")
 
 logger.add("log_api.log", rotation="100 MB")  # Automatically rotate log file
 
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template rather than raw path, so job IDs do not explode the label set.
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    ).observe(time.perf_counter() - started)
+    return response
+
+
 def get_info():
     """
     Info function.
     """
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    with open(os.path.join(BASE_DIR, 'VERSION'), 'r') as fh:
-        version = fh.read().strip()
     info = {
-        "boilerplate_version": version,
+        "boilerplate_version": VERSION,
         "fastapi_debug": app.debug
     }
     return info
@@ -60,3 +103,20 @@ def health():
         "info": get_info()
     }
     return result
+
+
+@app.get("/ready")
+def ready(services: Services = Depends(get_services)):
+    """
+    Readiness router. Returns the cached result of the last dependency check, 503 until all pass.
+    """
+    result = services.readiness.result
+    return JSONResponse(result, status_code=200 if result["ready"] else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus metrics.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,204 @@
+from bisect import bisect_right
+from typing import Collection, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Qualities offered to clients and the maximum height each one allows.
+QUALITY_HEIGHTS = {
+    '4320p': 4320, '2160p': 2160, '1440p': 1440,
+    '1080p': 1080, '720p': 720, '480p': 480,
+    '360p': 360, '240p': 240, '144p': 144
+}
+
+# Containers clients can ask for. mkv can hold any codec, so every video stream qualifies for it.
+VIDEO_CONTAINERS = ('mp4', 'webm', 'mkv')
+AUDIO_FORMATS = ('mp3', 'm4a', 'aac', 'opus', 'flac', 'wav')
+# Audio quality tiers offered to clients and the minimum bitrate (kbps) each one asks for. "best" takes
+# the highest-bitrate stream whatever its size.
+AUDIO_QUALITY_TIERS: Dict[str, Optional[int]] = {'low': 48, 'medium': 96, 'high': 128, 'best': None}
+# Reported bitrates wobble around the nominal one (e.g. 127.9 for a 128k stream).
+BITRATE_TOLERANCE = 0.95
+
+
+class MediaFormat(NamedTuple):
+    """
+    Compact record of one entry of the yt-dlp "formats" list.
+    """
+
+    format_id: str
+    ext: Optional[str]
+    protocol: Optional[str]
+    height: Optional[int]
+    fps: Optional[float]
+    vcodec: Optional[str]
+    acodec: Optional[str]
+    tbr: Optional[float]
+    abr: Optional[float]
+    filesize: Optional[int]
+
+    @classmethod
+    def from_info(cls, fmt: Dict) -> "MediaFormat":
+        def codec(name: str) -> Optional[str]:
+            value = fmt.get(name)
+            return None if value in (None, 'none') else value
+
+        return cls(
+            format_id=str(fmt.get('format_id')),
+            ext=fmt.get('ext'),
+            protocol=fmt.get('protocol'),
+            height=fmt.get('height'),
+            fps=fmt.get('fps'),
+            vcodec=codec('vcodec'),
+            acodec=codec('acodec'),
+            tbr=fmt.get('tbr'),
+            abr=fmt.get('abr'),
+            filesize=fmt.get('filesize') or fmt.get('filesize_approx'),
+        )
+
+    @property
+    def has_video(self) -> bool:
+        return self.vcodec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.acodec is not None
+
+    @property
+    def video_codec_family(self) -> Optional[str]:
+        """Codec name without profile, e.g. 'avc1.640028' -> 'avc1'"""
+        return self.vcodec.split('.')[0] if self.vcodec else None
+
+    @property
+    def audio_codec_family(self) -> Optional[str]:
+        """Codec name without profile, e.g. 'mp4a.40.2' -> 'mp4a'"""
+        return self.acodec.split('.')[0] if self.acodec else None
+
+    @property
+    def bitrate(self) -> float:
+        """Audio bitrate in kbps, 0 when unknown"""
+        return self.abr or self.tbr or 0
+
+    def video_rank(self) -> Tuple:
+        return self.height or 0, self.fps or 0, self.tbr or 0
+
+    def audio_rank(self) -> Tuple:
+        return self.bitrate, self.filesize or 0
+
+
+class FormatIndex:
+    """
+    Precomputed lookups over the formats of one video.
+
+    The best video-only stream at or below every quality height is computed once per container, so
+    "best video <= H in container C" is a dictionary lookup for the heights in QUALITY_HEIGHTS (and a
+    binary search for any other height).
+    """
+
+    def __init__(self, formats: Iterable[MediaFormat]):
+        self.formats: List[MediaFormat] = list(formats)
+        self.video = [f for f in self.formats if f.has_video and not f.has_audio]
+        self.audio = [f for f in self.formats if f.has_audio and not f.has_video]
+        self.muxed = [f for f in self.formats if f.has_video and f.has_audio]
+        self.max_height = max((f.height or 0 for f in self.video), default=0)
+
+        self._heights: Dict[Optional[str], List[int]] = {}
+        self._best_video: Dict[Tuple[Optional[str], int], MediaFormat] = {}
+        for container in VIDEO_CONTAINERS + (None,):
+            self._index_container(container)
+
+        # Ascending bitrate, so the smallest stream satisfying a quality tier is the first one found.
+        self._audio_by_bitrate = sorted(self.audio, key=MediaFormat.audio_rank)
+        self._best_audio: Dict[Optional[str], MediaFormat] = {}
+        for fmt in self.audio:
+            for key in (None, fmt.ext):
+                current = self._best_audio.get(key)
+                if current is None or fmt.audio_rank() > current.audio_rank():
+                    self._best_audio[key] = fmt
+
+    @classmethod
+    def from_info(cls, info: Dict) -> "FormatIndex":
+        return cls(MediaFormat.from_info(fmt) for fmt in info.get('formats') or [])
+
+    def _index_container(self, container: Optional[str]) -> None:
+        candidates = sorted(
+            (f for f in self.video if container in (None, 'mkv') or f.ext == container),
+            key=MediaFormat.video_rank
+        )
+        heights = sorted({f.height or 0 for f in candidates} | set(QUALITY_HEIGHTS.values()))
+        self._heights[container] = heights
+
+        # Sweep the heights upwards, carrying the best stream seen so far.
+        best, position = None, 0
+        for height in heights:
+            while position < len(candidates) and (candidates[position].height or 0) <= height:
+                if best is None or candidates[position].video_rank() >= best.video_rank():
+                    best = candidates[position]
+                position += 1
+            if best is not None:
+                self._best_video[(container, height)] = best
+
+    def best_video(self, max_height: int, container: Optional[str] = None) -> Optional[MediaFormat]:
+        """Best video-only stream no taller than max_height that can be stored in container"""
+        best = self._best_video.get((container, max_height))
+        if best is not None:
+            return best
+
+        heights = self._heights.get(container)
+        if not heights:
+            return None
+        position = bisect_right(heights, max_height)
+        return self._best_video.get((container, heights[position - 1])) if position else None
+
+    def best_audio(self, ext: Optional[str] = None) -> Optional[MediaFormat]:
+        return self._best_audio.get(ext)
+
+    def smallest_audio(self, min_bitrate: Optional[float],
+                       codecs: Optional[Collection[str]] = None) -> Optional[MediaFormat]:
+        """
+        Lowest-bitrate audio-only stream of at least min_bitrate kbps (the best stream when None), among the
+        given codec families if any. None when no stream qualifies.
+        """
+        candidates = [f for f in self._audio_by_bitrate if codecs is None or f.audio_codec_family in codecs]
+        if min_bitrate is None:
+            return candidates[-1] if candidates else None
+        return next((f for f in candidates if f.bitrate >= min_bitrate * BITRATE_TOLERANCE), None)
+
+    def audio_qualities(self) -> List[str]:
+        """Audio quality tiers for this video; tiers above the best stream are served from the best stream"""
+        return list(AUDIO_QUALITY_TIERS) if self.audio or self.muxed else []
+
+    def qualities(self) -> Dict[str, str]:
+        """Quality labels available for this video mapped to their yt-dlp format selectors"""
+        available_qualities = {}
+        for quality, height in QUALITY_HEIGHTS.items():
+            if height <= self.max_height:
+                available_qualities[quality] = f'bestvideo[height<={height}]+bestaudio/best[height<={height}]'
+
+        available_qualities['best'] = 'bestvideo+bestaudio/best'
+        return available_qualities
+
+    def video_containers(self) -> List[str]:
+        containers = {f.ext for f in self.video if f.ext in VIDEO_CONTAINERS}
+        if self.video:
+            containers.add('mkv')
+        return sorted(containers)
+
+    def audio_formats(self) -> List[str]:
+        audio_formats = set()
+        for fmt in self.audio:
+            codec = {'mp4a': 'aac'}.get(fmt.audio_codec_family, fmt.audio_codec_family)
+            for format_type in (fmt.ext, codec):
+                if format_type in AUDIO_FORMATS:
+                    audio_formats.add(format_type)
+        return sorted(audio_formats)
+
+    def estimate_size(self, quality: str, container: Optional[str] = None) -> Optional[int]:
+        """Approximate size in bytes of a download at the given quality, or None when unknown"""
+        height = self.max_height if quality == 'best' else QUALITY_HEIGHTS.get(quality)
+        if height is None:
+            return None
+
+        video = self.best_video(height, container)
+        audio = self.best_audio()
+        if video is None or not video.filesize:
+            return None
+        audio_size = audio.filesize if audio is not None and audio.filesize else 0
+        return video.filesize + audio_size
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from ..core.exceptions import YouTubeDownloadError
+from ..dependencies import get_storage
+from ..services.storage_service import LocalStorage, StorageBackend
+
+files_router = APIRouter(
+    prefix="/files",
+    tags=["Files"]
+)
+
+
+@files_router.get("/{object_name:path}")
+async def get_file(object_name: str, expires: int, signature: str, filename: str = "",
+                   storage: StorageBackend = Depends(get_storage)):
+    """
+    Serve a file kept by the local storage backend.
+
+    Links are signed and expire, like S3 pre-signed URLs. FileResponse answers Range requests, so
+    browsers and download managers can resume and seek.
+    """
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="File serving is only available with local storage")
+
+    if not storage.verify(object_name, expires, filename, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+
+    try:
+        path = storage.path_for(object_name)
+    except YouTubeDownloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not await storage.exists(object_name):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return FileResponse(path, filename=filename or None)
@@ -1,27 +1,119 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import hashlib
+import json
+import math
 
-from ..core.exceptions import YouTubeDownloadError
-from ..schemas.youtube_schema import FormatResponse, VideoRequest, AudioRequest, FormatRequest
-from ..services.youtube_service import YouTubeService
-from ..utils.validator import validate_youtube_url
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..core.exceptions import YouTubeDownloadError, JobQueueFullError, JobNotFoundError, RateLimitExceededError
+from ..core.config_settings import settings
+from ..dependencies import Services, get_services
+from ..models.youtube import AUDIO_FORMATS, AUDIO_QUALITY_TIERS
+from ..schemas.youtube_schema import (FormatResponse, VideoRequest, AudioRequest, FormatRequest, JobRequest,
+                                      JobResponse, JobStatus, JobType, BatchRequest, DownloadTuning)
+from ..services.job_service import Job
+from ..services.youtube_service import external_downloader_allowed
+from ..utils.rate_limit import RateLimiter
+from ..utils.validator import validate_youtube_url, validate_youtube_playlist_url, validate_video_id
 
 yt_router = APIRouter(
     prefix="/youtube",
     tags=["YouTube"]
 )
-youtube_service = YouTubeService()
+download_limiter = RateLimiter(settings.RATE_LIMIT_DOWNLOADS_PER_MINUTE / 60, settings.RATE_LIMIT_DOWNLOAD_BURST)
+request_limiter = RateLimiter(settings.RATE_LIMIT_REQUESTS_PER_MINUTE / 60, settings.RATE_LIMIT_REQUEST_BURST)
 
 
-@yt_router.post("/formats")
-async def get_formats(request: FormatRequest) -> dict:
+def _api_key_id(api_key: str) -> str:
+    # API keys are never kept in memory or shown in metrics as-is.
+    return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+CLIENT_WEIGHTS = {_api_key_id(api_key): weight for api_key, weight in settings.CLIENT_WEIGHTS.items()}
+
+
+def _client_of(request: Request) -> str:
+    """Identify the caller by its API key if it is a configured one, or else by its IP address"""
+    # Unknown keys are ignored: otherwise a fresh random key per request would get a fresh bucket each time.
+    api_key = request.headers.get("X-API-Key")
+    if api_key and _api_key_id(api_key) in CLIENT_WEIGHTS:
+        return _api_key_id(api_key)
+
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR and forwarded_for:
+        return "ip:" + forwarded_for.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def _rate_limit(limiter: RateLimiter):
+    """Dependency that charges the caller one token from limiter and returns its client ID"""
+    def dependency(request: Request) -> str:
+        client = _client_of(request)
+        if settings.RATE_LIMIT_ENABLED:
+            retry_after = limiter.acquire(client)
+            if retry_after:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests. Please slow down.",
+                    headers={"Retry-After": str(math.ceil(retry_after))}
+                )
+        return client
+    return dependency
+
+
+def _check_audio_options(audio_format: str, quality: Optional[str]) -> None:
+    """Reject unsupported audio formats and quality tiers before anything is queued"""
+    if audio_format not in AUDIO_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid audio format. Available formats: {', '.join(AUDIO_FORMATS)}"
+        )
+    if (quality or "best") not in AUDIO_QUALITY_TIERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid audio quality. Available qualities: {', '.join(AUDIO_QUALITY_TIERS)}"
+        )
+
+
+def _check_tuning(tuning: Optional[DownloadTuning]) -> None:
+    """Reject external downloaders the server does not allow before anything is queued"""
+    if tuning and tuning.external_downloader and not external_downloader_allowed(tuning.external_downloader):
+        raise HTTPException(
+            status_code=400,
+            detail=f"External downloader '{tuning.external_downloader}' is not allowed on this server"
+        )
+
+
+async def _submit_job(services: Services, job_type: JobType, params: dict, client: str = None) -> Job:
+    """Queue a video or audio download on the worker pool on behalf of client"""
     try:
-        if not validate_youtube_url(request.url):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid YouTube URL. Please provide a valid YouTube URL."
-            )
+        return await services.jobs.submit(job_type, params, client, CLIENT_WEIGHTS.get(client, 1))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RateLimitExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
 
-        formats = await youtube_service.get_formats(request.url)
+async def _wait_for_result(job: Job) -> dict:
+    await job.wait()
+    if job.status == JobStatus.FAILED:
+        if job.error_kind == "download":
+            raise YouTubeDownloadError(job.error)
+        # Anything else (a crashed worker, a storage outage, ...) is a server error, not a bad request.
+        raise HTTPException(status_code=500, detail=f"An error occurred: {job.error}")
+    if job.status == JobStatus.CANCELLED:
+        raise YouTubeDownloadError("The download was cancelled")
+    return job.result
+
+
+async def _lookup_formats(services: Services, url: str) -> Tuple[dict, str]:
+    """Formats of a video and their ETag, from the server-side cache shared by both /formats endpoints"""
+    try:
+        formats, etag = await services.youtube.get_formats_with_etag(url)
 
         if not formats["video_formats"] and not formats["audio_formats"]:
             raise HTTPException(
@@ -29,8 +121,10 @@ async def get_formats(request: FormatRequest) -> dict:
                 detail="No formats found for this video. The video might be private or deleted."
             )
 
-        return formats
+        return formats, etag
 
+    except HTTPException:
+        raise
     except YouTubeDownloadError as e:
         raise HTTPException(
             status_code=400,
@@ -42,17 +136,63 @@ async def get_formats(request: FormatRequest) -> dict:
             detail=f"An error occurred: {str(e)}"
         )
 
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag (RFC 9110), as proxies may weaken ETags"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+@yt_router.get("/formats/{video_id}", response_model=FormatResponse)
+async def get_formats_by_id(video_id: str, request: Request, client: str = Depends(_rate_limit(request_limiter)),
+                            services: Services = Depends(get_services)) -> Response:
+    """
+    Cacheable variant of POST /formats, keyed by video ID.
+
+    Responses carry an ETag and a Cache-Control max-age, so browsers, CDNs and reverse proxies can reuse
+    them and revalidate with If-None-Match, which is answered with 304 while the formats are unchanged.
+    """
+    if not validate_video_id(video_id):
+        raise HTTPException(status_code=400, detail="Invalid YouTube video ID")
+
+    formats, etag = await _lookup_formats(services, f"https://www.youtube.com/watch?v={video_id}")
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={settings.FORMATS_CACHE_MAX_AGE}"}
+    if _etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(formats, headers=headers)
+
+
+@yt_router.post("/formats")
+async def get_formats(request: FormatRequest, response: Response, client: str = Depends(_rate_limit(request_limiter)),
+                      services: Services = Depends(get_services)) -> dict:
+    if not validate_youtube_url(request.url):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid YouTube URL. Please provide a valid YouTube URL."
+        )
+
+    formats, etag = await _lookup_formats(services, request.url)
+    response.headers["ETag"] = etag
+    return formats
+
+
 @yt_router.post("/download/video")
-async def download_video(request: VideoRequest):
+async def download_video(request: VideoRequest, client: str = Depends(_rate_limit(download_limiter)),
+                         services: Services = Depends(get_services)):
     try:
         if not validate_youtube_url(request.url):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid YouTube URL"
             )
+        _check_tuning(request.tuning)
 
         # First get available formats to validate the request
-        formats = await youtube_service.get_formats(request.url)
+        formats = await services.youtube.get_formats(request.url)
 
         # Validate quality
         if request.quality not in formats['available_qualities']:
@@ -68,14 +208,11 @@ async def download_video(request: VideoRequest):
                 detail=f"Invalid format. Available formats: {', '.join(formats['video_formats'])}"
             )
 
-        result = await youtube_service.download_video(
-            url=request.url,
-            quality=request.quality,
-            output_format=request.format
-        )
-
-        return result
+        job = await _submit_job(services, JobType.VIDEO, request.model_dump(), client)
+        return await _wait_for_result(job)
 
+    except HTTPException:
+        raise
     except YouTubeDownloadError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -83,12 +220,122 @@ async def download_video(request: VideoRequest):
 
 
 @yt_router.post("/download/audio")
-async def download_audio(request: AudioRequest):
+async def download_audio(request: AudioRequest, client: str = Depends(_rate_limit(download_limiter)),
+                         services: Services = Depends(get_services)):
     if not validate_youtube_url(request.url):
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    _check_audio_options(request.format, request.quality)
+    _check_tuning(request.tuning)
+
+    job = await _submit_job(services, JobType.AUDIO, request.model_dump(), client)
+    try:
+        return await _wait_for_result(job)
+    except YouTubeDownloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@yt_router.post("/download/batch")
+async def download_batch(request: BatchRequest, client: str = Depends(_rate_limit(download_limiter)),
+                         services: Services = Depends(get_services)):
+    """
+    Download every entry of a playlist, channel or URL list.
+
+    Results are streamed back as newline-delimited JSON as each entry finishes. Submitting the same
+    request again (or passing its batch_id) resumes it, skipping entries that already completed.
+    """
+    if request.url and not (validate_youtube_playlist_url(request.url) or validate_youtube_url(request.url)):
+        raise HTTPException(status_code=400, detail="Invalid YouTube playlist or channel URL")
+    if request.type == JobType.AUDIO:
+        _check_audio_options(request.format, request.quality)
+    _check_tuning(request.tuning)
+
+    if request.urls:
+        if len(request.urls) > settings.BATCH_MAX_ENTRIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A batch can contain at most {settings.BATCH_MAX_ENTRIES} URLs"
+            )
+        invalid_urls = [url for url in request.urls if not validate_youtube_url(url)]
+        if invalid_urls:
+            raise HTTPException(status_code=400, detail=f"Invalid YouTube URLs: {', '.join(invalid_urls)}")
+
+    batch, queue = services.batches.start(request, client, CLIENT_WEIGHTS.get(client, 1))
+
+    async def ndjson_stream():
+        async for event in services.batches.events(batch, queue):
+            yield json.dumps(jsonable_encoder(event)) + "\n"
 
-    return await youtube_service.download_audio(
-        url=request.url,
-        audio_format=request.format,
-        audio_quality="0"
-    )
\ No newline at end of file
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@yt_router.get("/download/batch/{batch_id}")
+async def get_batch(batch_id: str, services: Services = Depends(get_services)) -> dict:
+    state = services.batches.get(batch_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' was not found")
+    return state
+
+
+@yt_router.post("/jobs", status_code=202)
+async def create_job(request: JobRequest, client: str = Depends(_rate_limit(download_limiter)),
+                     services: Services = Depends(get_services)) -> JobResponse:
+    if not validate_youtube_url(request.url):
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+
+    if request.type == JobType.VIDEO and not request.quality:
+        raise HTTPException(status_code=400, detail="Quality is required for video jobs")
+    if request.type == JobType.AUDIO:
+        _check_audio_options(request.format, request.quality)
+    _check_tuning(request.tuning)
+
+    job = await _submit_job(services, request.type, request.model_dump(exclude={"type"}), client)
+    return JobResponse(**job.to_dict())
+
+
+@yt_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, services: Services = Depends(get_services)) -> JobResponse:
+    try:
+        return JobResponse(**(await services.jobs.get(job_id)).to_dict())
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@yt_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, services: Services = Depends(get_services)):
+    """Stream status and progress updates for a job as Server-Sent Events until it finishes"""
+    try:
+        job = await services.jobs.get(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    def format_event(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+    async def event_stream():
+        queue = job.subscribe()
+        try:
+            yield format_event("status", job.to_dict())
+            while not job.is_finished or not queue.empty():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection.
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@yt_router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, services: Services = Depends(get_services)) -> JobResponse:
+    try:
+        return JobResponse(**(await services.jobs.cancel(job_id)).to_dict())
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
\ No newline at end of file
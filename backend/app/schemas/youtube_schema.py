@@ -1,7 +1,22 @@
-from typing import List, Dict
-from pydantic import BaseModel, Field
+from datetime import datetime
+from enum import Enum
+from typing import List, Dict, Optional, Any
+from pydantic import BaseModel, Field, model_validator
 
 
+class DownloadTuning(BaseModel):
+    concurrent_fragments: Optional[int] = Field(None, ge=1,
+                                                description="Number of DASH/HLS fragments fetched in parallel")
+    http_chunk_size: Optional[int] = Field(None, ge=1024, description="Size in bytes of each HTTP range request")
+    buffer_size: Optional[int] = Field(None, ge=1024, description="Download buffer size in bytes")
+    rate_limit: Optional[int] = Field(None, ge=1024, description="Maximum download rate in bytes per second")
+    external_downloader: Optional[str] = Field(None,
+                                               description="External downloader to use (e.g. aria2c), or 'native'")
+
+def _check_clip(start: Optional[float], end: Optional[float]) -> None:
+    if start is not None and end is not None and end <= start:
+        raise ValueError("Clip 'end' must be after 'start'")
+
 class FormatRequest(BaseModel):
     url: str = Field(..., description="YouTube video URL")
 
@@ -9,14 +24,92 @@ class VideoRequest(BaseModel):
     url: str = Field(..., description="YouTube video URL")
     quality: str = Field(..., description="Video quality (e.g., 1080p, 720p)")
     format: str = Field(..., description="Video format (mp4, webm, mkv)")
+    start: Optional[float] = Field(None, ge=0, description="Clip start in seconds (default: start of the video)")
+    end: Optional[float] = Field(None, gt=0, description="Clip end in seconds (default: end of the video)")
+    tuning: Optional[DownloadTuning] = Field(None, description="Download tuning, capped by server policy")
+
+    @model_validator(mode="after")
+    def check_clip(self) -> "VideoRequest":
+        _check_clip(self.start, self.end)
+        return self
 
 class AudioRequest(BaseModel):
     url: str = Field(..., description="YouTube video URL")
     format: str = Field(..., description="Audio format (mp3, m4a, etc.)")
-    # quality: str = Field("0", description="Audio quality (0-9, 0 is best)")
+    quality: str = Field("best", description="Audio quality tier (low, medium, high or best)")
+    start: Optional[float] = Field(None, ge=0, description="Clip start in seconds (default: start of the audio)")
+    end: Optional[float] = Field(None, gt=0, description="Clip end in seconds (default: end of the audio)")
+    tuning: Optional[DownloadTuning] = Field(None, description="Download tuning, capped by server policy")
+
+    @model_validator(mode="after")
+    def check_clip(self) -> "AudioRequest":
+        _check_clip(self.start, self.end)
+        return self
 
 class FormatResponse(BaseModel):
     available_qualities: Dict[str, str]
     video_formats: List[str]
     audio_formats: List[str]
+    audio_qualities: List[str] = Field([], description="Audio quality tiers accepted by /download/audio")
+    estimated_sizes: Dict[str, Optional[int]] = Field({}, description="Approximate download size in bytes per quality")
+
+class JobType(str, Enum):
+    VIDEO = "video"
+    AUDIO = "audio"
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    UPLOADING = "uploading"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class JobRequest(BaseModel):
+    type: JobType = Field(..., description="Kind of download (video or audio)")
+    url: str = Field(..., description="YouTube video URL")
+    format: str = Field(..., description="Output format (mp4, webm, mkv for video; mp3, m4a, etc. for audio)")
+    quality: Optional[str] = Field(None, description="Video quality (e.g., 1080p, 720p), required for video jobs, "
+                                                     "or audio quality tier (low, medium, high, best)")
+    start: Optional[float] = Field(None, ge=0, description="Clip start in seconds (default: start of the media)")
+    end: Optional[float] = Field(None, gt=0, description="Clip end in seconds (default: end of the media)")
+    tuning: Optional[DownloadTuning] = Field(None, description="Download tuning, capped by server policy")
+
+    @model_validator(mode="after")
+    def check_clip(self) -> "JobRequest":
+        _check_clip(self.start, self.end)
+        return self
+
+class BatchRequest(BaseModel):
+    type: JobType = Field(..., description="Kind of download (video or audio)")
+    url: Optional[str] = Field(None, description="YouTube playlist or channel URL")
+    urls: Optional[List[str]] = Field(None, description="List of YouTube video URLs")
+    format: str = Field(..., description="Output format (mp4, webm, mkv for video; mp3, m4a, etc. for audio)")
+    quality: Optional[str] = Field(None, description="Video quality (e.g., 1080p, 720p), required for video batches, "
+                                                     "or audio quality tier (low, medium, high, best)")
+    batch_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$",
+                                    description="ID of a previous batch to resume. Derived from the request if omitted")
+    max_parallel: Optional[int] = Field(None, ge=1, description="Maximum number of entries downloaded at the same time")
+    tuning: Optional[DownloadTuning] = Field(None, description="Download tuning, capped by server policy")
+
+    @model_validator(mode="after")
+    def check_source(self) -> "BatchRequest":
+        if bool(self.url) == bool(self.urls):
+            raise ValueError("Provide either a playlist/channel 'url' or a list of 'urls'")
+        if self.type == JobType.VIDEO and not self.quality:
+            raise ValueError("Quality is required for video batches")
+        return self
 
+class JobResponse(BaseModel):
+    job_id: str
+    type: JobType
+    status: JobStatus
+    params: Dict[str, Any]
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    error_kind: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    progress: Optional[Dict[str, Any]] = None
+    timings: Dict[str, float] = {}
@@ -1,89 +1,298 @@
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
 
 import boto3
-from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError
+from loguru import logger
 
 from ..core.config_settings import settings
+from ..utils.retry import RetryPolicy
+
+# Most parts S3 accepts in a single multipart upload.
+MAX_PARTS = 10000
 
 
 class AwsService:
+    """
+    Asynchronous wrapper around a pooled boto3 S3 client.
+
+    The client is created on first use, so importing the service never talks to S3. Blocking boto3
+    calls run on a dedicated thread pool sized to the HTTP connection pool, which keeps them off the
+    event loop without ever queueing a request behind an exhausted connection pool.
+    """
 
     def __init__(self):
         self.aws_access_key = settings.AWS_ACCESS_KEY_ID_VALUE
         self.aws_secret_key = settings.AWS_SECRET_ACCESS_KEY_VALUE
         self.bucket_name = settings.S3_BUCKET_NAME
-        # Explicitly pass credentials to boto3
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=self.aws_access_key,
-            aws_secret_access_key=self.aws_secret_key
-        )
-        self.is_s3_connected()
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=settings.S3_MAX_POOL_CONNECTIONS, thread_name_prefix="s3")
+
+    @property
+    def s3_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # Explicitly pass credentials to boto3. A private session keeps client creation thread-safe.
+                    self._client = boto3.session.Session().client(
+                        's3',
+                        aws_access_key_id=self.aws_access_key,
+                        aws_secret_access_key=self.aws_secret_key,
+                        region_name=settings.AWS_REGION,
+                        endpoint_url=settings.S3_ENDPOINT_URL,
+                        config=Config(
+                            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                            connect_timeout=settings.S3_CONNECT_TIMEOUT,
+                            read_timeout=settings.S3_READ_TIMEOUT,
+                            retries={'max_attempts': settings.S3_MAX_ATTEMPTS, 'mode': 'standard'},
+                        )
+                    )
+        return self._client
 
-    # Upload the file
-    def is_s3_connected(self):
+    async def _run(self, fn, *args, **kwargs):
+        """Run a blocking boto3 call on the S3 thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def is_s3_connected(self):
         """
-            Check if the AWS S3 service is connected by attempting to list the objects in the specified bucket.
+            Check if the AWS S3 service is connected by checking that the configured bucket is reachable.
 
-            :param bucket_name: Name of the S3 bucket to check connectivity.
             :return: True if connected, False otherwise.
             """
         try:
-            # Try to access the bucket by listing its contents (limited to 1 item)
-            self.s3_client.list_objects_v2(Bucket=self.bucket_name, MaxKeys=1)
+            await self._run(lambda: self.s3_client.head_bucket(Bucket=self.bucket_name))
             return True
         except NoCredentialsError:
-            print("AWS credentials not found.")
+            logger.error("AWS credentials not found.")
         except PartialCredentialsError:
-            print("Incomplete AWS credentials configuration.")
+            logger.error("Incomplete AWS credentials configuration.")
         except ClientError as e:
             error_code = e.response.get("Error", {}).get("Code", "Unknown")
-            print(f"Failed to connect to S3. Error: {error_code}")
+            logger.error(f"Failed to connect to S3. Error: {error_code}")
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            logger.error(f"An unexpected error occurred: {e}")
 
         return False
 
-    def upload_file(self, file_name, object_name=None):
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def upload_file(self, file_name, object_name=None, callback=None, retry=None):
         """Upload a file to an S3 bucket
 
+        Files larger than one part go up as a multipart upload whose parts are read straight from the
+        file, up to S3_MULTIPART_CONCURRENCY at a time. A failed attempt keeps the parts S3 already
+        acknowledged, so a retry only sends the missing ones instead of the whole file.
+
         :param file_name: File to upload
-        :param bucket: Bucket to upload to
         :param object_name: S3 object name. If not specified then file_name is used
-        :return: True if file was uploaded, else False
+        :param callback: Optional callable invoked with the number of bytes sent for each finished part
+        :param retry: Optional RetryPolicy for transient failures (throttling, dropped connections)
+        :return: Pre-signed URL of the uploaded object
         """
 
         # If S3 object_name was not specified, use file_name
         if object_name is None:
             object_name = os.path.basename(file_name)
+        retry = retry or RetryPolicy("upload", 1)
+
+        size = os.path.getsize(file_name)
+        # S3 allows at most MAX_PARTS parts per upload.
+        part_size = max(settings.S3_MULTIPART_PART_SIZE, -(-size // MAX_PARTS))
+        if size <= part_size:
+            await retry.run(lambda: self._run(self._put_file, file_name, object_name, callback))
+        else:
+            await self._upload_file_parts(file_name, object_name, size, part_size, callback, retry)
+
+        return await self.create_presigned_url(object_name, 900)
+
+    def _put_file(self, file_name, object_name, callback=None):
+        with open(file_name, "rb") as fh:
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=object_name, Body=fh)
+        if callback is not None:
+            callback(os.path.getsize(file_name))
+
+    def _upload_file_part(self, file_name, object_name, upload_id, part_number, part_size):
+        with open(file_name, "rb") as fh:
+            fh.seek((part_number - 1) * part_size)
+            body = fh.read(part_size)
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=object_name, UploadId=upload_id, PartNumber=part_number, Body=body
+        )
+        return response["ETag"], len(body)
+
+    async def _upload_file_parts(self, file_name, object_name, size, part_size, callback, retry):
+        upload = await retry.run(lambda: self._run(
+            self.s3_client.create_multipart_upload, Bucket=self.bucket_name, Key=object_name
+        ))
+        upload_id = upload["UploadId"]
+        part_count = -(-size // part_size)
+        # ETags of the parts S3 has acknowledged, kept across attempts.
+        completed = {}
+        slots = asyncio.Semaphore(settings.S3_MULTIPART_CONCURRENCY)
+
+        async def upload_part(part_number):
+            async with slots:
+                etag, sent = await self._run(
+                    self._upload_file_part, file_name, object_name, upload_id, part_number, part_size
+                )
+            completed[part_number] = etag
+            if callback is not None:
+                callback(sent)
+
+        async def attempt():
+            missing = [number for number in range(1, part_count + 1) if number not in completed]
+            if len(missing) < part_count:
+                logger.info(f"Resuming upload of {object_name}: {part_count - len(missing)}/{part_count} parts done")
+            # Let every part in flight finish before failing the attempt, so a retry keeps all of them.
+            results = await asyncio.gather(*(upload_part(number) for number in missing), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            await self._run(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name, Key=object_name, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": number, "ETag": completed[number]}
+                                           for number in sorted(completed)]}
+            )
+
+        try:
+            await retry.run(attempt)
+        except BaseException:
+            try:
+                await self._run(
+                    self.s3_client.abort_multipart_upload,
+                    Bucket=self.bucket_name, Key=object_name, UploadId=upload_id
+                )
+            except Exception as e:
+                logger.warning(f"Failed to abort the upload of {object_name}: {e}")
+            raise
+
+    async def upload_stream(self, reader, object_name, part_size, max_concurrency=4, callback=None, verify=None,
+                            retry=None):
+        """Upload a byte stream to S3 as a multipart upload while it is still being produced
+
+        Parts of part_size bytes are read from the stream and up to max_concurrency of them are
+        uploaded in parallel, so memory use stays bounded at roughly part_size * (max_concurrency + 1).
+
+        :param reader: asyncio.StreamReader producing the object bytes (e.g. the stdout of ffmpeg)
+        :param object_name: S3 object name
+        :param part_size: Size of each part in bytes (S3 requires at least 5 MiB for all but the last part)
+        :param max_concurrency: Maximum number of parts uploaded at the same time
+        :param callback: Optional callable invoked with the number of bytes sent for each finished part
+        :param verify: Optional coroutine function awaited once the stream ends and before the upload is
+                       completed. Raising from it aborts the upload (e.g. when the producer process failed).
+        :param retry: Optional RetryPolicy for the individual parts, whose bodies are still in memory
+        :return: Pre-signed URL of the uploaded object
+        """
+        retry = retry or RetryPolicy("upload", 1)
+        upload = await self._run(
+            self.s3_client.create_multipart_upload, Bucket=self.bucket_name, Key=object_name
+        )
+        upload_id = upload["UploadId"]
+        slots = asyncio.Semaphore(max_concurrency)
+        tasks = []
+
+        async def upload_part(part_number, body):
+            try:
+                response = await retry.run(lambda: self._run(
+                    self.s3_client.upload_part,
+                    Bucket=self.bucket_name, Key=object_name, UploadId=upload_id,
+                    PartNumber=part_number, Body=body
+                ))
+                if callback is not None:
+                    callback(len(body))
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                slots.release()
 
         try:
-            response = self.s3_client.upload_file(file_name, self.bucket_name, object_name)
+            part_number = 1
+            while True:
+                try:
+                    body = await reader.readexactly(part_size)
+                except asyncio.IncompleteReadError as e:
+                    body = e.partial
+                # Always send at least one part, even for an empty stream.
+                if not body and part_number > 1:
+                    break
+
+                await slots.acquire()
+                tasks.append(asyncio.create_task(upload_part(part_number, body)))
+                part_number += 1
+                if len(body) < part_size:
+                    break
 
-            if response is None:
-                pre_signed_url = self.create_presigned_url(object_name, 900)
-                return pre_signed_url
+            parts = await asyncio.gather(*tasks)
+            if verify is not None:
+                await verify()
+            await self._run(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name, Key=object_name, UploadId=upload_id,
+                MultipartUpload={"Parts": list(parts)}
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._run(
+                self.s3_client.abort_multipart_upload,
+                Bucket=self.bucket_name, Key=object_name, UploadId=upload_id
+            )
+            raise
 
+        return await self.create_presigned_url(object_name, 900)
+
+    async def object_exists(self, object_name):
+        """Check whether an object is already stored in the bucket
+
+        :param object_name: S3 object name
+        :return: True if the object exists, else False
+        """
+        try:
+            await self._run(self.s3_client.head_object, Bucket=self.bucket_name, Key=object_name)
+            return True
         except ClientError as e:
-            # logging.error(e)
-            raise ClientError(f"Failed to upload the file: {e}")
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
 
-    def create_presigned_url(self, object_name, expiration=900):
+    async def create_presigned_url(self, object_name, expiration=900, filename=None):
         """Generate a pre-signed URL to share an S3 object
 
+        Signing happens locally and needs no request to S3; only the very first call, which creates
+        the client, is moved off the event loop.
+
         :param object_name: string
         :param expiration: Time in seconds for the pre-signed URL to remain valid
-        :return: Pre-signed URL as string. If error, returns None.
+        :param filename: Optional file name the browser should save the object as
+        :return: Pre-signed URL as string. Signing errors are raised as the original botocore error.
         """
+        params = {'Bucket': self.bucket_name, 'Key': object_name}
+        if filename:
+            ascii_name = filename.encode('ascii', 'ignore').decode().replace('"', '') or os.path.basename(object_name)
+            params['ResponseContentDisposition'] = (
+                f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+            )
+
+        if self._client is None:
+            await self._run(lambda: self.s3_client)
 
         try:
             response = self.s3_client.generate_presigned_url('get_object',
-                                                        Params={'Bucket': self.bucket_name,
-                                                                'Key': object_name},
+                                                        Params=params,
                                                         ExpiresIn=expiration)
-        except ClientError as e:
-            # logging.error(e)
-            raise ClientError(f"Failed to generate pre-signed url: {e}")
+        except (BotoCoreError, ClientError) as e:
+            # Re-raised as is, so callers (and the retry classification) see the actual botocore error.
+            logger.error(f"Failed to generate pre-signed url for {object_name}: {e}")
+            raise
 
         # The response contains the pre-signed URL
         return response
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .job_service import Job
+from .storage_service import StorageBackend
+from .ytdlp_engine import YtDlpEngine
+from ..core.config_settings import settings
+from ..core.exceptions import JobQueueFullError, RateLimitExceededError
+from ..schemas.youtube_schema import BatchRequest, JobStatus, JobType
+from ..utils.validator import extract_video_id
+
+
+class Batch:
+    """
+    Progress of one playlist/channel/URL-list download, checkpointed to disk after every entry.
+    """
+
+    def __init__(self, batch_id: str, request: Dict[str, Any], state_dir: str):
+        self.batch_id = batch_id
+        self.request = request
+        self.path = os.path.join(state_dir, f"{batch_id}.json")
+        # Client-supplied IDs must not escape the state directory.
+        state_dir = os.path.abspath(state_dir)
+        if os.path.commonpath([state_dir, os.path.abspath(self.path)]) != state_dir:
+            raise ValueError(f"Invalid batch ID '{batch_id}'")
+        self.completed: Dict[str, Dict] = {}
+        self.failed: Dict[str, str] = {}
+        self.skipped = 0
+        self.finished = False
+        self.error: Optional[str] = None
+        self._subscribers: List[asyncio.Queue] = []
+
+    def load(self) -> None:
+        """Restore completed and failed entries from a previous run of the same batch"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as fh:
+            state = json.load(fh)
+        self.completed = state.get("completed", {})
+        self.failed = state.get("failed", {})
+
+    def save(self) -> None:
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint.
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as fh:
+            json.dump(self.to_dict(), fh)
+        os.replace(temp_path, self.path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batch_id": self.batch_id,
+            "request": self.request,
+            "finished": self.finished,
+            "error": self.error,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "event": "summary",
+            "batch_id": self.batch_id,
+            "completed": len(self.completed),
+            "failed": len(self.failed),
+            "skipped": self.skipped,
+            "error": self.error,
+        }
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+
+class BatchService:
+    """
+    Expands playlists and channels lazily and downloads their entries with bounded parallelism.
+
+    Every entry is a regular download job, so batches share the job worker pool with single downloads.
+    """
+
+    def __init__(self, engine: YtDlpEngine, submit_job: Callable[..., Awaitable[Job]], storage: StorageBackend,
+                 state_dir: str = None):
+        self.engine = engine
+        self.submit_job = submit_job
+        self.storage = storage
+        self.state_dir = state_dir or settings.BATCH_STATE_DIR
+        self._running: Dict[str, Batch] = {}
+
+    @staticmethod
+    def batch_id_for(request: BatchRequest) -> str:
+        """Batch IDs are derived from the request, so resubmitting a batch resumes it"""
+        if request.batch_id:
+            return request.batch_id
+        source = json.dumps(request.model_dump(exclude={"batch_id", "max_parallel", "tuning"}), sort_keys=True)
+        return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if batch_id in self._running:
+            return self._running[batch_id].to_dict()
+
+        try:
+            batch = Batch(batch_id, {}, self.state_dir)
+        except ValueError:
+            return None
+        if not os.path.exists(batch.path):
+            return None
+        with open(batch.path, "r") as fh:
+            return json.load(fh)
+
+    def start(self, request: BatchRequest, client: str = None, weight: int = 1) -> Tuple[Batch, asyncio.Queue]:
+        """Start (or resume) a batch on behalf of client, or attach to it if it is already running"""
+        batch_id = self.batch_id_for(request)
+        batch = self._running.get(batch_id)
+        if batch is not None:
+            return batch, batch.subscribe()
+
+        batch = Batch(batch_id, request.model_dump(mode="json"), self.state_dir)
+        batch.load()
+        queue = batch.subscribe()
+        self._running[batch_id] = batch
+
+        task = asyncio.create_task(self._run(batch, request, client, weight))
+        task.add_done_callback(lambda _: self._running.pop(batch_id, None))
+        return batch, queue
+
+    async def events(self, batch: Batch, queue: asyncio.Queue) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a batch's events as they happen, ending with its summary"""
+        try:
+            yield {
+                "event": "batch",
+                "batch_id": batch.batch_id,
+                "resumed_completed": len(batch.completed),
+            }
+            while True:
+                event = await queue.get()
+                yield event
+                if event["event"] == "summary":
+                    break
+        finally:
+            batch.unsubscribe(queue)
+
+    async def _run(self, batch: Batch, request: BatchRequest, client: str = None, weight: int = 1) -> None:
+        max_parallel = min(request.max_parallel or settings.BATCH_MAX_PARALLEL, settings.BATCH_MAX_PARALLEL)
+        slots = asyncio.Semaphore(max_parallel)
+        tasks = []
+
+        try:
+            index = 0
+            # Entries are pulled only when a slot is free, so long playlists are paged in as needed.
+            async for video_id, url in self._entries(request):
+                if index >= settings.BATCH_MAX_ENTRIES:
+                    batch.error = f"Batch truncated to {settings.BATCH_MAX_ENTRIES} entries"
+                    break
+                index += 1
+
+                result = await self._stored_result(batch.completed.get(video_id))
+                if result is not None:
+                    batch.skipped += 1
+                    batch.publish({
+                        "event": "item", "index": index, "video_id": video_id, "url": url,
+                        "status": "skipped", "result": result,
+                    })
+                    continue
+
+                await slots.acquire()
+                tasks.append(asyncio.create_task(
+                    self._download(batch, request, index, video_id, url, slots, client, weight)
+                ))
+
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            batch.error = str(e)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            batch.finished = batch.error is None
+            batch.save()
+            batch.publish(batch.summary())
+
+    async def _stored_result(self, result: Optional[Dict]) -> Optional[Dict]:
+        """
+        A completed entry's result with a freshly signed link, as the one saved with it has likely expired.
+
+        Returns None when the entry has to be downloaded again: its object is gone, or the checkpoint
+        predates results carrying their object key.
+        """
+        if not result or not result.get("object_key") or not await self.storage.exists(result["object_key"]):
+            return None
+        url = await self.storage.get_url(result["object_key"], filename=result.get("filename"))
+        return dict(result, message=url)
+
+    async def _entries(self, request: BatchRequest) -> AsyncIterator[Tuple[str, str]]:
+        seen = set()
+        if request.urls:
+            sources = self._from_urls(request.urls)
+        else:
+            sources = self._expand(request.url)
+
+        async for video_id, url in sources:
+            if video_id not in seen:
+                seen.add(video_id)
+                yield video_id, url
+
+    @staticmethod
+    async def _from_urls(urls: List[str]) -> AsyncIterator[Tuple[str, str]]:
+        for url in urls:
+            video_id = extract_video_id(url)
+            if video_id:
+                yield video_id, url
+
+    async def _expand(self, url: str, depth: int = 0) -> AsyncIterator[Tuple[str, str]]:
+        async for entry in self.engine.iter_entries(url):
+            entry_url = entry.get('url') or entry.get('webpage_url')
+
+            # Channel pages list their tabs (videos, shorts, ...) as nested playlists.
+            if entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab':
+                if depth < 2 and entry_url:
+                    async for nested in self._expand(entry_url, depth + 1):
+                        yield nested
+                continue
+
+            video_id = entry.get('id') or extract_video_id(entry_url or "")
+            if video_id:
+                yield video_id, entry_url or f"https://www.youtube.com/watch?v={video_id}"
+
+    async def _submit(self, job_type: JobType, params: Dict, client: str = None, weight: int = 1) -> Job:
+        while True:
+            try:
+                return await self.submit_job(job_type, params, client, weight)
+            except JobQueueFullError:
+                await asyncio.sleep(1)
+            except RateLimitExceededError as e:
+                # Entries count against the client's job limit like single downloads, so a large
+                # batch waits for its own earlier entries instead of failing.
+                await asyncio.sleep(min(e.retry_after, 5))
+
+    async def _download(self, batch: Batch, request: BatchRequest, index: int, video_id: str, url: str,
+                        slots: asyncio.Semaphore, client: str = None, weight: int = 1) -> None:
+        event = {"event": "item", "index": index, "video_id": video_id, "url": url}
+        try:
+            params = {
+                "url": url,
+                "format": request.format,
+                "quality": request.quality,
+                "tuning": request.tuning.model_dump() if request.tuning else None,
+            }
+            job = await self._submit(request.type, params, client, weight)
+            event["job_id"] = job.job_id
+            await job.wait()
+
+            if job.status == JobStatus.DONE:
+                batch.completed[video_id] = job.result
+                batch.failed.pop(video_id, None)
+                event.update(status="done", result=job.result)
+            else:
+                batch.failed[video_id] = job.error or job.status.value
+                event.update(status="failed", error=batch.failed[video_id])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            batch.failed[video_id] = str(e)
+            event.update(status="failed", error=str(e))
+        finally:
+            slots.release()
+
+        batch.save()
+        batch.publish(event)
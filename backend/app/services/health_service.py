@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+from ..core.config_settings import settings
+
+# A check returns a short description on success and raises (or returns False) on failure.
+Check = Callable[[], Awaitable[Any]]
+
+
+class ReadinessProbe:
+    """
+    Checks the service's dependencies (S3, yt-dlp, ffmpeg, ...) in the background and caches the result.
+
+    Readiness requests only read the cached result, so they are cheap and never hang on a slow
+    dependency, and a dependency that is briefly unreachable at startup delays readiness instead of
+    crashing the process.
+    """
+
+    def __init__(self, checks: Dict[str, Check], interval: float = None, timeout: float = None):
+        self.checks = checks
+        self.interval = interval or settings.READINESS_INTERVAL
+        self.timeout = timeout or settings.READINESS_TIMEOUT
+        self.result: Dict[str, Any] = {"ready": False, "checked_at": None, "checks": {}}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.result["ready"]
+
+    async def _run_check(self, name: str, check: Check) -> Dict[str, Any]:
+        try:
+            detail = await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            return {"ok": False, "detail": f"timed out after {self.timeout}s"}
+        except Exception as e:
+            return {"ok": False, "detail": str(e)}
+        if detail is False:
+            return {"ok": False, "detail": "unavailable"}
+        return {"ok": True, "detail": None if detail is True else detail}
+
+    async def check(self) -> Dict[str, Any]:
+        """Run every check now and cache the result"""
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(name, self.checks[name]) for name in names))
+        checks = dict(zip(names, results))
+
+        ready = all(result["ok"] for result in results)
+        if ready != self.ready or self.result["checked_at"] is None:
+            failed = ", ".join(name for name, result in checks.items() if not result["ok"])
+            if ready:
+                logger.info("Service is ready")
+            else:
+                logger.warning(f"Service is not ready, failed checks: {failed}")
+
+        self.result = {"ready": ready, "checked_at": datetime.now(timezone.utc).isoformat(), "checks": checks}
+        return self.result
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._check_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _check_periodically(self) -> None:
+        while True:
+            await self.check()
+            # Recheck sooner while not ready, so the service becomes ready soon after its dependencies.
+            await asyncio.sleep(self.interval if self.ready else min(self.interval, 5))
@@ -0,0 +1,482 @@
+import asyncio
+import math
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+
+from .job_store import JobStore, create_job_store
+from ..core.config_settings import settings
+from ..core.metrics import JOBS
+from ..core.exceptions import JobNotFoundError, JobQueueFullError, RateLimitExceededError, YouTubeDownloadError
+from ..schemas.youtube_schema import JobStatus, JobType
+from ..utils.cache import TTLCache
+from ..utils.fair_queue import FairQueue
+
+
+class Job:
+    """
+    A single download job and its lifecycle state.
+    """
+
+    FINAL_STATES = (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+    # Minimum number of seconds between two published progress events of the same phase.
+    PROGRESS_INTERVAL = 0.25
+
+    def __init__(self, job_type: JobType, params: Dict[str, Any], runner: Callable[["Job"], Awaitable[Dict]] = None,
+                 client: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.type = job_type
+        self.params = params
+        self.client = client
+        self.status = JobStatus.QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # "download" for errors of the download itself (bad input, unavailable video, ...), "internal" otherwise.
+        self.error_kind: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.progress: Optional[Dict[str, Any]] = None
+        # Seconds spent in each pipeline stage (extract, download, upload, ...)
+        self.timings: Dict[str, float] = {}
+        # Jobs waiting on this job's download instead of running their own; they get its progress too.
+        self.followers: List["Job"] = []
+
+        self._runner = runner
+        self._task: Optional[asyncio.Task] = None
+        # Set when the job itself is cancelled, as opposed to the worker running it shutting down.
+        self._cancel_requested = False
+        self._done = asyncio.Event()
+        self._subscribers: List[asyncio.Queue] = []
+        self._last_progress_at = 0.0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINAL_STATES
+
+    def set_status(self, status: JobStatus) -> None:
+        if self.is_finished:
+            return
+        self.status = status
+        if status == JobStatus.RUNNING and self.started_at is None:
+            self.started_at = datetime.now(timezone.utc)
+        if status in self.FINAL_STATES:
+            self.finished_at = datetime.now(timezone.utc)
+            self._done.set()
+        self._publish("status", self.to_dict())
+
+    def add_timing(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 3)
+
+    def update_progress(self, progress: Dict[str, Any]) -> None:
+        """Record the latest progress report, publishing it to subscribers at a bounded rate"""
+        previous = self.progress or {}
+        self.progress = progress
+
+        now = time.monotonic()
+        phase_changed = ((previous.get("phase"), previous.get("status"))
+                         != (progress.get("phase"), progress.get("status")))
+        if phase_changed or now - self._last_progress_at >= self.PROGRESS_INTERVAL:
+            self._last_progress_at = now
+            self._publish("progress", progress)
+        for follower in self.followers:
+            follower.update_progress(progress)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self, event: str, data: Dict[str, Any]) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # Slow consumer: drop the oldest event rather than blocking the download.
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    async def wait(self) -> "Job":
+        await self._done.wait()
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "type": self.type,
+            "status": self.status,
+            "params": self.params,
+            "result": self.result,
+            "error": self.error,
+            "error_kind": self.error_kind,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "timings": self.timings,
+        }
+
+    def to_record(self, **extra: Any) -> Dict[str, Any]:
+        """JSON-serializable state of the job, as kept in a job store"""
+        return dict(jsonable_encoder(self.to_dict()), client=self.client, **extra)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], runner: Callable[["Job"], Awaitable[Dict]] = None) -> "Job":
+        job = cls(JobType(record["type"]), record["params"], runner, record.get("client"))
+        job.job_id = record["job_id"]
+        job.apply(record)
+        return job
+
+    def apply(self, record: Dict[str, Any]) -> None:
+        """Bring the job up to date with its record in a job store, notifying subscribers of changes"""
+        self.result = record.get("result")
+        self.error = record.get("error")
+        self.error_kind = record.get("error_kind")
+        self.timings = record.get("timings") or {}
+        if record.get("progress") and record["progress"] != self.progress:
+            self.update_progress(record["progress"])
+
+        status = JobStatus(record["status"])
+        if status != self.status:
+            self.set_status(status)
+        for name in ("created_at", "started_at", "finished_at"):
+            if record.get(name):
+                setattr(self, name, datetime.fromisoformat(record[name]))
+
+
+class JobManager:
+    """
+    Runs download jobs on a bounded pool of asyncio workers so HTTP handlers never wait on a download.
+
+    Queued jobs are served by weighted round-robin across clients, and submissions are refused with
+    RateLimitExceededError while a client has too many unfinished jobs or the server is at capacity.
+    Jobs live in this process only; see DistributedJobManager for sharing them between processes.
+    """
+
+    name = "memory"
+    # Assumed duration of a job until real ones have been measured, for Retry-After estimates.
+    INITIAL_JOB_SECONDS = 30.0
+
+    def __init__(self, runner: Callable[[Job], Awaitable[Dict]], max_workers: int = None,
+                 max_queue_size: int = None, retention: int = None):
+        self.runner = runner
+        self.max_workers = max_workers or settings.JOB_WORKERS
+        self.max_queue_size = max_queue_size or settings.JOB_QUEUE_MAX_SIZE
+        self._jobs = TTLCache(max_size=10000, ttl=retention or settings.JOB_RETENTION)
+        self._queue: Optional[FairQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._active = 0
+        self._running: Set[Job] = set()
+        self._client_jobs: Dict[str, int] = {}
+        self._average_job_seconds = self.INITIAL_JOB_SECONDS
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def active_workers(self) -> int:
+        return self._active
+
+    @property
+    def current_bandwidth(self) -> int:
+        """Bytes per second currently being downloaded by all running jobs"""
+        return sum(
+            (job.progress or {}).get("speed") or 0
+            for job in self._running
+            if (job.progress or {}).get("phase") == "download"
+        )
+
+    def client_jobs(self, client: str) -> int:
+        """Number of queued and running jobs submitted by client"""
+        return self._client_jobs.get(client, 0)
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a worker can take a new job"""
+        backlog = self.queue_depth + self._active
+        seconds = self._average_job_seconds * (backlog + 1) / self.max_workers
+        return max(1, min(600, math.ceil(seconds)))
+
+    def admit(self, client: str = None) -> None:
+        """Raise RateLimitExceededError when a new job from client should not be accepted now"""
+        if client is not None and self.client_jobs(client) >= settings.ADMISSION_MAX_JOBS_PER_CLIENT:
+            raise RateLimitExceededError(
+                f"Too many unfinished downloads (limit {settings.ADMISSION_MAX_JOBS_PER_CLIENT}). "
+                f"Please wait for some to finish.",
+                self.retry_after()
+            )
+        if self.queue_depth >= settings.ADMISSION_MAX_QUEUED_JOBS:
+            raise RateLimitExceededError("The server is busy. Please try again later.", self.retry_after())
+        if settings.ADMISSION_MAX_BANDWIDTH and self.current_bandwidth >= settings.ADMISSION_MAX_BANDWIDTH:
+            raise RateLimitExceededError("The server's download bandwidth is saturated. Please try again later.",
+                                         self.retry_after())
+
+    def start(self) -> None:
+        self._ensure_workers()
+
+    def _ensure_workers(self) -> None:
+        # Workers are started lazily so the manager can be created before the event loop exists.
+        if self._queue is None:
+            self._queue = FairQueue(maxsize=self.max_queue_size)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def submit(self, job_type: JobType, params: Dict[str, Any], client: str = None, weight: int = 1) -> Job:
+        """Queue a job on behalf of client and return immediately"""
+        self._ensure_workers()
+        self.admit(client)
+
+        job = Job(job_type, params, self.runner, client)
+        try:
+            self._queue.put_nowait(job, client, weight)
+        except asyncio.QueueFull:
+            raise JobQueueFullError("The download queue is full. Please try again later.")
+
+        self._client_jobs[client] = self._client_jobs.get(client, 0) + 1
+        self._jobs.set(job.job_id, job)
+        return job
+
+    async def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(f"Job '{job_id}' was not found")
+        return job
+
+    async def cancel(self, job_id: str) -> Job:
+        """Cancel a queued or running job. Finished jobs are returned unchanged."""
+        job = await self.get(job_id)
+        if job.is_finished:
+            return job
+
+        if job._task is not None:
+            job._cancel_requested = True
+            job._task.cancel()
+        else:
+            # Still queued: the worker skips it when it is dequeued.
+            job.set_status(JobStatus.CANCELLED)
+        return job
+
+    async def shutdown(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if not job.is_finished:
+                    await self._run(job)
+                    # Refresh the retention window from the moment the job finished.
+                    self._jobs.set(job.job_id, job)
+            finally:
+                remaining = self._client_jobs.get(job.client, 1) - 1
+                if remaining > 0:
+                    self._client_jobs[job.client] = remaining
+                else:
+                    self._client_jobs.pop(job.client, None)
+
+    async def _run(self, job: Job) -> None:
+        self._active += 1
+        self._running.add(job)
+        started = time.monotonic()
+        job.set_status(JobStatus.RUNNING)
+        job._task = asyncio.create_task(job._runner(job))
+        try:
+            job.result = await job._task
+            job.set_status(JobStatus.DONE)
+        except asyncio.CancelledError:
+            # Cancelling the worker also cancels the job task it awaits, so only the flag tells them apart.
+            job.set_status(JobStatus.CANCELLED)
+            if not job._cancel_requested:
+                # The worker itself is being cancelled (shutdown), not just the job.
+                job._task.cancel()
+                raise
+        except Exception as e:
+            job.error = str(e)
+            job.error_kind = "download" if isinstance(e, YouTubeDownloadError) else "internal"
+            job.set_status(JobStatus.FAILED)
+        finally:
+            self._active -= 1
+            self._running.discard(job)
+            if job.status == JobStatus.DONE:
+                # Moving average of job durations, used to estimate Retry-After.
+                self._average_job_seconds += 0.2 * (time.monotonic() - started - self._average_job_seconds)
+            JOBS.labels(type=job.type.value, status=job.status.value).inc()
+
+
+class DistributedJobManager(JobManager):
+    """
+    Keeps jobs in a shared JobStore so API processes and workers on any number of nodes cooperate.
+
+    The API side enqueues jobs and follows the ones it hands out by polling the store, so waiting and
+    progress events work the same as with in-process jobs. Workers (in the API process when
+    API_RUN_WORKERS is set, and in `python -m app.worker` processes) claim jobs from the store and
+    renew their lease while running them; jobs of a worker that dies are retried by whichever process
+    notices the expired lease first.
+    """
+
+    name = "distributed"
+    # Record fields a worker writes back to the store while a job runs, and once it has finished.
+    HEARTBEAT_FIELDS = ("status", "progress", "timings", "started_at")
+    FINISH_FIELDS = HEARTBEAT_FIELDS + ("result", "error", "error_kind", "finished_at")
+
+    def __init__(self, runner: Callable[[Job], Awaitable[Dict]], store: JobStore = None, run_workers: bool = None,
+                 **kwargs: Any):
+        super().__init__(runner, **kwargs)
+        self.store = store or create_job_store()
+        self.run_workers = settings.API_RUN_WORKERS if run_workers is None else run_workers
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        # Jobs handed out by get() or submit() that have not finished yet, refreshed from the store.
+        self._following: Dict[str, Job] = {}
+        self._stats: Dict[str, Any] = {"queued": 0, "running": 0, "clients": {}}
+        self._poller: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._stats["queued"]
+
+    def client_jobs(self, client: str) -> int:
+        return self._stats["clients"].get(client, 0)
+
+    def _ensure_workers(self) -> None:
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        if self.run_workers:
+            self._workers = [worker for worker in self._workers if not worker.done()]
+            while len(self._workers) < self.max_workers:
+                self._workers.append(asyncio.create_task(self._worker()))
+
+    async def submit(self, job_type: JobType, params: Dict[str, Any], client: str = None, weight: int = 1) -> Job:
+        self._ensure_workers()
+        self.admit(client)
+        if self.queue_depth >= self.max_queue_size:
+            raise JobQueueFullError("The download queue is full. Please try again later.")
+
+        job = Job(job_type, params, client=client)
+        await self.store.enqueue(job.to_record(weight=max(1, weight), attempts=0, worker=None))
+
+        # Count the job right away rather than at the next poll, so bursts cannot overshoot the limits.
+        self._stats["queued"] += 1
+        self._stats["clients"][client] = self.client_jobs(client) + 1
+        self._following[job.job_id] = job
+        return job
+
+    async def get(self, job_id: str) -> Job:
+        job = self._following.get(job_id) or self._jobs.get(job_id)
+        if job is not None:
+            return job
+
+        record = await self.store.get(job_id)
+        if record is None:
+            raise JobNotFoundError(f"Job '{job_id}' was not found")
+        job = Job.from_record(record)
+        self._track(job)
+        return job
+
+    async def cancel(self, job_id: str) -> Job:
+        job = await self.get(job_id)
+        record = await self.store.cancel(job_id)
+        if record is not None:
+            job.apply(record)
+            self._track(job)
+        return job
+
+    def _track(self, job: Job) -> None:
+        if job.is_finished:
+            self._following.pop(job.job_id, None)
+            self._jobs.set(job.job_id, job)
+        else:
+            self._following[job.job_id] = job
+
+    async def shutdown(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        await super().shutdown()
+        await self.store.close()
+
+    async def _poll(self) -> None:
+        last_recovery = 0.0
+        while True:
+            try:
+                for record in await self.store.get_many(list(self._following)):
+                    job = self._following.get(record["job_id"])
+                    if job is not None:
+                        job.apply(record)
+                        self._track(job)
+                self._stats = await self.store.stats()
+
+                if time.monotonic() - last_recovery >= settings.JOB_HEARTBEAT_INTERVAL:
+                    last_recovery = time.monotonic()
+                    recovered = await self.store.recover(settings.JOB_MAX_ATTEMPTS)
+                    if recovered:
+                        logger.warning(f"Recovered {recovered} jobs from workers whose lease expired")
+            except Exception as e:
+                logger.error(f"Polling the job store failed: {e}")
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                record = await self.store.claim(self.worker_id, settings.JOB_LEASE_SECONDS)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                record = None
+            if record is None:
+                await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+                continue
+
+            job = Job.from_record(record, self.runner)
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                # Shutting down: hand the job to another worker instead of cancelling it.
+                await asyncio.shield(self.store.release(job.job_id, self.worker_id))
+                raise
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+
+            record = job.to_record()
+            fields = {name: record[name] for name in self.FINISH_FIELDS}
+            if not await self.store.finish(job.job_id, self.worker_id, fields):
+                logger.warning(f"Job {job.job_id} was taken over by another worker before it finished")
+
+    async def _heartbeat(self, job: Job) -> None:
+        """Renew the job's lease and publish its progress until it finishes"""
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+            record = job.to_record()
+            fields = {name: record[name] for name in self.HEARTBEAT_FIELDS}
+            try:
+                record = await self.store.heartbeat(job.job_id, self.worker_id, settings.JOB_LEASE_SECONDS, fields)
+            except Exception as e:
+                # Keep going: the lease is long enough to survive a few missed heartbeats.
+                logger.error(f"Heartbeat for job {job.job_id} failed: {e}")
+                continue
+            if record is None or record.get("cancel_requested"):
+                # Cancelled by a client, or the lease was lost and the job given to another worker.
+                if job._task is not None:
+                    job._cancel_requested = True
+                    job._task.cancel()
+                return
+
+
+def create_job_manager(runner: Callable[[Job], Awaitable[Dict]]) -> JobManager:
+    """In-process job manager for JOB_STORE=memory, otherwise one backed by the configured job store"""
+    if settings.JOB_STORE == JobManager.name:
+        return JobManager(runner)
+    return DistributedJobManager(runner)
@@ -0,0 +1,520 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from ..core.config_settings import settings
+from ..core.exceptions import YouTubeDownloadError
+from ..schemas.youtube_schema import JobStatus
+
+Record = Dict[str, Any]
+
+FINAL_STATES = (JobStatus.DONE.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value)
+WORKER_LOST_ERROR = "The worker running this job stopped responding"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _is_running(record: Record) -> bool:
+    return record["status"] not in FINAL_STATES and record["status"] != JobStatus.QUEUED.value
+
+
+class JobStore:
+    """
+    Queue and state of download jobs, shared by every API process and worker that uses the same store.
+
+    Jobs are plain JSON-serializable records (see Job.to_record). A worker claims a queued job together
+    with a lease, renews the lease with heartbeats while it runs the job, and finishes it with its final
+    state. Whenever a lease runs out, because the worker died or hung, recover() puts the job back in
+    the queue, or fails it once it has used up its attempts.
+    """
+
+    name = "base"
+    # Source of lease and queue timestamps; a shared store needs hosts with synchronised clocks.
+    clock: Callable[[], float] = staticmethod(time.time)
+
+    async def enqueue(self, record: Record) -> None:
+        raise NotImplementedError
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Record]:
+        """Take the next queued job, giving the least served client priority"""
+        raise NotImplementedError
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float,
+                        fields: Record) -> Optional[Record]:
+        """Renew a lease and save fields. Returns None if worker_id no longer owns the job"""
+        raise NotImplementedError
+
+    async def finish(self, job_id: str, worker_id: str, fields: Record) -> bool:
+        """Save a job's final state. Returns False if worker_id no longer owns the job"""
+        raise NotImplementedError
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        """Put a job the worker is giving up on (e.g. on shutdown) back in the queue without using an attempt"""
+        raise NotImplementedError
+
+    async def cancel(self, job_id: str) -> Optional[Record]:
+        """Cancel a queued job, or ask the worker running it to stop. Returns None for unknown jobs"""
+        raise NotImplementedError
+
+    async def recover(self, max_attempts: int) -> int:
+        """Requeue or fail running jobs whose lease has expired. Returns the number of jobs affected"""
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Record]:
+        records = await self.get_many([job_id])
+        return records[0] if records else None
+
+    async def get_many(self, job_ids: List[str]) -> List[Record]:
+        raise NotImplementedError
+
+    async def stats(self) -> Record:
+        """{"queued": int, "running": int, "clients": {client: unfinished jobs}}"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _expire(record: Record, max_attempts: int) -> None:
+        # Shared by the backends: what happens to a job whose worker stopped renewing its lease.
+        if record["attempts"] >= max_attempts:
+            record.update(status=JobStatus.FAILED.value, error=WORKER_LOST_ERROR, finished_at=_now_iso())
+        else:
+            record.update(status=JobStatus.QUEUED.value, progress=None)
+        record.update(worker=None, lease_until=None)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store in a SQLite database, for a single node.
+
+    The API and any number of `python -m app.worker` processes on the same host can share the file.
+    Every operation runs in its own write transaction, so claims never hand a job to two workers.
+    """
+
+    name = "sqlite"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            client TEXT,
+            weight INTEGER NOT NULL,
+            lease_until REAL,
+            enqueued_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, enqueued_at);
+    """
+    # Queued job of the client with the fewest running jobs relative to its weight, oldest first.
+    CLAIM_QUERY = """
+        SELECT record FROM jobs AS queued
+        WHERE status = 'queued'
+        ORDER BY (
+            SELECT COUNT(*) FROM jobs AS running
+            WHERE running.client IS queued.client AND running.status NOT IN ('queued', 'done', 'failed', 'cancelled')
+        ) * 1.0 / queued.weight, enqueued_at
+        LIMIT 1
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.JOB_STORE_SQLITE_PATH
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await asyncio.to_thread(self._transaction, fn)
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, job_id: str) -> Optional[Record]:
+        row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, conn: sqlite3.Connection, record: Record) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, client, weight, lease_until, enqueued_at, updated_at, record)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record["job_id"], record["status"], record.get("client"), record.get("weight") or 1,
+             record.get("lease_until"), record["enqueued_at"], self.clock(), json.dumps(record))
+        )
+
+    async def enqueue(self, record: Record) -> None:
+        record = dict(record, enqueued_at=self.clock())
+        await self._run(lambda conn: self._save(conn, record))
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Record]:
+        def claim(conn: sqlite3.Connection) -> Optional[Record]:
+            row = conn.execute(self.CLAIM_QUERY).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            record.update(status=JobStatus.RUNNING.value, worker=worker_id, attempts=record["attempts"] + 1,
+                          lease_until=self.clock() + lease_seconds)
+            self._save(conn, record)
+            return record
+
+        return await self._run(claim)
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float,
+                        fields: Record) -> Optional[Record]:
+        def heartbeat(conn: sqlite3.Connection) -> Optional[Record]:
+            record = self._load(conn, job_id)
+            if record is None or record["worker"] != worker_id or not _is_running(record):
+                return None
+            record.update(fields, lease_until=self.clock() + lease_seconds)
+            self._save(conn, record)
+            return record
+
+        return await self._run(heartbeat)
+
+    async def finish(self, job_id: str, worker_id: str, fields: Record) -> bool:
+        def finish(conn: sqlite3.Connection) -> bool:
+            record = self._load(conn, job_id)
+            if record is None or record["worker"] != worker_id or not _is_running(record):
+                return False
+            record.update(fields, lease_until=None)
+            self._save(conn, record)
+            return True
+
+        return await self._run(finish)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        def release(conn: sqlite3.Connection) -> None:
+            record = self._load(conn, job_id)
+            if record is not None and record["worker"] == worker_id and _is_running(record):
+                record.update(status=JobStatus.QUEUED.value, worker=None, lease_until=None, progress=None,
+                              attempts=record["attempts"] - 1)
+                self._save(conn, record)
+
+        await self._run(release)
+
+    async def cancel(self, job_id: str) -> Optional[Record]:
+        def cancel(conn: sqlite3.Connection) -> Optional[Record]:
+            record = self._load(conn, job_id)
+            if record is None or record["status"] in FINAL_STATES:
+                return record
+            if record["status"] == JobStatus.QUEUED.value:
+                record.update(status=JobStatus.CANCELLED.value, finished_at=_now_iso())
+            else:
+                record["cancel_requested"] = True
+            self._save(conn, record)
+            return record
+
+        return await self._run(cancel)
+
+    async def recover(self, max_attempts: int) -> int:
+        def recover(conn: sqlite3.Connection) -> int:
+            now = self.clock()
+            rows = conn.execute(
+                "SELECT record FROM jobs WHERE status NOT IN ('queued', 'done', 'failed', 'cancelled')"
+                " AND lease_until < ?", (now,)
+            ).fetchall()
+            for row in rows:
+                record = json.loads(row[0])
+                self._expire(record, max_attempts)
+                self._save(conn, record)
+            # Finished jobs are kept as long as the API keeps them in memory.
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (now - settings.JOB_RETENTION,)
+            )
+            return len(rows)
+
+        return await self._run(recover)
+
+    async def get_many(self, job_ids: List[str]) -> List[Record]:
+        if not job_ids:
+            return []
+
+        def get_many(conn: sqlite3.Connection) -> List[Record]:
+            placeholders = ", ".join("?" * len(job_ids))
+            rows = conn.execute(f"SELECT record FROM jobs WHERE job_id IN ({placeholders})", job_ids).fetchall()
+            return [json.loads(row[0]) for row in rows]
+
+        return await self._run(get_many)
+
+    async def stats(self) -> Record:
+        def stats(conn: sqlite3.Connection) -> Record:
+            rows = conn.execute(
+                "SELECT client, status = 'queued', COUNT(*) FROM jobs"
+                " WHERE status NOT IN ('done', 'failed', 'cancelled') GROUP BY client, status = 'queued'"
+            ).fetchall()
+            result = {"queued": 0, "running": 0, "clients": {}}
+            for client, queued, count in rows:
+                result["queued" if queued else "running"] += count
+                result["clients"][client] = result["clients"].get(client, 0) + count
+            return result
+
+        return await self._run(stats)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisJobStore(JobStore):
+    """
+    Job store in Redis, for clusters of API and worker nodes.
+
+    Each job is a JSON document updated in WATCH/MULTI transactions, so claims, heartbeats and
+    cancellations of the same job never interleave. Queued job IDs are kept in one list per client,
+    and clients take turns through a rotation list in which each appears `weight` times. Running
+    jobs are tracked in a sorted set scored by lease expiry.
+
+    REDIS_URL=fakeredis:// runs against an in-process fake server (the fakeredis package), which is
+    enough to try the store out with API_RUN_WORKERS on a single process.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = None, prefix: str = None):
+        url = url or settings.REDIS_URL
+        self.prefix = prefix or settings.REDIS_KEY_PREFIX
+        try:
+            if url.startswith("fakeredis://"):
+                import fakeredis
+                self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+            else:
+                import redis.asyncio
+                self.redis = redis.asyncio.Redis.from_url(url, decode_responses=True)
+        except ImportError as e:
+            raise YouTubeDownloadError(f"The redis job store needs the '{e.name}' package") from e
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def _pending_key(self, client: Optional[str]) -> str:
+        return self._key("pending", client or "")
+
+    async def _transition(self, job_id: str, change: Callable[[Record], Optional[Callable]]) -> tuple:
+        """
+        Atomically update a job. change(record) edits the record in place and returns a function that
+        queues any other commands on the pipeline, or returns None to leave the job untouched.
+
+        Returns the record (None if the job does not exist), whether it was changed, and the results of
+        the extra commands.
+        """
+        from redis.exceptions import WatchError
+
+        key = self._key("job", job_id)
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    if raw is None:
+                        return None, False, []
+                    record = json.loads(raw)
+                    commands = change(record)
+                    if commands is None:
+                        await pipe.unwatch()
+                        return record, False, []
+
+                    pipe.multi()
+                    expire = settings.JOB_RETENTION if record["status"] in FINAL_STATES else None
+                    pipe.set(key, json.dumps(record), ex=expire)
+                    commands(pipe)
+                    results = await pipe.execute()
+                    return record, True, results[1:]
+                except WatchError:
+                    continue
+
+    async def _add_to_rotation(self, client: Optional[str], weight: int) -> None:
+        await self.redis.rpush(self._key("rotation"), *([client or ""] * max(1, weight)))
+
+    async def _drop_from_rotation(self, client: str) -> None:
+        from redis.exceptions import WatchError
+
+        # Only drop a client whose queue is still empty; an enqueue in the meantime aborts the transaction.
+        pending_key = self._pending_key(client)
+        async with self.redis.pipeline() as pipe:
+            try:
+                await pipe.watch(pending_key)
+                if await pipe.llen(pending_key) == 0:
+                    pipe.multi()
+                    pipe.lrem(self._key("rotation"), 0, client)
+                    await pipe.execute()
+                else:
+                    await pipe.unwatch()
+            except WatchError:
+                pass
+
+    async def enqueue(self, record: Record) -> None:
+        record = dict(record, enqueued_at=self.clock())
+        client = record.get("client")
+        async with self.redis.pipeline() as pipe:
+            pipe.set(self._key("job", record["job_id"]), json.dumps(record))
+            pipe.rpush(self._pending_key(client), record["job_id"])
+            pipe.hincrby(self._key("counts"), "queued", 1)
+            pipe.hincrby(self._key("clients"), client or "", 1)
+            _, pending, _, _ = await pipe.execute()
+        if pending == 1:
+            await self._add_to_rotation(client, record.get("weight") or 1)
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Record]:
+        rotation_key = self._key("rotation")
+        for _ in range(await self.redis.llen(rotation_key)):
+            client = await self.redis.lmove(rotation_key, rotation_key, "LEFT", "RIGHT")
+            if client is None:
+                return None
+            job_id = await self.redis.lpop(self._pending_key(client))
+            if job_id is None:
+                await self._drop_from_rotation(client)
+                continue
+
+            lease_until = self.clock() + lease_seconds
+
+            def claim(record: Record) -> Optional[Callable]:
+                if record["status"] != JobStatus.QUEUED.value:
+                    # Cancelled while it was queued.
+                    return None
+                record.update(status=JobStatus.RUNNING.value, worker=worker_id, attempts=record["attempts"] + 1,
+                              lease_until=lease_until)
+                return lambda pipe: (
+                    pipe.zadd(self._key("leases"), {job_id: lease_until}),
+                    pipe.hincrby(self._key("counts"), "queued", -1),
+                )
+
+            record, claimed, _ = await self._transition(job_id, claim)
+            if claimed:
+                return record
+        return None
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float,
+                        fields: Record) -> Optional[Record]:
+        lease_until = self.clock() + lease_seconds
+
+        def heartbeat(record: Record) -> Optional[Callable]:
+            if record["worker"] != worker_id or not _is_running(record):
+                return None
+            record.update(fields, lease_until=lease_until)
+            return lambda pipe: pipe.zadd(self._key("leases"), {job_id: lease_until})
+
+        record, renewed, _ = await self._transition(job_id, heartbeat)
+        return record if renewed else None
+
+    def _finished(self, pipe, record: Record) -> None:
+        pipe.zrem(self._key("leases"), record["job_id"])
+        pipe.hincrby(self._key("clients"), record.get("client") or "", -1)
+
+    async def finish(self, job_id: str, worker_id: str, fields: Record) -> bool:
+        def finish(record: Record) -> Optional[Callable]:
+            if record["worker"] != worker_id or not _is_running(record):
+                return None
+            record.update(fields, lease_until=None)
+            return lambda pipe: self._finished(pipe, record)
+
+        _, finished, _ = await self._transition(job_id, finish)
+        return finished
+
+    def _requeue(self, pipe, record: Record) -> None:
+        pipe.zrem(self._key("leases"), record["job_id"])
+        # Back to the front of its client's queue: it has waited long enough already.
+        pipe.lpush(self._pending_key(record.get("client")), record["job_id"])
+        pipe.hincrby(self._key("counts"), "queued", 1)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        def release(record: Record) -> Optional[Callable]:
+            if record["worker"] != worker_id or not _is_running(record):
+                return None
+            record.update(status=JobStatus.QUEUED.value, worker=None, lease_until=None, progress=None,
+                          attempts=record["attempts"] - 1)
+            return lambda pipe: self._requeue(pipe, record)
+
+        record, released, results = await self._transition(job_id, release)
+        if released and results[1] == 1:
+            await self._add_to_rotation(record.get("client"), record.get("weight") or 1)
+
+    async def cancel(self, job_id: str) -> Optional[Record]:
+        def cancel(record: Record) -> Optional[Callable]:
+            if record["status"] in FINAL_STATES:
+                return None
+            if record["status"] == JobStatus.QUEUED.value:
+                record.update(status=JobStatus.CANCELLED.value, finished_at=_now_iso())
+                # The ID stays in the pending list; claim() skips it.
+                return lambda pipe: (
+                    pipe.hincrby(self._key("counts"), "queued", -1),
+                    pipe.hincrby(self._key("clients"), record.get("client") or "", -1),
+                )
+            record["cancel_requested"] = True
+            return lambda pipe: None
+
+        record, _, _ = await self._transition(job_id, cancel)
+        return record
+
+    async def recover(self, max_attempts: int) -> int:
+        now = self.clock()
+        recovered = 0
+        for job_id in await self.redis.zrangebyscore(self._key("leases"), "-inf", now):
+            def expire(record: Record) -> Optional[Callable]:
+                if not _is_running(record) or (record.get("lease_until") or 0) >= now:
+                    return None
+                self._expire(record, max_attempts)
+                if record["status"] == JobStatus.QUEUED.value:
+                    return lambda pipe: self._requeue(pipe, record)
+                return lambda pipe: self._finished(pipe, record)
+
+            record, expired, results = await self._transition(job_id, expire)
+            if record is None:
+                await self.redis.zrem(self._key("leases"), job_id)
+            elif expired:
+                recovered += 1
+                if record["status"] == JobStatus.QUEUED.value and results[1] == 1:
+                    await self._add_to_rotation(record.get("client"), record.get("weight") or 1)
+        return recovered
+
+    async def get_many(self, job_ids: List[str]) -> List[Record]:
+        if not job_ids:
+            return []
+        raws = await self.redis.mget([self._key("job", job_id) for job_id in job_ids])
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    async def stats(self) -> Record:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hget(self._key("counts"), "queued")
+            pipe.zcard(self._key("leases"))
+            pipe.hgetall(self._key("clients"))
+            queued, running, clients = await pipe.execute()
+        return {
+            "queued": int(queued or 0),
+            "running": running,
+            "clients": {client or None: int(count) for client, count in clients.items() if int(count) > 0},
+        }
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+JOB_STORES = {
+    SQLiteJobStore.name: SQLiteJobStore,
+    RedisJobStore.name: RedisJobStore,
+}
+
+
+def create_job_store(name: str = None) -> JobStore:
+    name = name or settings.JOB_STORE
+    if name not in JOB_STORES:
+        raise YouTubeDownloadError(f"Unknown job store '{name}'. Available stores: {', '.join(JOB_STORES)}")
+    return JOB_STORES[name]()
@@ -0,0 +1,279 @@
+import asyncio
+import os
+import re
+import shutil
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from ..core.config_settings import settings
+from ..core.exceptions import YouTubeDownloadError
+from ..core.metrics import TRANSCODES_RUNNING, record_spawn
+from ..models.youtube import AUDIO_QUALITY_TIERS, FormatIndex, MediaFormat
+
+# Post-processing paths, cheapest first: deliver the downloaded file as it is, rewrite the container
+# around the same streams, or re-encode at least one stream.
+COPY, REMUX, TRANSCODE = "copy", "remux", "transcode"
+
+# Codec families (video, audio) each container holds without re-encoding. None accepts any codec.
+VIDEO_CONTAINER_CODECS: Dict[str, Tuple[Optional[FrozenSet[str]], Optional[FrozenSet[str]]]] = {
+    'mp4': (frozenset({'avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'av01', 'vp09'}),
+            frozenset({'mp4a', 'opus', 'mp3', 'ac-3', 'ec-3', 'flac'})),
+    'webm': (frozenset({'vp8', 'vp9', 'vp09', 'av01'}), frozenset({'opus', 'vorbis'})),
+    'mkv': (None, None),
+}
+# Source audio codec families each audio format can be produced from with a stream copy.
+AUDIO_FORMAT_CODECS: Dict[str, FrozenSet[str]] = {
+    'mp3': frozenset({'mp3'}),
+    'm4a': frozenset({'mp4a'}),
+    'aac': frozenset({'mp4a'}),
+    'opus': frozenset({'opus'}),
+    'flac': frozenset({'flac'}),
+    'wav': frozenset(),
+}
+
+# Encoder options for streams that do not fit the requested container or format.
+VIDEO_ENCODER_ARGS = {
+    'mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23'],
+    'webm': ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-crf', '32', '-b:v', '0'],
+}
+AUDIO_ENCODERS = {
+    'mp4': 'aac',
+    'webm': 'libopus',
+    'mp3': 'libmp3lame',
+    'm4a': 'aac',
+    'aac': 'aac',
+    'opus': 'libopus',
+    'flac': 'flac',
+    'wav': 'pcm_s16le',
+}
+# Options of the lossy encoders for the "best" quality tier; other tiers set their bitrate instead.
+BEST_QUALITY_ARGS = {
+    'aac': ['-b:a', '192k'],
+    'libopus': ['-b:a', '160k'],
+    'libmp3lame': ['-q:a', '0'],
+}
+
+# Muxer options per output format. The streaming variants can write to a non-seekable pipe.
+FILE_MUXER_ARGS = {
+    'mp4': ['-f', 'mp4'],
+    'webm': ['-f', 'webm'],
+    'mkv': ['-f', 'matroska'],
+    'mp3': ['-f', 'mp3'],
+    'm4a': ['-f', 'ipod'],
+    'aac': ['-f', 'adts'],
+    'opus': ['-f', 'opus'],
+    'flac': ['-f', 'flac'],
+    'wav': ['-f', 'wav'],
+}
+STREAM_MUXER_ARGS = dict(
+    FILE_MUXER_ARGS,
+    mp4=['-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4'],
+    m4a=['-movflags', 'frag_keyframe+empty_moov', '-f', 'ipod'],
+)
+
+# Printed by ffmpeg -benchmark when it exits: CPU time of the whole process.
+BENCH_PATTERN = re.compile(rb"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+class PostprocessPlan(NamedTuple):
+    """
+    How a download reaches its output format: which streams to fetch and what ffmpeg does with them.
+    """
+
+    path: str
+    format_selector: str
+    output_format: str
+    # Container yt-dlp merges separate video and audio streams into (always a stream copy).
+    merge_format: Optional[str] = None
+    # ffmpeg codec options applied after the download; empty when the download is already final.
+    codec_args: Tuple[str, ...] = ()
+    # Approximate bytes downloaded, None when unknown.
+    size: Optional[int] = None
+
+    @property
+    def needs_ffmpeg(self) -> bool:
+        return bool(self.codec_args)
+
+    def ffmpeg_args(self, stream: bool = False) -> List[str]:
+        muxer_args = STREAM_MUXER_ARGS if stream else FILE_MUXER_ARGS
+        return list(self.codec_args or ('-c', 'copy')) + muxer_args[self.output_format]
+
+
+def _fits(codec_family: Optional[str], codecs: Optional[FrozenSet[str]]) -> bool:
+    return codecs is None or codec_family in codecs
+
+
+def _best_audio(formats: Iterable[MediaFormat], codecs: Optional[FrozenSet[str]]) -> Optional[MediaFormat]:
+    return max((f for f in formats if _fits(f.audio_codec_family, codecs)), key=MediaFormat.audio_rank, default=None)
+
+
+def _size(*formats: Optional[MediaFormat]) -> Optional[int]:
+    sizes = [f.filesize for f in formats if f is not None]
+    return sum(sizes) if sizes and all(sizes) else None
+
+
+def audio_encoder_args(output_format: str, bitrate: Optional[int] = None) -> List[str]:
+    """Encoder options for the audio of output_format, at bitrate kbps or at the best quality when None"""
+    encoder = AUDIO_ENCODERS[output_format]
+    if encoder not in BEST_QUALITY_ARGS:
+        # Lossless
+        return ['-c:a', encoder]
+    return ['-c:a', encoder] + (['-b:a', f'{bitrate}k'] if bitrate else BEST_QUALITY_ARGS[encoder])
+
+
+def _fallback_selector(height: Optional[int]) -> str:
+    if height is None:
+        return 'bestvideo+bestaudio/best'
+    return f'bestvideo[height<={height}]+bestaudio/best[height<={height}]'
+
+
+def _stream_args(video: MediaFormat, audio: Optional[MediaFormat], output_format: str) -> List[str]:
+    """Codec options that copy every stream the container can hold and re-encode the others"""
+    video_codecs, audio_codecs = VIDEO_CONTAINER_CODECS[output_format]
+    audio = audio or video
+    args = ['-c:v', 'copy'] if _fits(video.video_codec_family, video_codecs) else VIDEO_ENCODER_ARGS[output_format]
+    return args + (['-c:a', 'copy'] if _fits(audio.audio_codec_family, audio_codecs)
+                   else audio_encoder_args(output_format))
+
+
+def plan_video(index: FormatIndex, height: Optional[int], output_format: str) -> PostprocessPlan:
+    """
+    Pick the streams for a video download no taller than height (None: no limit), preferring ones the
+    container holds as they are so that ffmpeg only has to remux them.
+    """
+    video_codecs, audio_codecs = VIDEO_CONTAINER_CODECS[output_format]
+    max_height = index.max_height if height is None else height
+
+    if index.video and index.audio:
+        video = index.best_video(max_height, output_format)
+        audio = _best_audio(index.audio, audio_codecs)
+        if video is not None and audio is not None:
+            return PostprocessPlan(REMUX, f"{video.format_id}+{audio.format_id}", output_format,
+                                   merge_format=output_format, size=_size(video, audio))
+
+        # Merge into mkv, which holds anything, and re-encode only what the container cannot hold.
+        video = video or index.best_video(max_height)
+        audio = audio or index.best_audio()
+        if video is not None:
+            codec_args = _stream_args(video, audio, output_format)
+            return PostprocessPlan(TRANSCODE, f"{video.format_id}+{audio.format_id}", output_format,
+                                   merge_format='mkv', codec_args=tuple(codec_args), size=_size(video, audio))
+
+    def muxed_rank(fmt: MediaFormat) -> Tuple:
+        # The tallest stream wins; at the same height, the one needing the least work.
+        cost = 2 if fmt.ext == output_format else int(_fits(fmt.video_codec_family, video_codecs)
+                                                      and _fits(fmt.audio_codec_family, audio_codecs))
+        return (fmt.height or 0, cost) + fmt.video_rank()
+
+    muxed = max((f for f in index.muxed if height is None or (f.height or 0) <= height), key=muxed_rank,
+                default=None)
+    if muxed is not None:
+        if muxed.ext == output_format:
+            return PostprocessPlan(COPY, muxed.format_id, output_format, size=muxed.filesize)
+        codec_args = _stream_args(muxed, None, output_format)
+        path = REMUX if codec_args == ['-c:v', 'copy', '-c:a', 'copy'] else TRANSCODE
+        return PostprocessPlan(path, muxed.format_id, output_format, codec_args=tuple(codec_args),
+                               size=muxed.filesize)
+
+    # Nothing suitable in the index: let yt-dlp choose and merge, as without a plan.
+    return PostprocessPlan(REMUX, _fallback_selector(height), output_format, merge_format=output_format)
+
+
+def plan_audio(index: FormatIndex, audio_format: str, quality: str = 'best') -> PostprocessPlan:
+    """
+    Pick the audio stream for an audio download: the smallest stream that satisfies the quality tier,
+    delivered as it is or remuxed when it already has the requested codec, and transcoded otherwise.
+    """
+    min_bitrate = AUDIO_QUALITY_TIERS[quality]
+    native_codecs = AUDIO_FORMAT_CODECS[audio_format]
+    native = index.smallest_audio(min_bitrate, native_codecs)
+    source = native or index.smallest_audio(min_bitrate)
+    if source is None:
+        # No stream reaches the tier: the best one is used, preferably without re-encoding it.
+        native = index.smallest_audio(None, native_codecs)
+        source = native or index.smallest_audio(None)
+
+    if native is not None:
+        if native.ext == audio_format:
+            return PostprocessPlan(COPY, native.format_id, audio_format, size=native.filesize)
+        return PostprocessPlan(REMUX, native.format_id, audio_format, codec_args=('-vn', '-c:a', 'copy'),
+                               size=native.filesize)
+
+    codec_args = ['-vn'] + audio_encoder_args(audio_format, min_bitrate)
+    return PostprocessPlan(TRANSCODE, source.format_id if source else 'bestaudio/best', audio_format,
+                           codec_args=tuple(codec_args), size=_size(source) if source else None)
+
+
+def ffmpeg_command(input_args: List[str], plan: PostprocessPlan, output: str, stream: bool = False) -> List[str]:
+    # -benchmark reports the CPU time of the run, which is only printed at the info log level.
+    return (["ffmpeg", "-hide_banner", "-nostdin", "-nostats", "-loglevel", "info", "-benchmark", "-xerror"]
+            + input_args + plan.ffmpeg_args(stream) + ["-y", output])
+
+
+def cpu_seconds(stderr: bytes) -> float:
+    """CPU time (user + system) reported by an ffmpeg -benchmark run, 0 when missing"""
+    match = BENCH_PATTERN.search(stderr)
+    return round(float(match.group(1)) + float(match.group(2)), 3) if match else 0.0
+
+
+def ffmpeg_error(stderr: bytes, lines: int = 5) -> str:
+    """The last lines of ffmpeg's output, where it explains a failure"""
+    output = [line for line in stderr.decode(errors='replace').splitlines() if not line.startswith('bench:')]
+    return "\n".join(output[-lines:])
+
+
+class Postprocessor:
+    """
+    Runs the ffmpeg step of post-processing plans.
+
+    Transcodes keep a CPU core busy for as long as they run, so each one holds a slot of a per-worker
+    budget; copies and remuxes are I/O bound and never wait for a slot.
+    """
+
+    def __init__(self, max_transcodes: int = None):
+        self.max_transcodes = max_transcodes or settings.TRANSCODE_MAX_CONCURRENT or os.cpu_count() or 1
+        self._slots = asyncio.Semaphore(self.max_transcodes)
+
+    @asynccontextmanager
+    async def cpu_slot(self, plan: PostprocessPlan) -> AsyncIterator[None]:
+        if plan.path != TRANSCODE:
+            yield
+            return
+
+        async with self._slots:
+            TRANSCODES_RUNNING.inc()
+            try:
+                yield
+            finally:
+                TRANSCODES_RUNNING.dec()
+
+    async def run(self, plan: PostprocessPlan, input_path: str) -> Tuple[str, float]:
+        """Apply plan to a downloaded file, returning the output file and the CPU seconds ffmpeg used"""
+        if not plan.needs_ffmpeg:
+            return input_path, 0.0
+        if shutil.which("ffmpeg") is None:
+            raise YouTubeDownloadError("ffmpeg is required to post-process this download but was not found")
+
+        output_path = f"{os.path.splitext(input_path)[0]}.{plan.path}.{plan.output_format}"
+        async with self.cpu_slot(plan):
+            logger.debug(f"Running ffmpeg {plan.path} of {input_path} to {plan.output_format}")
+            record_spawn("ffmpeg")
+            proc = await asyncio.create_subprocess_exec(
+                *ffmpeg_command(["-i", input_path], plan, output_path),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await proc.communicate()
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+
+        if proc.returncode != 0:
+            raise YouTubeDownloadError(f"ffmpeg {plan.path} failed: {ffmpeg_error(stderr)}")
+        # The source is no longer needed; freeing it keeps the scratch reservation honest.
+        os.remove(input_path)
+        return output_path, cpu_seconds(stderr)
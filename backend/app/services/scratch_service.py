@@ -0,0 +1,145 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from loguru import logger
+
+from ..core.config_settings import settings
+from ..core.exceptions import ScratchSpaceError
+
+
+class ScratchManager:
+    """
+    Hands out isolated working directories for downloads and keeps the scratch disk within budget.
+
+    Every directory reserves its estimated size against a quota before the download starts. When the
+    reservation does not fit, the caller waits for running downloads to release space (up to a
+    timeout) instead of filling the disk. Directories are removed when the download ends, whether it
+    succeeded or not, and a periodic sweep deletes whatever a crashed process left behind.
+    """
+
+    def __init__(self, root: str = None, quota_bytes: int = None, min_free_bytes: int = None):
+        self.root = os.path.abspath(root or settings.SCRATCH_DIR)
+        self.quota_bytes = quota_bytes if quota_bytes is not None else settings.SCRATCH_QUOTA_BYTES
+        self.min_free_bytes = min_free_bytes if min_free_bytes is not None else settings.SCRATCH_MIN_FREE_BYTES
+        self._reservations: Dict[str, int] = {}
+        self._released: Optional[asyncio.Event] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._reservations.values())
+
+    def _fits(self, size: int) -> bool:
+        if self.reserved_bytes + size > self.quota_bytes:
+            return False
+        # The quota is the budget; free space is checked as well because the disk may be shared.
+        free_bytes = shutil.disk_usage(self.root).free
+        return free_bytes - size >= self.min_free_bytes
+
+    @staticmethod
+    def estimate(size: Optional[int]) -> int:
+        """Bytes to reserve for a download whose final size is estimated at size (None when unknown)"""
+        if not size:
+            return settings.SCRATCH_DEFAULT_RESERVATION
+        # Merging keeps the separate streams on disk next to the output until it finishes.
+        return int(size * settings.SCRATCH_RESERVATION_FACTOR)
+
+    @asynccontextmanager
+    async def directory(self, size: int, timeout: float = None) -> AsyncIterator[str]:
+        """
+        Reserve size bytes and yield a fresh working directory, removing it on exit.
+
+        Raises ScratchSpaceError when the reservation can never fit or does not fit within timeout.
+        """
+        self.start()
+        if size > self.quota_bytes:
+            raise ScratchSpaceError(
+                f"Download needs about {size} bytes of scratch space, more than the {self.quota_bytes} byte quota"
+            )
+
+        timeout = settings.SCRATCH_WAIT_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while not self._fits(size):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ScratchSpaceError("Not enough scratch space to start the download. Please try again later.")
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        # Checking and reserving happen without an await in between, so waiters cannot overbook.
+        path = os.path.join(self.root, uuid.uuid4().hex)
+        self._reservations[path] = size
+        try:
+            os.makedirs(path)
+            yield path
+        finally:
+            try:
+                await asyncio.shield(asyncio.to_thread(shutil.rmtree, path, True))
+            finally:
+                self._reservations.pop(path, None)
+                self._released.set()
+
+    def start(self) -> None:
+        # Started lazily so the manager can be created before the event loop exists.
+        if self._released is None:
+            self._released = asyncio.Event()
+        if self._sweeper is None or self._sweeper.done():
+            os.makedirs(self.root, exist_ok=True)
+            self._sweeper = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def _sweep_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Scratch sweep failed: {e}")
+            await asyncio.sleep(settings.SCRATCH_SWEEP_INTERVAL)
+
+    def sweep(self, max_age: float = None) -> int:
+        """
+        Delete scratch entries that no running download owns and that have not been written to for
+        max_age seconds. Returns the number of entries removed.
+        """
+        max_age = settings.SCRATCH_ORPHAN_TTL if max_age is None else max_age
+        cutoff = time.time() - max_age
+        removed = 0
+
+        for entry in os.scandir(self.root):
+            if entry.path in self._reservations or self._last_modified(entry.path) > cutoff:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+            removed += 1
+
+        if removed:
+            logger.info(f"Removed {removed} orphaned scratch entries from {self.root}")
+        return removed
+
+    @staticmethod
+    def _last_modified(path: str) -> float:
+        # Other processes may share the scratch root, so an entry only counts as orphaned once
+        # nothing inside it has changed for a while.
+        latest = os.path.getmtime(path)
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    latest = max(latest, os.path.getmtime(os.path.join(directory, name)))
+                except FileNotFoundError:
+                    pass
+        return latest
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlencode, quote
+
+from ..core.config_settings import settings
+from ..core.exceptions import YouTubeDownloadError
+from ..utils.retry import RetryPolicy
+
+UploadCallback = Callable[[int], None]
+
+# Lifetime of the download links handed out to clients.
+URL_EXPIRATION = 900
+
+
+class StorageBackend:
+    """
+    Stores finished downloads and hands out links to them.
+
+    Objects are addressed by the same deterministic keys whatever the backend, so the result cache
+    works unchanged on S3 and on local disk.
+    """
+
+    name = "base"
+
+    async def put_file(self, file_path: str, object_name: str, callback: UploadCallback = None) -> None:
+        raise NotImplementedError
+
+    async def put_stream(self, reader: asyncio.StreamReader, object_name: str, callback: UploadCallback = None,
+                         verify: Callable[[], Awaitable] = None) -> None:
+        """Store a byte stream while it is being produced. verify() runs before the object is committed"""
+        raise NotImplementedError
+
+    async def exists(self, object_name: str) -> bool:
+        raise NotImplementedError
+
+    async def get_url(self, object_name: str, filename: str = None, expiration: int = URL_EXPIRATION) -> str:
+        raise NotImplementedError
+
+    async def is_available(self) -> bool:
+        """Whether the backend can store objects right now (used by the readiness probe)"""
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class S3Storage(StorageBackend):
+    """
+    Uploads to the configured S3 bucket and hands out pre-signed URLs.
+
+    Uploads are retried after transient failures (throttling, dropped connections); a retried file
+    upload only sends the parts S3 has not acknowledged yet.
+    """
+
+    name = "s3"
+
+    def __init__(self, aws_service=None, retry: RetryPolicy = None):
+        # Imported here so processes using local storage never pay for importing boto3.
+        from .aws_service import AwsService
+        self.aws_service = aws_service or AwsService()
+        self.retry = retry or RetryPolicy.for_stage("upload")
+
+    async def put_file(self, file_path: str, object_name: str, callback: UploadCallback = None) -> None:
+        await self.aws_service.upload_file(file_path, object_name, callback, retry=self.retry)
+
+    async def put_stream(self, reader: asyncio.StreamReader, object_name: str, callback: UploadCallback = None,
+                         verify: Callable[[], Awaitable] = None) -> None:
+        await self.aws_service.upload_stream(
+            reader,
+            object_name,
+            part_size=settings.S3_MULTIPART_PART_SIZE,
+            max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+            callback=callback,
+            verify=verify,
+            retry=self.retry
+        )
+
+    async def exists(self, object_name: str) -> bool:
+        return await self.aws_service.object_exists(object_name)
+
+    async def get_url(self, object_name: str, filename: str = None, expiration: int = URL_EXPIRATION) -> str:
+        return await self.aws_service.create_presigned_url(object_name, expiration, filename=filename)
+
+    async def is_available(self) -> bool:
+        return await self.aws_service.is_s3_connected()
+
+    def close(self) -> None:
+        self.aws_service.close()
+
+
+class LocalStorage(StorageBackend):
+    """
+    Keeps finished downloads on the API host's disk and serves them through the /files endpoint.
+
+    Finished files are moved into place (a rename when they are on the same filesystem), so there is
+    no upload step at all. Links carry an HMAC signature over the key, file name and expiry time.
+    """
+
+    name = "local"
+    STREAM_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root: str = None, base_url: str = None, secret: str = None):
+        self.root = os.path.abspath(root or settings.LOCAL_STORAGE_DIR)
+        self.base_url = (base_url or settings.LOCAL_STORAGE_BASE_URL).rstrip("/")
+        # Without a configured secret, links stay valid only for the lifetime of this process.
+        self.secret = (secret or settings.LOCAL_STORAGE_SECRET or secrets.token_hex(32)).encode()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, object_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, object_name))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise YouTubeDownloadError(f"Invalid object name: {object_name}")
+        return path
+
+    async def put_file(self, file_path: str, object_name: str, callback: UploadCallback = None) -> None:
+        path = self.path_for(object_name)
+        size = os.path.getsize(file_path)
+
+        def move() -> None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Move under a temporary name first so readers never see a partial file. The name is unique,
+            # so workers storing the same key at once do not overwrite each other's temporary file.
+            temp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+            try:
+                shutil.move(file_path, temp_path)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        await asyncio.to_thread(move)
+        if callback is not None:
+            callback(size)
+
+    async def put_stream(self, reader: asyncio.StreamReader, object_name: str, callback: UploadCallback = None,
+                         verify: Callable[[], Awaitable] = None) -> None:
+        path = self.path_for(object_name)
+        temp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fh = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            while True:
+                chunk = await reader.read(self.STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(fh.write, chunk)
+                if callback is not None:
+                    callback(len(chunk))
+            await asyncio.to_thread(fh.close)
+
+            if verify is not None:
+                await verify()
+            os.replace(temp_path, path)
+        except BaseException:
+            fh.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    async def exists(self, object_name: str) -> bool:
+        return os.path.isfile(self.path_for(object_name))
+
+    async def is_available(self) -> bool:
+        return os.access(self.root, os.W_OK)
+
+    def sign(self, object_name: str, expires: int, filename: str = "") -> str:
+        message = f"{object_name}\n{expires}\n{filename}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, object_name: str, expires: int, filename: str, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(object_name, expires, filename), signature)
+
+    async def get_url(self, object_name: str, filename: str = None, expiration: int = URL_EXPIRATION) -> str:
+        expires = int(time.time()) + expiration
+        query = {"expires": expires, "signature": self.sign(object_name, expires, filename or "")}
+        if filename:
+            query["filename"] = filename
+        return f"{self.base_url}/{quote(object_name)}?{urlencode(query)}"
+
+
+STORAGE_BACKENDS = {
+    S3Storage.name: S3Storage,
+    LocalStorage.name: LocalStorage,
+}
+
+
+def create_storage(name: str = None) -> StorageBackend:
+    name = name or settings.STORAGE_BACKEND
+    if name not in STORAGE_BACKENDS:
+        raise YouTubeDownloadError(
+            f"Unknown storage backend '{name}'. Available backends: {', '.join(STORAGE_BACKENDS)}"
+        )
+    return STORAGE_BACKENDS[name]()
@@ -1,133 +1,606 @@
 import asyncio
-import glob
+import copy
+import hashlib
 import json
 import os
 import re
-import subprocess
-from typing import Dict
+import shutil
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 import yt_dlp
-
-from .aws_service import AwsService
+from loguru import logger
+
+from .postprocess_service import (STREAM_MUXER_ARGS, PostprocessPlan, Postprocessor, cpu_seconds, ffmpeg_command,
+                                  ffmpeg_error, plan_audio, plan_video)
+from .scratch_service import ScratchManager
+from .storage_service import StorageBackend, create_storage
+from .ytdlp_engine import create_engine
+from ..core.config_settings import settings
 from ..core.exceptions import YouTubeDownloadError
-
-aws_service = AwsService()
+from ..core.metrics import (BYTES_TRANSFERRED, record_cache, record_postprocess, record_spawn, record_stage,
+                            stage_timer)
+from ..models.youtube import AUDIO_FORMATS, AUDIO_QUALITY_TIERS, QUALITY_HEIGHTS, FormatIndex
+from ..schemas.youtube_schema import JobStatus, JobType
+from ..utils.cache import TTLCache
+from ..utils.retry import RetryCallback, RetryPolicy
+from ..utils.singleflight import SingleFlight
+from ..utils.validator import extract_video_id
+
+# Only direct HTTP(S) streams can be handed to ffmpeg; fragmented protocols go through yt-dlp.
+STREAMABLE_PROTOCOLS = ('http', 'https')
+# Output file name inside a download's scratch directory. The directory is unique per download, so
+# names never collide, whatever the video title.
+OUTPUT_TEMPLATE = "%(id)s.%(ext)s"
+# A clip as (start, end) seconds into the video.
+Clip = Tuple[float, float]
+# Clips are cut without re-encoding, so they start at the last keyframe before the requested start and
+# carry up to a keyframe interval of extra media; scratch reservations allow for that much.
+CLIP_KEYFRAME_MARGIN = 10
+# Media URLs carry their expiry time (YouTube's "expire" parameter). Cached info whose URLs expire within
+# this many seconds is extracted again before a download, instead of failing part-way through it.
+MEDIA_URL_EXPIRY_MARGIN = 300
+MEDIA_URL_EXPIRY_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+# Download errors meaning the media URLs were refused, so a retry needs freshly extracted ones.
+EXPIRED_URL_ERROR_PATTERN = re.compile(r"http error (403|410)|server returned 403", re.IGNORECASE)
+
+
+def clip_label(clip: Clip) -> str:
+    """Compact "start-end" form of a clip, e.g. "90-120.5", used in object keys and file names"""
+    return "-".join(f"{value:.3f}".rstrip("0").rstrip(".") for value in clip)
+
+
+def external_downloader_allowed(downloader: str) -> bool:
+    """Whether a request may pick downloader: 'native', the server default or one of the allowed ones"""
+    return (downloader == 'native'
+            or downloader in settings.YTDLP_ALLOWED_EXTERNAL_DOWNLOADERS + [settings.YTDLP_EXTERNAL_DOWNLOADER])
 
 
 class YouTubeService:
-    def __init__(self):
-        self._check_yt_dlp()
-
-    def _check_yt_dlp(self):
-        try:
-            subprocess.run(["yt-dlp", "--version"], capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            raise YouTubeDownloadError("yt-dlp is not installed")
-
-    def validate_url(self, url: str) -> bool:
+    def __init__(self, storage: StorageBackend = None, scratch: ScratchManager = None):
+        # Nothing here does I/O: the engine, storage and scratch space are checked by the readiness probe.
+        self.engine = create_engine()
+        self.storage = storage or create_storage()
+        self.scratch = scratch or ScratchManager()
+        self.postprocessor = Postprocessor()
+        # Transient failures are retried per stage; uploads are retried by the storage backend.
+        self.extract_retry = RetryPolicy.for_stage("extract")
+        self.download_retry = RetryPolicy.for_stage("download")
+        # Streamed uploads download and upload at once; they are retried as a download.
+        self.stream_retry = RetryPolicy("stream", settings.RETRY_DOWNLOAD_ATTEMPTS)
+        self._info_cache = TTLCache(max_size=settings.INFO_CACHE_MAX_SIZE, ttl=settings.INFO_CACHE_TTL)
+        self._index_cache = TTLCache(max_size=settings.INFO_CACHE_MAX_SIZE, ttl=settings.INFO_CACHE_TTL)
+        # Parsed /formats responses and their ETags, shared by the GET and POST endpoints.
+        self._formats_cache = TTLCache(max_size=settings.INFO_CACHE_MAX_SIZE, ttl=settings.INFO_CACHE_TTL)
+        # Object keys known to exist in the bucket, so repeated requests skip the HEAD round trip.
+        self._result_index = TTLCache(max_size=settings.RESULT_INDEX_MAX_SIZE, ttl=settings.RESULT_INDEX_TTL)
+        # Concurrent identical extractions, lookups and downloads share a single execution.
+        self._single_flight = SingleFlight()
+        # Job running the shared download of each object key in flight, so jobs joining it can follow its progress.
+        self._producers: Dict[str, object] = {}
+
+    async def validate_url(self, url: str) -> bool:
         """Validate if the URL is a valid YouTube URL"""
         # Basic URL validation using regex
         youtube_regex = (
             r'(https?://)?(www\.)?'
-            '(youtube|youtu|youtube-nocookie)\.(com|be)/'
-            '(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+            r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
+            r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
         )
 
         if not re.match(youtube_regex, url):
-            print("Error: Invalid YouTube URL format")
+            logger.warning(f"Invalid YouTube URL format: {url}")
             return False
 
         try:
-            cmd = ["yt-dlp", "--simulate", "--no-warnings", url]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            # Reuses (and warms) the metadata cache instead of running a separate simulation.
+            await self.get_video_info(url)
             return True
-        except subprocess.CalledProcessError as e:
-            error_message = e.stderr.lower()
+        except YouTubeDownloadError as e:
+            error_message = str(e).lower()
             if "unable to download webpage" in error_message:
-                print("Error: Unable to access the video. It may be private or restricted.")
+                logger.warning(f"Unable to access the video. It may be private or restricted: {url}")
             elif "video unavailable" in error_message:
-                print("Error: The video is unavailable or does not exist.")
+                logger.warning(f"The video is unavailable or does not exist: {url}")
             else:
-                print(f"Error: {e.stderr.strip()}")
+                logger.warning(f"Video validation failed for {url}: {e}")
             return False
 
-    def get_youtube_video_title(self, url: str) -> str:
-        # Configure yt-dlp to only extract information without downloading the video.
+    async def get_video_info(self, url: str) -> Dict:
+        """Return the yt-dlp info dict for a video, extracting it at most once per cache TTL"""
+        video_id = extract_video_id(url)
+        cache_key = video_id or url
+
+        info = self._info_cache.get(cache_key)
+        record_cache("info", info is not None)
+        if info is not None:
+            return info
+
+        extract_url = f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+
+        async def extract() -> Dict:
+            with stage_timer("extract"):
+                extracted = await self.extract_retry.run(lambda: self.engine.extract_info(extract_url))
+            self._info_cache.set(cache_key, extracted)
+            return extracted
+
+        return await self._single_flight.do(("info", cache_key), extract)
+
+    def _forget_info(self, url: str) -> None:
+        self._info_cache.pop(extract_video_id(url) or url)
+
+    async def _media_info(self, url: str) -> Dict:
+        """The cached info of a video for downloading it, extracted again if its media URLs are about to expire"""
+        info = await self.get_video_info(url)
+        expiries = []
+        for fmt in info.get('formats') or []:
+            match = MEDIA_URL_EXPIRY_PATTERN.search(fmt.get('url') or '')
+            if match:
+                expiries.append(int(match.group(1)))
+        if expiries and min(expiries) - time.time() < MEDIA_URL_EXPIRY_MARGIN:
+            logger.info(f"Media URLs of {url} have expired, extracting them again")
+            self._forget_info(url)
+            info = await self.get_video_info(url)
+        return info
+
+    async def get_format_index(self, url: str) -> FormatIndex:
+        """Return the structured format index of a video, built once per cached info dict"""
+        info = await self.get_video_info(url)
+        index = self._index_cache.get(info['id'])
+        record_cache("format_index", index is not None)
+        if index is None:
+            index = FormatIndex.from_info(info)
+            self._index_cache.set(info['id'], index)
+        return index
+
+    async def get_youtube_video_title(self, url: str) -> str:
+        info = await self.get_video_info(url)
+        # The video title is available in the 'fulltitle' key.
+        title = info.get('fulltitle') or info.get('title') or info.get('id', 'Unknown Title')
+        return yt_dlp.utils.sanitize_filename(title)
+
+    @staticmethod
+    def _tuning_params(tuning: Optional[Dict] = None) -> Dict:
+        """yt-dlp download options from the server settings, with per-request overrides capped by server policy"""
+        tuning = tuning or {}
+
+        def capped(requested: Optional[int], default: Optional[int], maximum: int) -> Optional[int]:
+            return default if requested is None else min(requested, maximum)
+
+        params = {
+            'concurrent_fragment_downloads': capped(tuning.get('concurrent_fragments'),
+                                                    settings.YTDLP_CONCURRENT_FRAGMENTS,
+                                                    settings.YTDLP_MAX_CONCURRENT_FRAGMENTS),
+        }
+
+        http_chunk_size = capped(tuning.get('http_chunk_size'), settings.YTDLP_HTTP_CHUNK_SIZE,
+                                 settings.YTDLP_MAX_HTTP_CHUNK_SIZE)
+        if http_chunk_size:
+            params['http_chunk_size'] = http_chunk_size
+
+        buffer_size = capped(tuning.get('buffer_size'), settings.YTDLP_BUFFER_SIZE, settings.YTDLP_MAX_BUFFER_SIZE)
+        if buffer_size:
+            params['buffersize'] = buffer_size
+
+        # Clients may only lower the server-wide rate limit, never lift it.
+        rate_limits = [limit for limit in (tuning.get('rate_limit'), settings.YTDLP_RATE_LIMIT) if limit]
+        if rate_limits:
+            params['ratelimit'] = min(rate_limits)
+
+        downloader = tuning.get('external_downloader')
+        if downloader is None:
+            downloader = settings.YTDLP_EXTERNAL_DOWNLOADER
+        elif downloader == 'native':
+            downloader = None
+        elif not external_downloader_allowed(downloader):
+            # The API checks this before queueing; workers may run with different settings.
+            raise YouTubeDownloadError(f"External downloader '{downloader}' is not allowed on this server")
+
+        if downloader:
+            params['external_downloader'] = {'default': downloader}
+            if downloader == settings.YTDLP_EXTERNAL_DOWNLOADER and settings.YTDLP_EXTERNAL_DOWNLOADER_ARGS:
+                params['external_downloader_args'] = {'default': list(settings.YTDLP_EXTERNAL_DOWNLOADER_ARGS)}
+
+        return params
+
+    @staticmethod
+    def _final_path(filepaths: List[str]) -> str:
+        """The file produced by a single-video download, as reported by the engine"""
+        if not filepaths or not os.path.isfile(filepaths[-1]):
+            raise YouTubeDownloadError("Download finished without producing an output file")
+        return filepaths[-1]
+
+    @staticmethod
+    def _progress_reporter(job) -> Optional[Callable[[Dict], None]]:
+        return job.update_progress if job is not None else None
+
+    def _retry_reporter(self, stage: str, job=None, url: str = None,
+                        refresh_on: Callable[[BaseException], bool] = None) -> RetryCallback:
+        """
+        Report a retried stage to the job.
+
+        With url, also drop the cached info so the retry uses fresh media URLs: after any error, or only
+        after the errors refresh_on accepts.
+        """
+
+        def on_retry(attempt: int, error: BaseException, delay: float) -> None:
+            if url is not None and (refresh_on is None or refresh_on(error)):
+                self._forget_info(url)
+            if job is not None:
+                job.update_progress({
+                    "phase": stage,
+                    "status": "retrying",
+                    "attempt": attempt,
+                    "delay": round(delay, 2),
+                    "error": str(error),
+                })
+
+        return on_retry
+
+    @staticmethod
+    def _format_of(object_name: str) -> str:
+        return os.path.splitext(object_name)[1].lstrip('.') or "none"
+
+    async def _run_download(self, url: str, params: Dict, output_format: str, job=None) -> str:
+        """Run an engine download and return the output file, timing download and post-processing separately"""
+        report = self._progress_reporter(job)
+        postprocess_started = {}
+        downloaded_bytes = {}
+
+        def on_progress(progress: Dict) -> None:
+            if progress.get("phase") == "postprocess":
+                # The first post-processor (merge, audio extraction) ends the download stage.
+                postprocess_started.setdefault("at", time.perf_counter())
+            elif progress.get("status") == "finished":
+                downloaded_bytes[progress.get("format_id")] = (
+                    progress.get("downloaded_bytes") or progress.get("total_bytes") or 0
+                )
+            if report is not None:
+                report(progress)
+
+        # Downloads start from the metadata extracted for the request instead of running the extractor again.
+        info = await self._media_info(url)
+        started = time.perf_counter()
+        filepaths = await self.engine.download(url, params, on_progress=on_progress, info=info)
+        finished = time.perf_counter()
+
+        download_finished = postprocess_started.get("at", finished)
+        record_stage("download", download_finished - started, output_format, job)
+        if "at" in postprocess_started:
+            record_stage("postprocess", finished - download_finished, output_format, job)
+        BYTES_TRANSFERRED.labels(direction="download", format=output_format).inc(sum(downloaded_bytes.values()))
+        return self._final_path(filepaths)
+
+    async def _upload(self, file_path: str, object_name: str, job=None) -> None:
+        """Hand a finished file to the storage backend off the event loop, reporting uploaded bytes to the job"""
+        output_format = self._format_of(object_name)
+        total_bytes = os.path.getsize(file_path)
+        if job is None:
+            with stage_timer("upload", output_format):
+                await self.storage.put_file(file_path, object_name)
+            BYTES_TRANSFERRED.labels(direction="upload", format=output_format).inc(total_bytes)
+            return
+
+        job.set_status(JobStatus.UPLOADING)
+        loop = asyncio.get_running_loop()
+        uploaded = {"bytes": 0}
+
+        def report(progress: Dict) -> None:
+            job.update_progress(progress)
+
+        def callback(bytes_amount: int) -> None:
+            # Storage backends may call this from their worker threads.
+            uploaded["bytes"] += bytes_amount
+            loop.call_soon_threadsafe(report, {
+                "phase": "upload",
+                "status": "uploading",
+                "uploaded_bytes": uploaded["bytes"],
+                "total_bytes": total_bytes,
+                "percent": round(100 * uploaded["bytes"] / total_bytes, 1) if total_bytes else None,
+            })
+
+        with stage_timer("upload", output_format, job):
+            await self.storage.put_file(file_path, object_name, callback)
+        BYTES_TRANSFERRED.labels(direction="upload", format=output_format).inc(total_bytes)
+
+    def _select_formats(self, info: Dict, format_selector: str) -> List[Dict]:
+        """Apply a yt-dlp format selector to a cached info dict and return the chosen format(s)"""
         ydl_opts = {
             'quiet': True,
-            # 'skip_download': True,
+            'no_warnings': True,
+            'simulate': True,
+            'format': format_selector,
         }
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Extract video information as a dictionary
-            info_dict = ydl.extract_info(url)
-            # The video title is available in the 'title' key.
-            js = json.dumps(ydl.sanitize_info(info_dict)['fulltitle']).split('"')[1]
-            # return info_dict.get('title', 'Unknown Title')
-            return js
-
-    async def get_formats(self, url: str) -> Dict:
-        try:
-            cmd = ["yt-dlp", "-F", url]
+            selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+        return selected.get('requested_formats') or [selected]
+
+    @staticmethod
+    def _build_ffmpeg_stream_command(formats: List[Dict], plan: PostprocessPlan,
+                                     clip: Optional[Clip] = None) -> List[str]:
+        input_args = []
+        for fmt in formats:
+            headers = "".join(f"{key}: {value}\r\n" for key, value in (fmt.get('http_headers') or {}).items())
+            if headers:
+                input_args += ["-headers", headers]
+            if clip is not None:
+                # Input seeking: ffmpeg only reads the byte ranges from the keyframe before the start on.
+                input_args += ["-ss", f"{clip[0]:.3f}", "-t", f"{clip[1] - clip[0]:.3f}"]
+            input_args += ["-i", fmt['url']]
+
+        if len(formats) > 1:
+            for index, fmt in enumerate(formats):
+                stream_type = "a" if fmt.get('vcodec') == 'none' else "v"
+                input_args += ["-map", f"{index}:{stream_type}:0"]
+
+        return ffmpeg_command(input_args, plan, "pipe:1", stream=True)
+
+    async def _stream_upload(self, url: str, plan: PostprocessPlan, object_name: str, job=None,
+                             clip: Optional[Clip] = None) -> Optional[float]:
+        """
+        Pipe the selected streams through ffmpeg straight into storage (an S3 multipart upload).
+
+        Returns the CPU seconds ffmpeg used, or None when the request cannot be streamed and has to go
+        through the regular download-then-upload path.
+        """
+        output_format = plan.output_format
+        if output_format not in STREAM_MUXER_ARGS or shutil.which("ffmpeg") is None:
+            return None
+
+        info = await self._media_info(url)
+        formats = await asyncio.to_thread(self._select_formats, info, plan.format_selector)
+        if not all(fmt.get('url') and fmt.get('protocol') in STREAMABLE_PROTOCOLS for fmt in formats):
+            return None
+
+        uploaded = {"bytes": 0}
+
+        def callback(bytes_amount: int) -> None:
+            uploaded["bytes"] += bytes_amount
+            BYTES_TRANSFERRED.labels(direction="upload", format=output_format).inc(bytes_amount)
+            if job is not None:
+                job.update_progress({"phase": "upload", "status": "streaming", "uploaded_bytes": uploaded["bytes"]})
+
+        # A transcode holds its CPU slot for the whole stream, since it encodes while downloading.
+        async with self.postprocessor.cpu_slot(plan):
+            record_spawn("ffmpeg")
             proc = await asyncio.create_subprocess_exec(
-                *cmd,
+                *self._build_ffmpeg_stream_command(formats, plan, clip),
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
-            stdout, stderr = await proc.communicate()
+            stderr_task = asyncio.create_task(proc.stderr.read())
+
+            async def verify() -> None:
+                returncode = await proc.wait()
+                if returncode != 0:
+                    stderr = await stderr_task
+                    raise YouTubeDownloadError(f"Streaming failed: {ffmpeg_error(stderr)}")
+
+            try:
+                # Download, ffmpeg and upload overlap in this mode, so they are timed as a single stage.
+                with stage_timer("stream", output_format, job):
+                    await self.storage.put_stream(proc.stdout, object_name, callback=callback, verify=verify)
+                return cpu_seconds(await stderr_task)
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                stderr_task.cancel()
 
-            if proc.returncode != 0:
-                raise YouTubeDownloadError(f"Failed to get formats: {stderr.decode()}")
+    async def get_formats(self, url: str) -> Dict:
+        formats, _ = await self.get_formats_with_etag(url)
+        return formats
 
-            output = stdout.decode()
-            return self._parse_formats(output)
+    async def get_formats_with_etag(self, url: str) -> Tuple[Dict, str]:
+        """Return the formats of a video with an ETag of their content, parsing them once per cache TTL"""
+        cache_key = extract_video_id(url) or url
+        cached = self._formats_cache.get(cache_key)
+        record_cache("formats", cached is not None)
+        if cached is not None:
+            return cached
 
+        try:
+            index = await self.get_format_index(url)
+            formats = self._parse_formats(index)
+        except YouTubeDownloadError:
+            raise
         except Exception as e:
             raise YouTubeDownloadError(f"Error getting formats: {str(e)}")
 
-    def _parse_formats(self, output: str) -> Dict:
-        available_qualities = {}
-        available_video_formats = set()
-        available_audio_formats = set()
-
-        video_lines = [line for line in output.split('\n') if 'video only' in line.lower()]
-        max_height = 0
+        # Derived from the content only, so every API instance hands out the same ETag for the same formats.
+        body = json.dumps(formats, sort_keys=True, separators=(",", ":")).encode()
+        entry = (formats, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        self._formats_cache.set(cache_key, entry)
+        return entry
 
-        for line in video_lines:
-            match = re.search(r'(\d+)p', line)
-            if match:
-                height = int(match.group(1))
-                max_height = max(max_height, height)
-
-            for format_type in ['mp4', 'webm', 'mkv']:
-                if format_type in line.lower():
-                    available_video_formats.add(format_type)
-
-        quality_map = {
-            '4320p': 4320, '2160p': 2160, '1440p': 1440,
-            '1080p': 1080, '720p': 720, '480p': 480,
-            '360p': 360, '240p': 240, '144p': 144
+    def _parse_formats(self, index: FormatIndex) -> Dict:
+        available_qualities = index.qualities()
+        return {
+            "available_qualities": available_qualities,
+            "video_formats": index.video_containers(),
+            "audio_formats": index.audio_formats(),
+            "audio_qualities": index.audio_qualities(),
+            "estimated_sizes": {quality: index.estimate_size(quality) for quality in available_qualities},
         }
 
-        for quality, height in quality_map.items():
-            if height <= max_height:
-                available_qualities[quality] = f'bestvideo[height<={height}]+bestaudio/best[height<={height}]'
-
-        available_qualities['best'] = 'bestvideo+bestaudio/best'
-
-        audio_lines = [line for line in output.split('\n') if 'audio only' in line.lower()]
-        for line in audio_lines:
-            for format_type in ['mp3', 'm4a', 'aac', 'opus', 'flac', 'wav']:
-                if format_type in line.lower():
-                    available_audio_formats.add(format_type)
+    @staticmethod
+    def _result_key(video_id: str, format_selector: str, container: str, codec_args: Tuple[str, ...] = (),
+                    clip: Optional[Clip] = None) -> str:
+        """Deterministic S3 key for a rendition: the same video and options always map to the same object"""
+        options = " ".join(codec_args)
+        source = f"{format_selector}|{container}|{options}"
+        if clip is not None:
+            source += f"|{clip_label(clip)}"
+        digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+        return f"media/{video_id}/{digest}.{container}"
+
+    async def _result_exists(self, object_key: str) -> bool:
+        indexed = bool(self._result_index.get(object_key))
+        record_cache("result_index", indexed)
+        if indexed:
+            record_cache("result", True)
+            return True
 
+        exists = await self._single_flight.do(
+            ("exists", object_key), lambda: self.storage.exists(object_key)
+        )
+        record_cache("result", exists)
+        if exists:
+            self._result_index.set(object_key, True)
+        return exists
+
+    async def _deliver(self, object_key: str, filename: str, produce: Callable[[], Awaitable],
+                       job=None) -> Tuple[str, bool]:
+        """
+        Return a pre-signed URL for object_key, running produce() to create the object only if it is
+        not already in the bucket. Concurrent calls for the same key share a single produce() run; the
+        second value tells whether this call waited on another caller's run instead of its own.
+        """
+        shared = False
+        if not await self._result_exists(object_key):
+            key = ("download", object_key)
+            # Nothing is awaited between this check and do(), so it cannot miss a run starting.
+            shared = key in self._single_flight
+            leader = self._producers.get(object_key) if shared else None
+            if leader is not None and job is not None:
+                leader.followers.append(job)
+                if leader.progress:
+                    job.update_progress(leader.progress)
+            elif not shared:
+                self._producers[object_key] = job
+            try:
+                await self._single_flight.do(key, produce)
+            finally:
+                if leader is not None and job in leader.followers:
+                    leader.followers.remove(job)
+                elif not shared and self._producers.get(object_key) is job:
+                    del self._producers[object_key]
+            self._result_index.set(object_key, True)
+
+        with stage_timer("presign", self._format_of(object_key), job):
+            return await self.storage.get_url(object_key, filename=filename), shared
+
+    async def _postprocess(self, plan: PostprocessPlan, file_path: str, job=None) -> Tuple[str, float]:
+        """Run the ffmpeg step of plan on a downloaded file, if it has one"""
+        if not plan.needs_ffmpeg:
+            return file_path, 0.0
+        if job is not None:
+            job.update_progress({"phase": "postprocess", "status": "started", "postprocessor": plan.path})
+        with stage_timer(plan.path, plan.output_format, job):
+            return await self.postprocessor.run(plan, file_path)
+
+    async def _produce(self, url: str, plan: PostprocessPlan, object_key: str, scratch_bytes: int, params: Dict,
+                       job=None, clip: Optional[Clip] = None) -> float:
+        """Create object_key from the streams chosen by plan, returning the CPU seconds post-processing used"""
+        if settings.UPLOAD_MODE == "stream":
+            # A pipe cannot be resumed, so a retried stream starts over, from freshly extracted media URLs.
+            streamed = await self.stream_retry.run(
+                lambda: self._stream_upload(url, plan, object_key, job, clip),
+                on_retry=self._retry_reporter("stream", job, url)
+            )
+            if streamed is not None:
+                return streamed
+
+        async with self.scratch.directory(scratch_bytes) as work_dir:
+            params = {
+                'format': plan.format_selector,
+                # Files are named after the video ID; the title is only used as the download file name.
+                'outtmpl': os.path.join(work_dir, OUTPUT_TEMPLATE),
+                # A retried download runs in the same directory and picks up its .part files where the
+                # failed attempt stopped. A missing fragment fails the attempt instead of leaving a gap.
+                'continuedl': True,
+                'skip_unavailable_fragments': False,
+                **params,
+            }
+            if plan.merge_format:
+                params['merge_output_format'] = plan.merge_format
+            if clip is not None:
+                params.update(self._clip_params(clip))
+
+            file_path = await self.download_retry.run(
+                lambda: self._run_download(url, params, plan.output_format, job),
+                on_retry=self._retry_reporter(
+                    "download", job, url, refresh_on=lambda e: bool(EXPIRED_URL_ERROR_PATTERN.search(str(e)))
+                )
+            )
+            file_path, cpu = await self._postprocess(plan, file_path, job)
+
+            # Hand the finished file to storage (the local backend moves it instead of copying)
+            await self._upload(file_path, object_key, job)
+        return cpu
+
+    async def _deliver_plan(self, url: str, plan: PostprocessPlan, object_key: str, filename: str,
+                            scratch_bytes: int, params: Dict, job=None, clip: Optional[Clip] = None) -> Dict:
+        """Deliver the rendition described by plan and report how it was produced"""
+        report = {"path": "cached", "cpu_seconds": 0.0}
+
+        async def produce() -> None:
+            cpu = await self._produce(url, plan, object_key, scratch_bytes, params, job, clip)
+            record_postprocess(plan.path, cpu, plan.output_format, job)
+            report.update(path=plan.path, cpu_seconds=cpu)
+
+        download_url, shared = await self._deliver(object_key, filename, produce, job)
+        if shared:
+            # Produced by a concurrent request for the same rendition; its job reports the path and CPU time.
+            report["path"] = "shared"
+        result = {
+            "status": "success",
+            "message": f"{download_url}",
+            "postprocess": report,
+            # Lets stored results (e.g. batch checkpoints) be signed again once the link has expired.
+            "object_key": object_key,
+            "filename": filename,
+        }
+        if clip is not None:
+            result["clip"] = {"start": clip[0], "end": clip[1]}
+        return result
+
+    @staticmethod
+    def _clip_range(info: Dict, start: Optional[float], end: Optional[float]) -> Optional[Clip]:
+        """The part of the video to deliver, or None when the request covers all of it"""
+        if start is None and end is None:
+            return None
+
+        duration = info.get('duration')
+        start = round(float(start or 0), 3)
+        if duration:
+            if start >= duration:
+                raise YouTubeDownloadError(f"Clip start {start:g}s is beyond the end of the video ({duration:g}s)")
+            end = duration if end is None else min(end, duration)
+        elif end is None:
+            raise YouTubeDownloadError("Clip end is required when the video duration is unknown")
+        end = round(float(end), 3)
+
+        if end <= start:
+            raise YouTubeDownloadError("Clip end must be after its start")
+        if start == 0 and duration and end >= duration:
+            return None
+        return start, end
+
+    @staticmethod
+    def _clip_params(clip: Clip) -> Dict:
+        """yt-dlp parameters downloading only the clip"""
         return {
-            "available_qualities": available_qualities,
-            "video_formats": list(available_video_formats),
-            "audio_formats": list(available_audio_formats)
+            # yt-dlp hands section downloads to ffmpeg, which seeks in the source and fetches only the
+            # DASH fragments and byte ranges that cover the clip.
+            'download_ranges': yt_dlp.utils.download_range_func(None, [clip]),
+            # Cut at keyframes and copy the streams instead of re-encoding for an exact start.
+            'force_keyframes_at_cuts': False,
         }
 
-    async def download_video(self, url: str, quality: str, output_format: str) -> Dict:
+    @staticmethod
+    def _clip_size(size: Optional[int], clip: Optional[Clip], info: Dict) -> Optional[int]:
+        """Estimated size of the clip of a download estimated at size bytes"""
+        duration = info.get('duration')
+        if not size or clip is None or not duration:
+            return size
+        return int(size * min(1.0, (clip[1] - clip[0] + CLIP_KEYFRAME_MARGIN) / duration))
+
+    async def download_video(self, url: str, quality: str, output_format: str, job=None,
+                             tuning: Optional[Dict] = None, start: Optional[float] = None,
+                             end: Optional[float] = None) -> Dict:
         try:
+            resolve_started = time.perf_counter()
             # First get available formats
             formats = await self.get_formats(url)
 
@@ -147,142 +620,101 @@ class YouTubeService:
                     f"Available formats are: {', '.join(available_formats)}"
                 )
 
-            # output_template = "downloads/%(title)s-%(resolution)s.%(ext)s"
-            output_template = f"downloads/{self.get_youtube_video_title(url)}-{quality}.{output_format}"
-            os.makedirs("downloads", exist_ok=True)
-
-            # Modified format string to ensure we get both video and audio
-            if quality == 'best':
-                format_quality_string = 'bestvideo+bestaudio/best'
-            else:
-                # Extract height from quality (e.g., '720p' -> '720')
-                height = quality.replace('p', '')
-                format_quality_string = f'bestvideo[height<={height}]+bestaudio/best[height<={height}]'
-
-            cmd = [
-                "yt-dlp",
-                "-f", format_quality_string,
-                "--merge-output-format", output_format,  # Force merge to specified format
-                "-o", output_template,
-                "--no-playlist",
-                "--no-write-thumbnail",
-                "--no-embed-thumbnail",
-                "--no-write-description",
-                "--no-write-info-json",
-                "--progress",
-                "--prefer-ffmpeg",
-                url
-            ]
-
-            print(f"\nStarting download in {quality} ({output_format} format)...")
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
+            info = await self.get_video_info(url)
+            title = await self.get_youtube_video_title(url)
+
+            # Streams the container holds as they are win, so most downloads are only remuxed.
+            index = await self.get_format_index(url)
+            plan = plan_video(index, QUALITY_HEIGHTS.get(quality), output_format)
+            # Clips are separate renditions with keys of their own.
+            clip = self._clip_range(info, start, end)
+            object_key = self._result_key(info['id'], plan.format_selector, output_format, plan.codec_args, clip)
+            tuning_params = self._tuning_params(tuning)
+            scratch_bytes = self.scratch.estimate(
+                self._clip_size(plan.size or index.estimate_size(quality, output_format), clip, info)
             )
-
-            if result.returncode != 0:
-                raise YouTubeDownloadError(f"Download failed: {result.stdout}")
-
-            # Post-download renaming: yt-dlp appends extra text to the filename, so we need to rename the file to remove it.
-            expected_filename = f"{self.get_youtube_video_title(url)}-{quality}.{output_format}"
-            expected_filepath = os.path.join("downloads", expected_filename)
-
-            # Create a glob pattern that matches files starting with the expected name but possibly with extra text before the extension.
-            # For example, if yt-dlp appends '.f248' then the file might be:
-            # "downloads/Recursion tree method ...-1080p.f248.webm"
-            pattern = os.path.join("downloads", f"{self.get_youtube_video_title(url)}-{quality}*{'.' + output_format}")
-            matching_files = glob.glob(pattern)
-
-            # Look for a file that doesn't exactly match our expected name.
-            for file_path in matching_files:
-                if os.path.basename(file_path) != expected_filename:
-                    print(f"Renaming {file_path} to {expected_filepath}")
-                    os.rename(file_path, expected_filepath)
-                    break  # Assuming only one such file exists
-
-            # Upload the downloaded video to S3
-            download_url = aws_service.upload_file(expected_filepath)
-            if not download_url:
-                raise YouTubeDownloadError("Failed to upload the downloaded video to S3")
-
-            if os.path.exists(expected_filepath):
-                os.remove(expected_filepath)
-            else:
-                print(f"The file {expected_filepath} does not exist")
-
-            return {
-                "status": "success",
-                "message": f"{download_url}",
+            record_stage("resolve", time.perf_counter() - resolve_started, output_format, job)
+
+            params = {
+                'noplaylist': True,
+                'writethumbnail': False,
+                'writedescription': False,
+                'writeinfojson': False,
+                'prefer_ffmpeg': True,
+                **tuning_params,
             }
+            name = f"{title}-{quality}" if clip is None else f"{title}-{quality}-{clip_label(clip)}"
+            logger.info(f"Starting download of {url} in {quality} ({output_format} format, {plan.path})"
+                        + (f", clip {clip_label(clip)}s" if clip else ""))
+
+            return await self._deliver_plan(url, plan, object_key, f"{name}.{output_format}",
+                                            scratch_bytes, params, job, clip)
 
         except YouTubeDownloadError:
             raise
         except Exception as e:
             raise YouTubeDownloadError(f"Error downloading video: {str(e)}")
 
-    async def download_audio(self, url: str, audio_format: str, audio_quality: str = "0") -> Dict:
-        if not audio_quality.isdigit() or int(audio_quality) not in range(10):
-            raise YouTubeDownloadError("Audio quality must be between 0 (best) and 9 (worst)")
-
-        # output_template = "downloads/%(title)s-%(abr)s.%(ext)s"
-        output_template = f"downloads/{self.get_youtube_video_title(url)}.{audio_format}"
-
-        try:
-            cmd = [
-                "yt-dlp",
-                "-f", "bestaudio",
-                "--extract-audio",
-                "--audio-format", audio_format,
-                "--audio-quality", audio_quality,
-                "-o", output_template,
-                "--no-playlist",
-                url
-            ]
-
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+    async def download_audio(self, url: str, audio_format: str, quality: str = "best", job=None,
+                             tuning: Optional[Dict] = None, start: Optional[float] = None,
+                             end: Optional[float] = None) -> Dict:
+        if audio_format not in AUDIO_FORMATS:
+            raise YouTubeDownloadError(
+                f"Requested audio format '{audio_format}' is not available. "
+                f"Available formats are: {', '.join(AUDIO_FORMATS)}"
+            )
+        if quality not in AUDIO_QUALITY_TIERS:
+            raise YouTubeDownloadError(
+                f"Requested audio quality '{quality}' is not available. "
+                f"Available qualities are: {', '.join(AUDIO_QUALITY_TIERS)}"
             )
-            stdout, stderr = await proc.communicate()
-
-            if proc.returncode != 0:
-                raise YouTubeDownloadError(f"Download failed: {stderr.decode()}")
-
-            # Post-download renaming: yt-dlp appends extra text to the filename, so we need to rename the file to remove it.
-            expected_filename = f"{self.get_youtube_video_title(url)}.{audio_format}"
-            expected_filepath = os.path.join("downloads", expected_filename)
-
-            # Create a glob pattern that matches files starting with the expected name but possibly with extra text before the extension.
-            # For example, if yt-dlp appends '.f248' then the file might be:
-            # "downloads/Recursion tree method ...-1080p.f248.webm"
-            pattern = os.path.join("downloads",
-                                   f"{self.get_youtube_video_title(url)}*{'.' + audio_format}")
-            matching_files = glob.glob(pattern)
-
-            # Look for a file that doesn't exactly match our expected name.
-            for file_path in matching_files:
-                if os.path.basename(file_path) != expected_filename:
-                    print(f"Renaming {file_path} to {expected_filepath}")
-                    os.rename(file_path, expected_filepath)
-                    break  # Assuming only one such file exists
-
-            # Upload the downloaded video to S3
-            download_url = aws_service.upload_file(expected_filepath)
-            if not download_url:
-                raise YouTubeDownloadError("Failed to upload the downloaded video to S3")
-
-            if os.path.exists(expected_filepath):
-                os.remove(expected_filepath)
-            else:
-                print(f"The file {expected_filepath} does not exist")
 
-            return {
-                "status": "success",
-                "message": f"{download_url}",
+        try:
+            resolve_started = time.perf_counter()
+            info = await self.get_video_info(url)
+            title = await self.get_youtube_video_title(url)
+            index = await self.get_format_index(url)
+            # The smallest stream meeting the tier, delivered without transcoding when it has the right codec.
+            plan = plan_audio(index, audio_format, quality)
+            clip = self._clip_range(info, start, end)
+            # Tiers that resolve to the same stream and processing share one object.
+            object_key = self._result_key(info['id'], plan.format_selector, audio_format, plan.codec_args, clip)
+            tuning_params = self._tuning_params(tuning)
+            scratch_bytes = self.scratch.estimate(self._clip_size(plan.size, clip, info))
+            record_stage("resolve", time.perf_counter() - resolve_started, audio_format, job)
+
+            params = {
+                'noplaylist': True,
+                **tuning_params,
             }
+
+            name = title if clip is None else f"{title}-{clip_label(clip)}"
+            return await self._deliver_plan(url, plan, object_key, f"{name}.{audio_format}", scratch_bytes,
+                                            params, job, clip)
+        except YouTubeDownloadError:
+            raise
         except Exception as e:
             raise YouTubeDownloadError(f"Error downloading audio: {str(e)}")
+
+    async def run_job(self, job) -> Dict:
+        """Run a queued video or audio download job, wherever the job manager runs it"""
+        params = job.params
+        if job.type == JobType.VIDEO:
+            return await self.download_video(
+                url=params["url"],
+                quality=params["quality"],
+                output_format=params["format"],
+                job=job,
+                tuning=params.get("tuning"),
+                start=params.get("start"),
+                end=params.get("end")
+            )
+        return await self.download_audio(
+            url=params["url"],
+            audio_format=params["format"],
+            quality=params.get("quality") or "best",
+            job=job,
+            tuning=params.get("tuning"),
+            start=params.get("start"),
+            end=params.get("end")
+        )
@@ -0,0 +1,473 @@
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import yt_dlp
+
+from ..core.config_settings import settings
+from ..core.exceptions import YouTubeDownloadError
+from ..core.metrics import record_spawn
+
+ProgressCallback = Callable[[Dict], None]
+
+# Machine readable progress lines printed by the yt-dlp CLI (one per update thanks to --newline).
+PROGRESS_TEMPLATE = (
+    "download:[progress] %(progress.status)s|%(progress.downloaded_bytes)s|%(progress.total_bytes)s|"
+    "%(progress.total_bytes_estimate)s|%(progress.speed)s|%(progress.eta)s|"
+    "%(progress.fragment_index)s|%(progress.fragment_count)s|%(info.format_id)s"
+)
+POSTPROCESS_TEMPLATE = "postprocess:[postprocess] %(progress.status)s|%(progress.postprocessor)s"
+# Final path of every downloaded file, printed once it has been moved into place.
+FILEPATH_TEMPLATE = "after_move:[filepath] %(filepath)s"
+
+# Options shared by every extraction, whatever the backend.
+EXTRACT_PARAMS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+}
+# Playlist/channel expansion: list the entries without resolving each video.
+FLAT_PLAYLIST_PARAMS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+}
+
+
+def _download_progress(status: str, downloaded, total, speed, eta, fragment_index, fragment_count,
+                       format_id) -> Dict:
+    progress = {
+        "phase": "download",
+        "status": status,
+        "format_id": format_id,
+        "downloaded_bytes": downloaded,
+        "total_bytes": total,
+        "speed": speed,
+        "eta": eta,
+        "fragment_index": fragment_index,
+        "fragment_count": fragment_count,
+    }
+    if downloaded is not None and total:
+        progress["percent"] = round(100 * downloaded / total, 1)
+    return progress
+
+
+class YtDlpEngine:
+    """
+    Runs yt-dlp extractions and downloads.
+
+    Both operations take yt-dlp API parameters (the same dict yt_dlp.YoutubeDL accepts) so callers do
+    not need to know which backend is in use.
+    """
+
+    name = "base"
+
+    def version(self) -> str:
+        raise NotImplementedError
+
+    async def extract_info(self, url: str, params: Dict = None) -> Dict:
+        raise NotImplementedError
+
+    async def download(self, url: str, params: Dict, on_progress: ProgressCallback = None,
+                       info: Dict = None) -> List[str]:
+        """
+        Download url and return the final paths of the written files, after all post-processing.
+
+        With info (as returned by extract_info), the download works from it instead of extracting url again.
+        """
+        raise NotImplementedError
+
+    def iter_entries(self, url: str) -> AsyncIterator[Dict]:
+        """Yield the flat entries of a playlist or channel one by one, fetching pages only as needed"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessEngine(YtDlpEngine):
+    """
+    Runs YoutubeDL objects on worker threads of this process.
+
+    The yt_dlp package and its extractors are imported once, and every extraction thread keeps its
+    YoutubeDL objects between calls, so initialised extractors are reused instead of paying
+    interpreter start-up and extractor import on every call.
+    """
+
+    name = "inprocess"
+
+    def __init__(self, max_workers: int = None):
+        self._extract_executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.YTDLP_ENGINE_WORKERS, thread_name_prefix="yt-dlp-extract"
+        )
+        self._download_executor = ThreadPoolExecutor(
+            max_workers=settings.JOB_WORKERS, thread_name_prefix="yt-dlp-download"
+        )
+        self._local = threading.local()
+
+    def version(self) -> str:
+        return yt_dlp.version.__version__
+
+    def _get_extractor(self, params: Dict) -> yt_dlp.YoutubeDL:
+        # YoutubeDL is not thread-safe, so each thread keeps its own instance per parameter set.
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        key = json.dumps(params, sort_keys=True, default=str)
+        ydl = instances.get(key)
+        if ydl is None:
+            ydl = instances[key] = yt_dlp.YoutubeDL(params)
+        return ydl
+
+    def _extract(self, url: str, params: Dict) -> Dict:
+        ydl = self._get_extractor(params)
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+    async def extract_info(self, url: str, params: Dict = None) -> Dict:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._extract_executor, self._extract, url,
+                                              {**EXTRACT_PARAMS, **(params or {})})
+        except yt_dlp.utils.YoutubeDLError as e:
+            raise YouTubeDownloadError(f"Failed to extract video info: {str(e)}")
+
+    async def download(self, url: str, params: Dict, on_progress: ProgressCallback = None,
+                       info: Dict = None) -> List[str]:
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        filepaths = []
+
+        def report(progress: Dict) -> None:
+            if on_progress is not None:
+                loop.call_soon_threadsafe(on_progress, progress)
+
+        def progress_hook(d: Dict) -> None:
+            # Raising from a hook is how a running yt-dlp download is interrupted.
+            if cancelled.is_set():
+                raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+            report(_download_progress(
+                d.get('status'),
+                d.get('downloaded_bytes'),
+                d.get('total_bytes') or d.get('total_bytes_estimate'),
+                int(d['speed']) if d.get('speed') else None,
+                d.get('eta'),
+                d.get('fragment_index'),
+                d.get('fragment_count'),
+                (d.get('info_dict') or {}).get('format_id'),
+            ))
+
+        def postprocessor_hook(d: Dict) -> None:
+            if cancelled.is_set():
+                raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+            report({"phase": "postprocess", "status": d.get('status'), "postprocessor": d.get('postprocessor')})
+
+        def run() -> None:
+            ydl_params = {
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                **params,
+                'progress_hooks': [progress_hook],
+                'postprocessor_hooks': [postprocessor_hook],
+                # Called with the final path once all post-processors have run.
+                'post_hooks': [filepaths.append],
+            }
+            with yt_dlp.YoutubeDL(ydl_params) as ydl:
+                if info is not None:
+                    # Drop the formats selected at extraction, as --load-info-json does. This also copies the
+                    # dict, which yt-dlp adds the requested downloads to and callers may share.
+                    ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+                elif ydl.download([url]) != 0:
+                    raise YouTubeDownloadError("Download failed")
+
+        future = loop.run_in_executor(self._download_executor, run)
+        try:
+            await asyncio.shield(future)
+            return filepaths
+        except asyncio.CancelledError:
+            # Let the worker thread notice the flag and unwind before releasing the caller.
+            cancelled.set()
+            await asyncio.gather(future, return_exceptions=True)
+            raise
+        except yt_dlp.utils.YoutubeDLError as e:
+            raise YouTubeDownloadError(f"Download failed: {str(e)}")
+
+    async def iter_entries(self, url: str) -> AsyncIterator[Dict]:
+        loop = asyncio.get_running_loop()
+        # A dedicated instance: the entries generator keeps using it between our calls.
+        ydl = yt_dlp.YoutubeDL(FLAT_PLAYLIST_PARAMS)
+        done = object()
+
+        try:
+            result = await loop.run_in_executor(
+                self._extract_executor, partial(ydl.extract_info, url, download=False, process=False)
+            )
+            # Channel and handle URLs first resolve to the URL of the actual listing.
+            for _ in range(3):
+                if result.get('_type') not in ('url', 'url_transparent'):
+                    break
+                result = await loop.run_in_executor(
+                    self._extract_executor, partial(ydl.extract_info, result['url'], download=False, process=False)
+                )
+
+            if result.get('_type') not in ('playlist', 'multi_video'):
+                yield result
+                return
+
+            entries = iter(result.get('entries') or [])
+            while True:
+                entry = await loop.run_in_executor(self._extract_executor, next, entries, done)
+                if entry is done:
+                    break
+                yield entry
+        except yt_dlp.utils.YoutubeDLError as e:
+            raise YouTubeDownloadError(f"Failed to list playlist entries: {str(e)}")
+
+    def close(self) -> None:
+        self._extract_executor.shutdown(wait=False, cancel_futures=True)
+        self._download_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SubprocessEngine(YtDlpEngine):
+    """
+    Runs every call as a separate yt-dlp CLI process. Kept as a fallback backend.
+    """
+
+    name = "subprocess"
+
+    # yt-dlp API parameters and the CLI options they correspond to.
+    VALUE_OPTIONS = {
+        'format': '-f',
+        'merge_output_format': '--merge-output-format',
+        'outtmpl': '-o',
+        'concurrent_fragment_downloads': '-N',
+        'http_chunk_size': '--http-chunk-size',
+        'buffersize': '--buffer-size',
+        'ratelimit': '-r',
+    }
+    FLAG_OPTIONS = {
+        'noplaylist': ('--no-playlist', '--yes-playlist'),
+        'skip_download': ('--skip-download', None),
+        'writethumbnail': ('--write-thumbnail', '--no-write-thumbnail'),
+        'writedescription': ('--write-description', '--no-write-description'),
+        'writeinfojson': ('--write-info-json', '--no-write-info-json'),
+        'prefer_ffmpeg': ('--prefer-ffmpeg', None),
+        'continuedl': ('--continue', '--no-continue'),
+        'skip_unavailable_fragments': ('--skip-unavailable-fragments', '--abort-on-unavailable-fragments'),
+        'force_keyframes_at_cuts': ('--force-keyframes-at-cuts', '--no-force-keyframes-at-cuts'),
+    }
+    IGNORED_OPTIONS = ('quiet', 'no_warnings', 'noprogress')
+
+    def version(self) -> str:
+        record_spawn("yt-dlp")
+        try:
+            result = subprocess.run(["yt-dlp", "--version"], capture_output=True, text=True, check=True)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            raise YouTubeDownloadError("yt-dlp is not installed")
+        return result.stdout.strip()
+
+    @classmethod
+    def params_to_args(cls, params: Dict) -> List[str]:
+        """Translate yt-dlp API parameters into CLI options"""
+        args = []
+        for key, value in params.items():
+            if key in cls.IGNORED_OPTIONS:
+                continue
+            if key in cls.VALUE_OPTIONS:
+                args += [cls.VALUE_OPTIONS[key], str(value)]
+            elif key in cls.FLAG_OPTIONS:
+                option = cls.FLAG_OPTIONS[key][0 if value else 1]
+                if option:
+                    args.append(option)
+            elif key == 'postprocessors':
+                args += cls._postprocessors_to_args(value)
+            elif key == 'download_ranges':
+                args += [arg for start, end in value.ranges for arg in ("--download-sections", f"*{start}-{end}")]
+            elif key == 'external_downloader':
+                args += ["--downloader", value['default']]
+            elif key == 'external_downloader_args':
+                args += ["--downloader-args", shlex.join(value['default'])]
+            else:
+                raise ValueError(f"yt-dlp parameter '{key}' is not supported by the subprocess engine")
+        return args
+
+    @staticmethod
+    def _postprocessors_to_args(postprocessors: List[Dict]) -> List[str]:
+        args = []
+        for pp in postprocessors:
+            if pp.get('key') == 'FFmpegExtractAudio':
+                args += ["--extract-audio", "--audio-format", pp.get('preferredcodec', 'best')]
+                if pp.get('preferredquality') is not None:
+                    args += ["--audio-quality", str(pp['preferredquality'])]
+            else:
+                raise ValueError(f"Post-processor '{pp.get('key')}' is not supported by the subprocess engine")
+        return args
+
+    @staticmethod
+    async def run_command(cmd: List[str], on_line: Callable[[str], None] = None) -> Tuple[int, str, str]:
+        """
+        Run a command without blocking the event loop, killing it if the caller is cancelled.
+
+        stdout is read incrementally so that on_line sees every line as soon as it is printed.
+        """
+        record_spawn(cmd[0])
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=16 * 1024 * 1024
+        )
+        # Drain stderr concurrently so a chatty process cannot fill the pipe and stall.
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        stdout_lines = []
+        try:
+            async for raw_line in proc.stdout:
+                line = raw_line.decode(errors="replace").rstrip()
+                stdout_lines.append(line)
+                if on_line is not None:
+                    on_line(line)
+            stderr = await stderr_task
+            await proc.wait()
+        except asyncio.CancelledError:
+            proc.kill()
+            stderr_task.cancel()
+            await proc.wait()
+            raise
+
+        return proc.returncode, "\n".join(stdout_lines), stderr.decode(errors="replace")
+
+    @staticmethod
+    def parse_progress(line: str) -> Optional[Dict]:
+        """Turn a line printed with PROGRESS_TEMPLATE or POSTPROCESS_TEMPLATE into a progress dict"""
+
+        def _number(value: str):
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+
+        if line.startswith("[progress] "):
+            fields = line[len("[progress] "):].split("|")
+            if len(fields) != 9:
+                return None
+            status, downloaded, total, estimate, speed, eta, fragment_index, fragment_count, format_id = fields
+            return _download_progress(
+                status,
+                _number(downloaded),
+                _number(total) or _number(estimate),
+                _number(speed),
+                _number(eta),
+                _number(fragment_index),
+                _number(fragment_count),
+                format_id if format_id != "NA" else None,
+            )
+
+        if line.startswith("[postprocess] "):
+            status, _, postprocessor = line[len("[postprocess] "):].partition("|")
+            return {"phase": "postprocess", "status": status, "postprocessor": postprocessor}
+
+        # yt-dlp announces the merge step on its own line before the post-processor hooks fire.
+        if line.startswith("[Merger]"):
+            return {"phase": "postprocess", "status": "started", "postprocessor": "Merger"}
+
+        return None
+
+    async def extract_info(self, url: str, params: Dict = None) -> Dict:
+        extract_params = {**EXTRACT_PARAMS, **(params or {})}
+        extract_params.pop('skip_download')
+        cmd = ["yt-dlp", "-J", *self.params_to_args(extract_params), url]
+
+        returncode, stdout, stderr = await self.run_command(cmd)
+        if returncode != 0:
+            raise YouTubeDownloadError(f"Failed to extract video info: {stderr}")
+        return json.loads(stdout)
+
+    async def download(self, url: str, params: Dict, on_progress: ProgressCallback = None,
+                       info: Dict = None) -> List[str]:
+        source = [url]
+        if info is not None:
+            # Written to the download's scratch directory, next to its output.
+            fd, info_path = tempfile.mkstemp(suffix=".info.json",
+                                             dir=os.path.dirname(params.get('outtmpl', '')) or None)
+            with os.fdopen(fd, "w") as fh:
+                json.dump(info, fh)
+            source = ["--load-info-json", info_path]
+
+        cmd = [
+            "yt-dlp",
+            *self.params_to_args(params),
+            # --print implies --simulate and --quiet; keep downloading and keep the progress lines.
+            "--print", FILEPATH_TEMPLATE,
+            "--no-simulate",
+            "--progress",
+            "--newline",
+            "--progress-template", PROGRESS_TEMPLATE,
+            "--progress-template", POSTPROCESS_TEMPLATE,
+            *source
+        ]
+        filepaths = []
+
+        def on_line(line: str) -> None:
+            if line.startswith("[filepath] "):
+                filepaths.append(line[len("[filepath] "):])
+                return
+            progress = self.parse_progress(line)
+            if progress is not None and on_progress is not None:
+                on_progress(progress)
+
+        try:
+            returncode, stdout, stderr = await self.run_command(cmd, on_line=on_line)
+        finally:
+            if info is not None:
+                os.remove(info_path)
+        if returncode != 0:
+            raise YouTubeDownloadError(f"Download failed: {stderr}")
+        return filepaths
+
+    async def iter_entries(self, url: str) -> AsyncIterator[Dict]:
+        # -j with --flat-playlist prints one JSON object per entry as soon as it is listed.
+        record_spawn("yt-dlp")
+        proc = await asyncio.create_subprocess_exec(
+            "yt-dlp", "-j", "--flat-playlist", "--yes-playlist", "--no-warnings", url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=16 * 1024 * 1024
+        )
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            async for raw_line in proc.stdout:
+                if raw_line.strip():
+                    yield json.loads(raw_line)
+            stderr = await stderr_task
+            if await proc.wait() != 0:
+                raise YouTubeDownloadError(f"Failed to list playlist entries: {stderr.decode(errors='replace')}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            stderr_task.cancel()
+
+
+ENGINES = {
+    InProcessEngine.name: InProcessEngine,
+    SubprocessEngine.name: SubprocessEngine,
+}
+
+
+def create_engine(name: str = None) -> YtDlpEngine:
+    name = name or settings.YTDLP_ENGINE
+    if name not in ENGINES:
+        raise YouTubeDownloadError(f"Unknown yt-dlp engine '{name}'. Available engines: {', '.join(ENGINES)}")
+    return ENGINES[name]()
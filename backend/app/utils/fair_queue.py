@@ -0,0 +1,61 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Hashable
+
+
+class FairQueue:
+    """
+    asyncio queue that serves clients by weighted round-robin instead of first come, first served.
+
+    Items are kept in one FIFO per client. get() takes up to `weight` items in a row from the client at
+    the head of the rotation before moving on to the next one, so a client with a long backlog cannot
+    delay another client's first job by more than one round.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self._queues: Dict[Hashable, Deque[Any]] = {}
+        self._weights: Dict[Hashable, int] = {}
+        self._rotation: Deque[Hashable] = deque()
+        self._served = 0
+        self._size = 0
+        self._available = asyncio.Semaphore(0)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def pending(self, client: Hashable) -> int:
+        return len(self._queues.get(client, ()))
+
+    def put_nowait(self, item: Any, client: Hashable = None, weight: int = 1) -> None:
+        if self.maxsize and self._size >= self.maxsize:
+            raise asyncio.QueueFull
+
+        queue = self._queues.get(client)
+        if queue is None:
+            queue = self._queues[client] = deque()
+            self._rotation.append(client)
+        queue.append(item)
+        self._weights[client] = max(1, weight)
+        self._size += 1
+        self._available.release()
+
+    async def get(self) -> Any:
+        await self._available.acquire()
+
+        client = self._rotation[0]
+        queue = self._queues[client]
+        item = queue.popleft()
+        self._size -= 1
+        self._served += 1
+
+        if not queue:
+            # Nothing left for this client: drop it from the rotation until it submits again.
+            self._rotation.popleft()
+            del self._queues[client]
+            del self._weights[client]
+            self._served = 0
+        elif self._served >= self._weights[client]:
+            self._rotation.rotate(-1)
+            self._served = 0
+        return item
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter keyed by client.
+
+    Each client may spend up to `burst` tokens at once and regains `rate` tokens per second. Buckets of
+    the least recently seen clients are dropped once more than max_clients are tracked; a dropped
+    bucket simply starts full again.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, cost: float = 1.0) -> float:
+        """
+        Take cost tokens from the client's bucket.
+
+        Returns 0 when the request is allowed, otherwise the number of seconds until enough tokens
+        will have accumulated (nothing is taken in that case).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= cost:
+                tokens -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - tokens) / self.rate if self.rate > 0 else float("inf")
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return retry_after
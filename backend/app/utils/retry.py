@@ -0,0 +1,102 @@
+import asyncio
+import random
+import re
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from loguru import logger
+
+from ..core.config_settings import settings
+from ..core.metrics import RETRIES
+
+T = TypeVar("T")
+RetryCallback = Callable[[int, BaseException, float], None]
+
+# Failures that a later attempt cannot fix, whatever the rest of the message says.
+PERMANENT_PATTERN = re.compile(
+    r"video unavailable|private video|sign in to|members-only|copyright|has been removed|"
+    r"is not available|requested format|not supported|no space left",
+    re.IGNORECASE
+)
+# Network blips, expired or throttled media URLs and overloaded servers, as reported by yt-dlp and ffmpeg.
+TRANSIENT_PATTERN = re.compile(
+    r"http error (403|408|429|5\d\d)|server returned (403|408|429|5\d\d|5xx)|timed out|timeout|"
+    r"connection (reset|refused|aborted)|broken pipe|incompleteread|bytes read, \d+ more expected|remote end closed|"
+    r"temporary failure in name resolution|did not get any data|"
+    r"giving up after \d+ (fragment )?retries|end of file|input/output error",
+    re.IGNORECASE
+)
+# S3 error codes and botocore exceptions worth another attempt.
+TRANSIENT_S3_CODES = {
+    "SlowDown", "Throttling", "ThrottlingException", "RequestTimeout", "RequestTimeoutException",
+    "InternalError", "ServiceUnavailable", "500", "502", "503", "504",
+}
+TRANSIENT_EXCEPTION_NAMES = {
+    "EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError", "ConnectTimeoutError",
+    "ResponseStreamingError", "IncompleteReadError",
+}
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether exc (or an exception it was raised from) looks like a failure worth retrying"""
+    while exc is not None:
+        if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+            return True
+        if type(exc).__name__ in TRANSIENT_EXCEPTION_NAMES:
+            return True
+
+        # botocore ClientError
+        response = getattr(exc, "response", None)
+        if isinstance(response, dict):
+            return response.get("Error", {}).get("Code") in TRANSIENT_S3_CODES
+
+        message = str(exc)
+        if PERMANENT_PATTERN.search(message):
+            return False
+        if TRANSIENT_PATTERN.search(message):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class RetryPolicy:
+    """
+    Retries a pipeline stage after transient failures, with exponential backoff and full jitter.
+
+    Attempt n waits a random time between 0 and min(max_delay, base_delay * 2 ** (n - 1)) before the
+    next one, so clients failing together do not retry in lockstep. The stage itself decides what a
+    retry keeps: downloads resume from their .part files, uploads from their completed parts.
+    """
+
+    def __init__(self, stage: str, attempts: int, base_delay: float = None, max_delay: float = None,
+                 retry_on: Callable[[BaseException], bool] = is_transient):
+        self.stage = stage
+        self.attempts = max(1, attempts)
+        self.base_delay = settings.RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = settings.RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.retry_on = retry_on
+
+    @classmethod
+    def for_stage(cls, stage: str) -> "RetryPolicy":
+        """The policy configured for stage by its RETRY_<STAGE>_ATTEMPTS setting"""
+        return cls(stage, getattr(settings, f"RETRY_{stage.upper()}_ATTEMPTS"))
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(self, fn: Callable[[], Awaitable[T]], on_retry: Optional[RetryCallback] = None) -> T:
+        """Await fn() until it succeeds, fails permanently or runs out of attempts"""
+        attempt = 1
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                if attempt >= self.attempts or not self.retry_on(e):
+                    raise
+                delay = self.delay(attempt)
+                logger.warning(f"{self.stage} failed (attempt {attempt}/{self.attempts}), "
+                               f"retrying in {delay:.1f}s: {e}")
+                RETRIES.labels(stage=self.stage).inc()
+                if on_retry is not None:
+                    on_retry(attempt, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the work; callers arriving while it is in flight wait for the
+    same result, and a failure is raised in every waiting caller. Nothing is cached once the call
+    completes. The work is cancelled only when every waiter has been cancelled.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Dict[str, Any]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = {"task": asyncio.create_task(fn()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._forget(key, call))
+
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        except asyncio.CancelledError:
+            if call["waiters"] == 1 and not call["task"].done():
+                # Last waiter gone: stop the work and let the next caller start afresh.
+                self._forget(key, call)
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def _forget(self, key: Hashable, call: Dict[str, Any]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -1,4 +1,5 @@
 import re
+from typing import Optional
 
 
 def validate_youtube_url(url: str) -> bool:
@@ -8,4 +9,33 @@ def validate_youtube_url(url: str) -> bool:
         '(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
 
     match = re.match(youtube_regex, url)
-    return bool(match)
\ No newline at end of file
+    return bool(match)
+
+
+def validate_video_id(video_id: str) -> bool:
+    """Check for a bare 11 character YouTube video ID"""
+    return bool(re.fullmatch(r'[0-9A-Za-z_-]{11}', video_id))
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Return the canonical 11 character video ID of a YouTube URL, or None for anything else (channels, playlists)"""
+    # The ID must end the URL or be followed by a character that cannot be part of one, so that
+    # e.g. the first 11 characters of a channel name are not taken for an ID.
+    youtube_regex = (
+        r'(https?://)?(www\.)?'
+        r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
+        r'(watch\?v=|embed/|v/|shorts/|.+[?&]v=)?([0-9A-Za-z_-]{11})(?=$|[^0-9A-Za-z_-])')
+
+    match = re.match(youtube_regex, url)
+    return match.group(6) if match else None
+
+
+def validate_youtube_playlist_url(url: str) -> bool:
+    """Check for a YouTube playlist or channel URL (anything that lists several videos)"""
+    playlist_regex = (
+        r'(https?://)?(www\.|m\.)?youtube\.com/'
+        r'((playlist|watch)\?.*\blist=[\w-]+'
+        r'|(@[\w.-]+|channel/UC[\w-]{22}|c/[\w.-]+|user/[\w.-]+)(/(videos|shorts|streams|playlists))?/?$)'
+    )
+
+    return bool(re.match(playlist_regex, url))
@@ -0,0 +1,45 @@
+"""
+Standalone download worker.
+
+Claims jobs from the shared job store and runs them, so downloads scale out independently of the API:
+
+    JOB_STORE=redis python -m app.worker
+
+Run the API with the same JOB_STORE (and API_RUN_WORKERS=false to keep downloads off the API nodes).
+"""
+import asyncio
+import signal
+import sys
+
+from loguru import logger
+
+from .core.config_settings import settings
+from .services.job_service import DistributedJobManager
+from .services.youtube_service import YouTubeService
+
+
+async def main() -> None:
+    if settings.JOB_STORE == "memory":
+        sys.exit("Workers need a shared job store: set JOB_STORE to sqlite or redis")
+
+    youtube = YouTubeService()
+    manager = DistributedJobManager(youtube.run_job, run_workers=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    youtube.scratch.start()
+    manager.start()
+    logger.info(f"Worker {manager.worker_id} running {manager.max_workers} jobs at a time "
+                f"from the {settings.JOB_STORE} job store")
+
+    await stop.wait()
+    logger.info(f"Worker {manager.worker_id} shutting down, releasing its running jobs")
+    await manager.shutdown()
+    await youtube.scratch.stop()
+    youtube.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,327 @@
+"""
+End-to-end load test of the HTTP API, fully offline.
+
+Runs the FastAPI app under uvicorn with:
+  - a fake YouTube extractor (benchmarks/yt_dlp_plugins) that resolves every video to synthetic DASH
+    and progressive media generated with ffmpeg and served from a local HTTP server,
+  - moto's S3 server as the bucket (or the local storage backend with --storage local),
+and reports requests/sec, p50/p99 latency, peak RSS and peak scratch disk usage per endpoint.
+
+Every request uses a distinct video ID by default, so downloads run the whole pipeline instead of
+hitting the result cache; pass --videos 1 to measure the cached path.
+
+Usage (from the backend directory, ffmpeg on PATH):
+    python -m benchmarks.bench_api --requests 20 --concurrency 4
+    python -m benchmarks.bench_api --endpoints formats --requests 500 --concurrency 50 --output run.json
+    python -m benchmarks.bench_api --endpoints formats_get --videos 1 --requests 500 --concurrency 50
+    python -m benchmarks.bench_api --endpoints video audio --duration 600 --clip 300 330
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .common import free_port, percentile, print_table, serve_directory, set_default_env
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _clip(args) -> dict:
+    return {"start": args.clip[0], "end": args.clip[1]} if args.clip else {}
+
+
+ENDPOINTS = {
+    "formats": ("/app/v1/youtube/formats", lambda url, args: {"url": url}),
+    # GET endpoints have no body; their path is filled in with the video ID.
+    "formats_get": ("/app/v1/youtube/formats/{video_id}", None),
+    "video": ("/app/v1/youtube/download/video",
+              lambda url, args: {"url": url, "quality": args.quality, "format": "mp4", **_clip(args)}),
+    "audio": ("/app/v1/youtube/download/audio",
+              lambda url, args: {"url": url, "format": args.audio_format, "quality": args.audio_quality,
+                                 **_clip(args)}),
+}
+
+
+def build_media(directory: str, duration: int) -> None:
+    """Generate a 360p/720p/128k/48k audio DASH set and a progressive 360p file, plus the fake extractor's manifest"""
+    source = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=25",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(duration),
+    ]
+    subprocess.run(source + [
+        "-filter_complex", "[0:v]split=2[a][b];[a]scale=640:360[v360];[b]copy[v720]",
+        "-map", "[v360]", "-map", "[v720]", "-map", "1:a", "-map", "1:a",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "25", "-c:a", "aac", "-b:a:0", "128k", "-b:a:1", "48k",
+        "-f", "dash", "-seg_duration", "2", "-use_template", "1", "-use_timeline", "0",
+        "-init_seg_name", "init-$RepresentationID$.m4s",
+        "-media_seg_name", "chunk-$RepresentationID$-$Number%05d$.m4s",
+        os.path.join(directory, "manifest.mpd"),
+    ], check=True)
+    subprocess.run(source + [
+        "-vf", "scale=640:360", "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac",
+        "-movflags", "+faststart", os.path.join(directory, "progressive.mp4"),
+    ], check=True)
+
+    def fragments(representation: int):
+        paths = [f"init-{representation}.m4s"] + sorted(
+            os.path.basename(path) for path in glob.glob(os.path.join(directory, f"chunk-{representation}-*.m4s"))
+        )
+        return paths, sum(os.path.getsize(os.path.join(directory, path)) for path in paths)
+
+    formats = []
+    for representation, (format_id, height) in enumerate((("134", 360), ("136", 720))):
+        paths, size = fragments(representation)
+        formats.append({
+            "format_id": format_id, "ext": "mp4", "vcodec": "avc1.4d401f", "acodec": "none",
+            "width": height * 16 // 9, "height": height, "fps": 25, "filesize": size, "fragments": paths,
+            "manifest_stream_number": representation,
+        })
+    for representation, (format_id, abr) in enumerate((("140", 128), ("139", 48)), start=2):
+        paths, size = fragments(representation)
+        formats.append({
+            "format_id": format_id, "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": abr,
+            "filesize": size, "fragments": paths, "manifest_stream_number": representation,
+        })
+    formats.append({
+        "format_id": "18", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "width": 640,
+        "height": 360, "fps": 25, "filesize": os.path.getsize(os.path.join(directory, "progressive.mp4")),
+        "path": "progressive.mp4",
+    })
+
+    with open(os.path.join(directory, "manifest.json"), "w") as fh:
+        json.dump({"duration": duration, "formats": formats}, fh)
+
+
+def start_s3(bucket: str) -> object:
+    from moto.server import ThreadedMotoServer
+    import boto3
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    os.environ["S3_ENDPOINT_URL"] = f"http://127.0.0.1:{port}"
+    boto3.client(
+        "s3", endpoint_url=os.environ["S3_ENDPOINT_URL"], region_name="us-east-1",
+        aws_access_key_id="benchmark", aws_secret_access_key="benchmark"
+    ).create_bucket(Bucket=bucket)
+    return server
+
+
+def _rss_bytes(pid: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class ResourceSampler:
+    """
+    Samples the RSS of this process plus its child processes (yt-dlp, ffmpeg) and the size of the
+    scratch directory in a background thread, keeping the peaks.
+    """
+
+    def __init__(self, scratch_dir: str, interval: float = 0.05):
+        self.scratch_dir = scratch_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _children(self):
+        for path in glob.glob("/proc/self/task/*/children"):
+            # Threads exit between the glob and the read; skip them rather than killing the sampler.
+            try:
+                with open(path) as fh:
+                    children = fh.read().split()
+            except OSError:
+                continue
+            yield from children
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = _rss_bytes("self") + sum(_rss_bytes(pid) for pid in self._children())
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_disk = max(self.peak_disk, _directory_size(self.scratch_dir))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "ResourceSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+async def bench_endpoint(base_url: str, name: str, args, scratch_dir: str, run: int) -> dict:
+    import httpx
+
+    path, body = ENDPOINTS[name]
+    latencies, errors = [], []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    def video_url(index: int) -> str:
+        # 11-character IDs unique per endpoint run, cycled over --videos distinct videos.
+        video = index % (args.videos or args.requests)
+        return f"https://www.youtube.com/watch?v=b{run:02d}{video:08d}"
+
+    async def one_request(client, index: int) -> None:
+        async with slots:
+            started = time.perf_counter()
+            url = video_url(index)
+            if body is None:
+                response = await client.get(path.format(video_id=url.rsplit("=", 1)[1]))
+            else:
+                response = await client.post(path, json=body(url, args))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(f"{response.status_code}: {response.text[:200]}")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        with ResourceSampler(scratch_dir) as sampler:
+            wall_started = time.perf_counter()
+            await asyncio.gather(*(one_request(client, index) for index in range(args.requests)))
+            wall_time = time.perf_counter() - wall_started
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "rps": args.requests / wall_time,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": sampler.peak_rss / 2 ** 20,
+        "peak_disk_mb": sampler.peak_disk / 2 ** 20,
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at the same time")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--videos", type=int, default=0,
+                        help="Distinct video IDs per endpoint (default: one per request, i.e. no cache hits)")
+    parser.add_argument("--storage", default="s3", choices=["s3", "local"])
+    parser.add_argument("--engine", default="inprocess", choices=["inprocess", "subprocess"])
+    parser.add_argument("--upload-mode", default="file", choices=["file", "stream"])
+    parser.add_argument("--quality", default="720p")
+    parser.add_argument("--audio-format", default="mp3")
+    parser.add_argument("--audio-quality", default="best", choices=["low", "medium", "high", "best"])
+    parser.add_argument("--duration", type=int, default=10, help="Length of the synthetic media in seconds")
+    parser.add_argument("--clip", type=float, nargs=2, metavar=("START", "END"),
+                        help="Download only this clip (in seconds) of the video and audio")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg is required to generate the synthetic media")
+
+    workdir = tempfile.mkdtemp(prefix="bench-api-")
+    media_dir = os.path.join(workdir, "media")
+    scratch_dir = os.path.join(workdir, "scratch")
+    os.makedirs(media_dir)
+    build_media(media_dir, args.duration)
+    media_server = serve_directory(media_dir)
+
+    set_default_env()
+    os.environ.update({
+        "BENCH_MEDIA_URL": f"http://127.0.0.1:{media_server.server_address[1]}",
+        "YTDLP_ENGINE": args.engine,
+        "UPLOAD_MODE": args.upload_mode,
+        "STORAGE_BACKEND": args.storage,
+        "SCRATCH_DIR": scratch_dir,
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, "storage"),
+        # All benchmark traffic comes from one address; measure throughput, not the rate limiter.
+        "RATE_LIMIT_ENABLED": "false",
+        "ADMISSION_MAX_JOBS_PER_CLIENT": str(args.requests),
+        "ADMISSION_MAX_QUEUED_JOBS": str(args.requests),
+        "JOB_QUEUE_MAX_SIZE": str(max(args.requests, 100)),
+        # The CLI engine finds the fake extractor through PYTHONPATH.
+        "PYTHONPATH": os.pathsep.join(filter(None, [BENCHMARKS_DIR, os.environ.get("PYTHONPATH")])),
+    })
+    sys.path.insert(0, BENCHMARKS_DIR)
+    s3_server = start_s3(os.environ["S3_BUCKET_NAME"]) if args.storage == "s3" else None
+
+    import uvicorn
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    from app.main import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        results = [
+            asyncio.run(bench_endpoint(f"http://127.0.0.1:{port}", name, args, scratch_dir, run))
+            for run, name in enumerate(args.endpoints)
+        ]
+    finally:
+        server.should_exit = True
+        server_thread.join()
+        media_server.shutdown()
+        if s3_server is not None:
+            s3_server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results, ["endpoint", "requests", "concurrency", "errors", "rps", "p50_ms", "p99_ms",
+                          "peak_rss_mb", "peak_disk_mb"])
+    for result in results:
+        if result["first_error"]:
+            print(f"{result['endpoint']}: first error: {result['first_error']}")
+    print(f"max RSS of child processes: {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"revision": _git_revision(), "args": vars(args), "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-call overhead of the yt-dlp engines.
+
+Serves a small media file from a local HTTP server and runs the same metadata extraction through
+every engine, so the numbers reflect engine overhead (process start-up, extractor import and
+initialisation) rather than network latency.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_engine --calls 20 --concurrency 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from .common import percentile, print_table, serve_directory, set_default_env
+
+set_default_env()
+
+from app.services.ytdlp_engine import ENGINES  # noqa: E402
+
+
+def start_media_server(directory: str):
+    with open(os.path.join(directory, "sample.mp4"), "wb") as fh:
+        fh.write(os.urandom(256 * 1024))
+    return serve_directory(directory)
+
+
+async def bench_engine(name: str, url: str, calls: int, concurrency: int) -> dict:
+    engine = ENGINES[name]()
+
+    started = time.perf_counter()
+    engine.version()
+    version_time = time.perf_counter() - started
+
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one_call():
+        async with slots:
+            call_started = time.perf_counter()
+            await engine.extract_info(url)
+            latencies.append(time.perf_counter() - call_started)
+
+    # The first call includes one-off warm-up (imports, thread start-up) and is reported separately.
+    first_started = time.perf_counter()
+    await engine.extract_info(url)
+    first_call = time.perf_counter() - first_started
+
+    wall_started = time.perf_counter()
+    await asyncio.gather(*(one_call() for _ in range(calls)))
+    wall_time = time.perf_counter() - wall_started
+    engine.close()
+
+    latencies.sort()
+    return {
+        "engine": name,
+        "version_check_ms": version_time * 1000,
+        "first_call_ms": first_call * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "calls_per_sec": calls / wall_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20, help="Extractions per engine (after warm-up)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent extractions")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_media_server(directory)
+        url = f"http://127.0.0.1:{server.server_address[1]}/sample.mp4"
+        try:
+            results = [asyncio.run(bench_engine(name, url, args.calls, args.concurrency)) for name in args.engines]
+        finally:
+            server.shutdown()
+
+    print_table(results, ["engine", "version_check_ms", "first_call_ms", "mean_ms", "p50_ms", "p99_ms",
+                          "calls_per_sec"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Resilience of the download pipeline to transient failures, fully offline.
+
+Runs YouTubeService in-process against fault-injecting local stand-ins:
+  - the synthetic media of bench_api, served by an HTTP server with Range support that can cut a
+    response partway through and then answer 503 for a while (a network blip followed by an outage),
+  - moto's S3 server as the bucket, where UploadPart calls can fail with SlowDown after their body
+    was sent (or the local storage backend with --storage local).
+
+Every scenario downloads the same video and audio renditions under fresh video IDs and reports the
+retries per stage, the media bytes served and the bytes uploaded, and whether the stored objects
+decode cleanly. The first scenario runs without faults and is the baseline: with resumable
+downloads and uploads, a faulty scenario serves and uploads little more than the baseline does.
+
+Usage (from the backend directory, ffmpeg on PATH):
+    python -m benchmarks.bench_resilience
+    python -m benchmarks.bench_resilience --protocol dash --cut-at 0.5 --outage 2 --scenarios download
+    python -m benchmarks.bench_resilience --upload-mode stream --output resilience.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from urllib.parse import parse_qs, unquote, urlparse
+
+from .bench_api import BENCHMARKS_DIR, build_media, start_s3
+from .common import QuietHandler, QuietServer, print_table, set_default_env
+
+SCENARIOS = ("none", "download", "upload", "both")
+MEDIA_EXTENSIONS = (".m4s", ".mp4", ".m4a")
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+PART_SIZE = 1024 * 1024
+
+
+class MediaFaults:
+    """Cuts the media stream once after cut_at bytes, then fails every request for outage seconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, cut_at: int = None, outage: float = 0) -> None:
+        with self.lock:
+            self.cut_at = cut_at
+            self.outage = outage
+            self.outage_until = 0.0
+            self.served = 0
+
+    def in_outage(self) -> bool:
+        return time.monotonic() < self.outage_until
+
+    def take(self, size: int) -> int:
+        """Account for size media bytes about to be sent and return how many may actually be sent"""
+        with self.lock:
+            allowed = size
+            if self.cut_at is not None and self.served + size >= self.cut_at:
+                allowed = max(0, self.cut_at - self.served)
+                self.cut_at = None
+                self.outage_until = time.monotonic() + self.outage
+            self.served += allowed
+            return allowed
+
+
+class FaultyMediaHandler(QuietHandler):
+    """Serves files with Range support, subject to the server's MediaFaults"""
+
+    def do_GET(self):
+        faults = self.server.faults
+        if faults.in_outage():
+            self.send_error(503)
+            return
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        is_media = path.endswith(MEDIA_EXTENSIONS)
+        with open(path, "rb") as fh:
+            fh.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = fh.read(min(CHUNK_SIZE, remaining))
+                allowed = faults.take(len(chunk)) if is_media else len(chunk)
+                self.wfile.write(chunk[:allowed])
+                if allowed < len(chunk):
+                    # Drop the connection partway through the response.
+                    self.close_connection = True
+                    return
+                remaining -= len(chunk)
+
+
+class S3Faults:
+    """Counts the bytes sent to S3 and fails some UploadPart calls with SlowDown after their body was sent"""
+
+    def __init__(self, client):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.uploaded = 0
+        client.meta.events.register("before-parameter-build.s3.UploadPart", self._count)
+        client.meta.events.register("before-parameter-build.s3.PutObject", self._count)
+        client.meta.events.register("after-call.s3.UploadPart", self._fail)
+
+    def reset(self, failures: int = 0) -> None:
+        with self.lock:
+            self.failures = failures
+            self.uploaded = 0
+
+    def _count(self, params, **kwargs):
+        body = params.get("Body")
+        size = len(body) if isinstance(body, (bytes, bytearray)) else os.fstat(body.fileno()).st_size
+        with self.lock:
+            self.uploaded += size
+
+    def _fail(self, http_response, parsed, model, **kwargs):
+        from botocore.exceptions import ClientError
+
+        # The first part of each upload always succeeds, so the failures hit a partly uploaded object.
+        part_number = int((parse_qs(urlparse(http_response.url).query).get("partNumber") or [1])[0])
+        with self.lock:
+            if self.failures <= 0 or part_number < 2:
+                return
+            self.failures -= 1
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}},
+                          model.name)
+
+
+def http_manifest(media_dir: str) -> None:
+    """Rewrite the manifest so every DASH representation is a single indexed file fetched over plain HTTP"""
+    path = os.path.join(media_dir, "manifest.json")
+    with open(path) as fh:
+        manifest = json.load(fh)
+    for fmt in manifest["formats"]:
+        fragments = fmt.pop("fragments", None)
+        if not fragments:
+            continue
+        del fmt["manifest_stream_number"]
+        fmt["path"] = f"{fmt['format_id']}.{fmt['ext']}"
+        concatenated = os.path.join(media_dir, f"{fmt['format_id']}.fragmented")
+        with open(concatenated, "wb") as out:
+            for fragment in fragments:
+                with open(os.path.join(media_dir, fragment), "rb") as fh:
+                    shutil.copyfileobj(fh, out)
+        # Rewrite as a regular file with its index up front, like the single-file formats YouTube serves,
+        # so ffmpeg can seek in it with Range requests.
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", concatenated, "-c", "copy",
+                        "-movflags", "+faststart", os.path.join(media_dir, fmt["path"])], check=True)
+        os.remove(concatenated)
+    with open(path, "w") as fh:
+        json.dump(manifest, fh)
+
+
+def retries_by_stage() -> dict:
+    from prometheus_client import REGISTRY
+
+    return {
+        stage: REGISTRY.get_sample_value("media_retries_total", {"stage": stage}) or 0
+        for stage in ("extract", "download", "stream", "upload")
+    }
+
+
+def stored_source(storage, download_url: str) -> str:
+    """Something ffmpeg can read the stored object from: a local path or the pre-signed URL"""
+    if storage.name != "local":
+        return download_url
+    object_name = unquote(urlparse(download_url).path[len(urlparse(storage.base_url).path):].lstrip("/"))
+    return storage.path_for(object_name)
+
+
+def decodes_cleanly(source: str) -> bool:
+    result = subprocess.run(["ffmpeg", "-v", "error", "-xerror", "-i", source, "-f", "null", "-"],
+                            capture_output=True, text=True)
+    return result.returncode == 0 and not result.stderr.strip()
+
+
+async def run_scenario(service, name: str, run: int, args, media_faults: MediaFaults, s3_faults, baseline) -> dict:
+    cut_at = None
+    if name in ("download", "both"):
+        cut_at = int(baseline["served"] * args.cut_at)
+    media_faults.reset(cut_at, args.outage)
+    if s3_faults is not None:
+        s3_faults.reset(args.s3_failures if name in ("upload", "both") else 0)
+    retries_before = retries_by_stage()
+
+    renditions = [
+        lambda url: service.download_video(url, args.quality, "mp4"),
+        lambda url: service.download_audio(url, args.audio_format),
+    ]
+    errors, first_error, valid = 0, None, 0
+    started = time.perf_counter()
+    for index, download in enumerate(renditions):
+        url = f"https://www.youtube.com/watch?v=fault{run:03d}{index:03d}"
+        try:
+            result = await download(url)
+        except Exception as e:
+            errors += 1
+            first_error = first_error or str(e)[:200]
+            continue
+        source = stored_source(service.storage, result["message"])
+        valid += await asyncio.to_thread(decodes_cleanly, source)
+    elapsed = time.perf_counter() - started
+
+    retries_after = retries_by_stage()
+    return {
+        "scenario": name,
+        "renditions": len(renditions),
+        "errors": errors,
+        "valid": valid,
+        **{f"retries_{stage}": int(retries_after[stage] - retries_before[stage]) for stage in retries_after},
+        "served": media_faults.served,
+        "served_mb": media_faults.served / 1e6,
+        "uploaded_mb": s3_faults.uploaded / 1e6 if s3_faults is not None else 0.0,
+        "seconds": elapsed,
+        "first_error": first_error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS[1:]), choices=list(SCENARIOS[1:]),
+                        help="Faulty scenarios to run after the fault-free baseline")
+    parser.add_argument("--protocol", default="http", choices=["http", "dash"],
+                        help="Serve the DASH representations as single files (http) or as fragments (dash)")
+    parser.add_argument("--storage", default="s3", choices=["s3", "local"])
+    parser.add_argument("--engine", default="inprocess", choices=["inprocess", "subprocess"])
+    parser.add_argument("--upload-mode", default="file", choices=["file", "stream"])
+    parser.add_argument("--quality", default="720p")
+    parser.add_argument("--audio-format", default="m4a")
+    parser.add_argument("--duration", type=int, default=60, help="Length of the synthetic media in seconds")
+    parser.add_argument("--cut-at", type=float, default=0.8,
+                        help="Cut the media stream after this fraction of the baseline's media bytes")
+    parser.add_argument("--outage", type=float, default=1.0, help="Seconds the media server fails after the cut")
+    parser.add_argument("--s3-failures", type=int, default=3, help="UploadPart calls failing with SlowDown")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None:
+        sys.exit("ffmpeg is required to generate the synthetic media")
+
+    workdir = tempfile.mkdtemp(prefix="bench-resilience-")
+    media_dir = os.path.join(workdir, "media")
+    os.makedirs(media_dir)
+    build_media(media_dir, args.duration)
+    if args.protocol == "http":
+        http_manifest(media_dir)
+    media_faults = MediaFaults()
+    media_server = QuietServer(("127.0.0.1", 0), partial(FaultyMediaHandler, directory=media_dir))
+    media_server.faults = media_faults
+    threading.Thread(target=media_server.serve_forever, daemon=True).start()
+
+    set_default_env()
+    os.environ.update({
+        "BENCH_MEDIA_URL": f"http://127.0.0.1:{media_server.server_address[1]}",
+        "YTDLP_ENGINE": args.engine,
+        "UPLOAD_MODE": args.upload_mode,
+        "STORAGE_BACKEND": args.storage,
+        "SCRATCH_DIR": os.path.join(workdir, "scratch"),
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, "storage"),
+        # Small parts (allowed by moto below S3's 5 MiB minimum), so uploads of the synthetic media are
+        # multipart uploads of several parts.
+        "S3_MULTIPART_PART_SIZE": str(PART_SIZE),
+        "S3_UPLOAD_PART_MIN_SIZE": str(PART_SIZE),
+        # Back off briefly, but long enough in total to outlast the outage.
+        "RETRY_BASE_DELAY": "0.25",
+        "RETRY_MAX_DELAY": "2",
+        "RETRY_DOWNLOAD_ATTEMPTS": "8",
+        # The CLI engine finds the fake extractor through PYTHONPATH.
+        "PYTHONPATH": os.pathsep.join(filter(None, [BENCHMARKS_DIR, os.environ.get("PYTHONPATH")])),
+    })
+    sys.path.insert(0, BENCHMARKS_DIR)
+    s3_server = start_s3(os.environ["S3_BUCKET_NAME"]) if args.storage == "s3" else None
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING", format="{level} | {message}")
+    from app.services.youtube_service import YouTubeService
+
+    async def run_all():
+        service = YouTubeService()
+        s3_faults = S3Faults(service.storage.aws_service.s3_client) if args.storage == "s3" else None
+        try:
+            baseline = await run_scenario(service, "none", 0, args, media_faults, s3_faults, None)
+            results = [baseline]
+            for run, name in enumerate(args.scenarios, start=1):
+                results.append(await run_scenario(service, name, run, args, media_faults, s3_faults, baseline))
+            return results
+        finally:
+            service.storage.close()
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        media_server.shutdown()
+        if s3_server is not None:
+            s3_server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results, ["scenario", "errors", "valid", "retries_extract", "retries_download", "retries_stream",
+                          "retries_upload", "served_mb", "uploaded_mb", "seconds"])
+    for result in results:
+        if result["first_error"]:
+            print(f"{result['scenario']}: first error: {result['first_error']}")
+
+    if args.output:
+        from .bench_api import _git_revision
+        with open(args.output, "w") as fh:
+            json.dump({"revision": _git_revision(), "args": vars(args), "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Startup cost of the API: import time, time to first request and time until ready.
+
+Each run starts a fresh Python process, so nothing is cached between runs:
+  - import: time to `import app.main`,
+  - first_request: from spawning uvicorn until GET /health answers,
+  - ready: from spawning uvicorn until GET /ready answers 200 (storage reachable, yt-dlp and ffmpeg found).
+
+With --storage s3 the bucket is served by moto, as in bench_api.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --storage s3 --engine subprocess --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import free_port, print_table, set_default_env
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def measure_import(env: dict) -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True,
+                            check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_server(env: dict, timeout: float) -> dict:
+    import httpx
+
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    timings = {"first_request": float("nan"), "ready": float("nan")}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                try:
+                    if client.get("/health").status_code == 200:
+                        timings["first_request"] = time.perf_counter() - started
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            while time.perf_counter() - started < timeout:
+                if client.get("/ready").status_code == 200:
+                    timings["ready"] = time.perf_counter() - started
+                    break
+                time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--storage", default="local", choices=["s3", "local"])
+    parser.add_argument("--engine", default="inprocess", choices=["inprocess", "subprocess"])
+    parser.add_argument("--timeout", type=float, default=60, help="Give up on a run after this many seconds")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    set_default_env()
+    os.environ.update({
+        "YTDLP_ENGINE": args.engine,
+        "STORAGE_BACKEND": args.storage,
+        "SCRATCH_DIR": os.path.join(workdir, "scratch"),
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, "storage"),
+        "READINESS_INTERVAL": "1",
+    })
+    s3_server = None
+    if args.storage == "s3":
+        from .bench_api import start_s3
+        s3_server = start_s3(os.environ["S3_BUCKET_NAME"])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+
+    try:
+        runs = []
+        for _ in range(args.runs):
+            run = {"import": measure_import(env)}
+            run.update(measure_server(env, args.timeout))
+            runs.append(run)
+    finally:
+        if s3_server is not None:
+            s3_server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = []
+    for metric in ("import", "first_request", "ready"):
+        values = sorted(run[metric] * 1000 for run in runs)
+        results.append({
+            "metric": metric,
+            "runs": len(values),
+            "min_ms": values[0],
+            "median_ms": statistics.median(values),
+            "max_ms": values[-1],
+        })
+    print_table(results, ["metric", "runs", "min_ms", "median_ms", "max_ms"])
+
+    if args.output:
+        from .bench_api import _git_revision
+        with open(args.output, "w") as fh:
+            json.dump({"revision": _git_revision(), "args": vars(args), "runs": runs, "results": results}, fh,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Helpers shared by the benchmarks: default settings and a quiet local HTTP server.
+"""
+import os
+import socket
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+# The application settings are read at import time; benchmarks never talk to AWS.
+DEFAULT_ENV = {
+    "ALLOWED_ORIGINS": '["*"]', "ALLOW_CREDENTIALS": "true", "ALLOW_METHODS": '["*"]',
+    "ALLOW_HEADERS": '["*"]', "APP_DEBUG": "false", "S3_BUCKET_NAME": "benchmark",
+    "AWS_ACCESS_KEY_ID_VALUE": "benchmark", "AWS_SECRET_ACCESS_KEY_VALUE": "benchmark",
+}
+
+
+def set_default_env() -> None:
+    for name, value in DEFAULT_ENV.items():
+        os.environ.setdefault(name, value)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close connections early (e.g. once the extractor has sniffed the headers).
+        pass
+
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """Serve directory over HTTP on a free local port from a background thread"""
+    server = QuietServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def print_table(results: List[dict], columns: List[str]) -> None:
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for result in results:
+        print(" | ".join(
+            f"{result[column]:>16.1f}" if isinstance(result[column], float) else f"{result[column]:>16}"
+            for column in columns
+        ))
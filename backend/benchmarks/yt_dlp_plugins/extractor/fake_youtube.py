@@ -0,0 +1,43 @@
+"""
+Fake YouTube extractor used by the offline API benchmark.
+
+yt-dlp loads it as a plugin when the benchmarks directory is on sys.path (PYTHONPATH for the CLI
+engine) and tries it before its own extractors. Every YouTube video URL resolves to the synthetic
+media described by BENCH_MEDIA_URL/manifest.json, so format selection, DASH fragment downloads and
+the ffmpeg merge/transcode steps all run for real without network access.
+"""
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class FakeYoutubeBenchIE(InfoExtractor):
+    IE_NAME = 'youtube:bench'
+    _VALID_URL = r'https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)(?P<id>[0-9A-Za-z_-]{11})'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base_url = os.environ['BENCH_MEDIA_URL'].rstrip('/')
+        manifest = self._download_json(f'{base_url}/manifest.json', video_id, note='Downloading bench manifest')
+
+        formats = []
+        for representation in manifest['formats']:
+            fmt = {key: value for key, value in representation.items() if key != 'fragments'}
+            if representation.get('fragments'):
+                fmt.update({
+                    'url': f'{base_url}/manifest.mpd',
+                    'protocol': 'http_dash_segments',
+                    'fragment_base_url': f'{base_url}/',
+                    'fragments': [{'path': path} for path in representation['fragments']],
+                })
+            else:
+                fmt.update({'url': f"{base_url}/{representation['path']}", 'protocol': 'http'})
+                fmt.pop('path', None)
+            formats.append(fmt)
+
+        return {
+            'id': video_id,
+            'title': f'Benchmark video {video_id}',
+            'duration': manifest['duration'],
+            'formats': formats,
+        }
@@ -0,0 +1,11 @@
+import os
+
+# Required settings without defaults, so the app can be imported without a .env file.
+for name, value in {
+    "ALLOWED_ORIGINS": '["*"]',
+    "ALLOW_CREDENTIALS": "true",
+    "ALLOW_METHODS": '["*"]',
+    "ALLOW_HEADERS": '["*"]',
+    "APP_DEBUG": "false",
+}.items():
+    os.environ.setdefault(name, value)
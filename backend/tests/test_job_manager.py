@@ -0,0 +1,77 @@
+"""
+How the in-process job manager ends jobs: cancelled, interrupted by a shutdown, or failed.
+"""
+import asyncio
+
+from app.core.exceptions import YouTubeDownloadError
+from app.schemas.youtube_schema import JobStatus, JobType
+from app.services.job_service import JobManager
+
+PARAMS = {"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "format": "m4a"}
+
+
+def test_shutdown_during_running_job_stops_workers():
+    started = asyncio.Event()
+
+    async def runner(job):
+        started.set()
+        await asyncio.sleep(3600)
+
+    async def scenario():
+        manager = JobManager(runner, max_workers=1)
+        job = await manager.submit(JobType.AUDIO, PARAMS)
+        await asyncio.wait_for(started.wait(), timeout=5)
+
+        # Used to hang: the worker's own cancellation was taken for a cancelled job and swallowed.
+        await asyncio.wait_for(manager.shutdown(), timeout=5)
+        assert job.is_finished
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_job_leaves_worker_running():
+    started = asyncio.Event()
+    runs = []
+
+    async def runner(job):
+        runs.append(job.job_id)
+        started.set()
+        if len(runs) == 1:
+            await asyncio.sleep(3600)
+        return {"status": "success"}
+
+    async def scenario():
+        manager = JobManager(runner, max_workers=1)
+        first = await manager.submit(JobType.AUDIO, PARAMS)
+        await asyncio.wait_for(started.wait(), timeout=5)
+        await manager.cancel(first.job_id)
+        await asyncio.wait_for(first.wait(), timeout=5)
+        assert first.status == JobStatus.CANCELLED
+
+        # The same worker goes on to the next job.
+        second = await manager.submit(JobType.AUDIO, PARAMS)
+        await asyncio.wait_for(second.wait(), timeout=5)
+        assert second.status == JobStatus.DONE
+        await asyncio.wait_for(manager.shutdown(), timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_records_error_kind():
+    async def runner(job):
+        if job.params.get("bad"):
+            raise YouTubeDownloadError("Video unavailable")
+        raise OSError("No space left on device")
+
+    async def scenario():
+        manager = JobManager(runner, max_workers=1)
+        download = await manager.submit(JobType.AUDIO, dict(PARAMS, bad=True))
+        internal = await manager.submit(JobType.AUDIO, PARAMS)
+        await asyncio.wait_for(internal.wait(), timeout=5)
+        await manager.shutdown()
+
+        # The router answers 400 only for the first; the second is a server error.
+        assert download.status == JobStatus.FAILED and download.error_kind == "download"
+        assert internal.status == JobStatus.FAILED and internal.error_kind == "internal"
+
+    asyncio.run(scenario())
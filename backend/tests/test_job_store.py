@@ -0,0 +1,178 @@
+"""
+Lease expiry and recovery of the shared job stores, with a controllable clock instead of real waits.
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app.core.config_settings import settings
+from app.schemas.youtube_schema import JobStatus, JobType
+from app.services.job_service import DistributedJobManager, Job
+from app.services.job_store import WORKER_LOST_ERROR, RedisJobStore, SQLiteJobStore
+
+LEASE_SECONDS = 30
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store_factory(request, tmp_path):
+    """Builds stores of one backend sharing the same data, each on the returned clock"""
+    clock = FakeClock()
+    prefix = f"test-{uuid.uuid4().hex[:8]}"
+    redis = None
+
+    def create():
+        nonlocal redis
+        if request.param == "sqlite":
+            store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+        else:
+            store = RedisJobStore("fakeredis://", prefix=prefix)
+            # Stores of one test share a fake server, as separate processes would share Redis.
+            redis = redis or store.redis
+            store.redis = redis
+        store.clock = clock
+        return store
+
+    return create, clock
+
+
+async def enqueue_job(store, client: str = "client") -> str:
+    job = Job(JobType.AUDIO, {"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "format": "m4a"},
+              client=client)
+    await store.enqueue(job.to_record(weight=1, attempts=0, worker=None))
+    return job.job_id
+
+
+def test_expired_lease_is_reclaimed_exactly_once(store_factory):
+    create, clock = store_factory
+
+    async def scenario():
+        store = create()
+        job_id = await enqueue_job(store)
+        first = await store.claim("worker-a", LEASE_SECONDS)
+        assert first["job_id"] == job_id and first["attempts"] == 1
+
+        # Within the lease nothing is recovered.
+        clock.advance(LEASE_SECONDS - 1)
+        assert await store.recover(max_attempts=3) == 0
+        assert await store.claim("worker-b", LEASE_SECONDS) is None
+
+        # worker-a stops renewing: the job is queued again, once, however often recover runs.
+        clock.advance(2)
+        assert await store.recover(max_attempts=3) == 1
+        assert await store.recover(max_attempts=3) == 0
+        assert (await store.get(job_id))["status"] == JobStatus.QUEUED.value
+
+        second = await store.claim("worker-b", LEASE_SECONDS)
+        assert second["job_id"] == job_id
+        assert second["worker"] == "worker-b" and second["attempts"] == 2
+        assert await store.claim("worker-c", LEASE_SECONDS) is None
+
+        # The stale worker has lost the job: it can neither renew the lease nor finish it.
+        assert await store.heartbeat(job_id, "worker-a", LEASE_SECONDS, {}) is None
+        assert not await store.finish(job_id, "worker-a", {"status": JobStatus.DONE.value})
+        assert await store.finish(job_id, "worker-b", {"status": JobStatus.DONE.value})
+        assert (await store.stats())["running"] == 0
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_lease_fails_job_after_max_attempts(store_factory):
+    create, clock = store_factory
+
+    async def scenario():
+        store = create()
+        job_id = await enqueue_job(store)
+        for attempt in (1, 2):
+            record = await store.claim(f"worker-{attempt}", LEASE_SECONDS)
+            assert record["attempts"] == attempt
+            clock.advance(LEASE_SECONDS + 1)
+            assert await store.recover(max_attempts=2) == 1
+
+        record = await store.get(job_id)
+        assert record["status"] == JobStatus.FAILED.value
+        assert record["error"] == WORKER_LOST_ERROR
+        assert await store.claim("worker-3", LEASE_SECONDS) is None
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_manager_reruns_job_of_dead_worker_once(store_factory, monkeypatch):
+    create, clock = store_factory
+    monkeypatch.setattr(settings, "JOB_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "JOB_HEARTBEAT_INTERVAL", 0.01)
+    runs = []
+
+    async def runner(job: Job) -> dict:
+        runs.append(job.job_id)
+        return {"status": "success"}
+
+    async def scenario():
+        # A worker claims the job and dies without finishing it or renewing its lease.
+        store = create()
+        job_id = await enqueue_job(store)
+        assert (await store.claim("dead-worker", LEASE_SECONDS))["job_id"] == job_id
+        clock.advance(LEASE_SECONDS + 1)
+
+        manager = DistributedJobManager(runner, store=create(), run_workers=True, max_workers=2)
+        manager.start()
+        try:
+            job = await manager.get(job_id)
+            await asyncio.wait_for(job.wait(), timeout=10)
+            # Give the other worker and further recovery rounds a chance to run it again.
+            await asyncio.sleep(0.2)
+        finally:
+            await manager.shutdown()
+
+        assert job.status == JobStatus.DONE
+        assert runs == [job_id]
+        record = await store.get(job_id)
+        assert record["attempts"] == 2 and record["worker"] == manager.worker_id
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_shutdown_hands_running_job_back_to_queue(store_factory, monkeypatch):
+    create, clock = store_factory
+    monkeypatch.setattr(settings, "JOB_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "JOB_HEARTBEAT_INTERVAL", 0.01)
+    started = asyncio.Event()
+
+    async def runner(job: Job) -> dict:
+        started.set()
+        await asyncio.sleep(3600)
+
+    async def scenario():
+        store = create()
+        job_id = await enqueue_job(store)
+        manager = DistributedJobManager(runner, store=create(), run_workers=True, max_workers=1)
+        manager.start()
+        await asyncio.wait_for(started.wait(), timeout=10)
+        assert (await store.get(job_id))["attempts"] == 1
+
+        # As on SIGTERM: the worker releases the job without using up an attempt.
+        await asyncio.wait_for(manager.shutdown(), timeout=10)
+        record = await store.get(job_id)
+        assert record["status"] == JobStatus.QUEUED.value
+        assert record["attempts"] == 0 and record["worker"] is None
+
+        second = await store.claim("worker-b", LEASE_SECONDS)
+        assert second["job_id"] == job_id and second["attempts"] == 1
+        await store.close()
+
+    asyncio.run(scenario())
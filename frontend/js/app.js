@@ -108,6 +108,79 @@ document.addEventListener('DOMContentLoaded', function () {
     }
   }
 
+  function showProgress(text) {
+    const p = loadingSpinner ? loadingSpinner.querySelector('p') : null;
+    if (p) {
+      p.textContent = text || 'Processing your request...';
+    }
+  }
+
+  function formatBytes(bytes) {
+    if (!bytes) {
+      return '0 MB';
+    }
+    return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+  }
+
+  function describeProgress(progress) {
+    if (progress.phase === 'download') {
+      const percent = progress.percent != null ? `${progress.percent}%` : formatBytes(progress.downloaded_bytes);
+      const speed = progress.speed ? ` at ${formatBytes(progress.speed)}/s` : '';
+      const eta = progress.eta != null ? `, ${progress.eta}s left` : '';
+      return `Downloading... ${percent}${speed}${eta}`;
+    }
+    if (progress.phase === 'postprocess') {
+      return 'Merging audio and video...';
+    }
+    if (progress.phase === 'upload') {
+      return `Uploading... ${progress.percent != null ? progress.percent + '%' : ''}`;
+    }
+    return 'Processing your request...';
+  }
+
+  /**
+   * Submits a download job and follows its progress over Server-Sent Events.
+   * Resolves with the job result once the job is done.
+   */
+  async function runDownloadJob(payload) {
+    const response = await fetch(`${currentConfig.apiEndpoint}/jobs`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(payload)
+    });
+
+    const job = await response.json();
+    if (!response.ok) {
+      throw new Error(job.detail || 'Download failed');
+    }
+
+    return new Promise((resolve, reject) => {
+      const events = new EventSource(`${currentConfig.apiEndpoint}/jobs/${job.job_id}/events`);
+
+      events.addEventListener('progress', (event) => {
+        showProgress(describeProgress(JSON.parse(event.data)));
+      });
+
+      events.addEventListener('status', (event) => {
+        const status = JSON.parse(event.data);
+        if (status.status === 'done') {
+          events.close();
+          resolve(status.result);
+        } else if (status.status === 'failed' || status.status === 'cancelled') {
+          events.close();
+          reject(new Error(status.error || `Job ${status.status}`));
+        }
+      });
+
+      events.onerror = () => {
+        events.close();
+        reject(new Error('Lost connection to the server'));
+      };
+    });
+  }
+
   function hideResults() {
     if (resultsContainer) {
       resultsContainer.classList.add('hidden');
@@ -163,19 +236,35 @@ document.addEventListener('DOMContentLoaded', function () {
     }
   }
 
+  // Same pattern as the backend's extract_video_id
+  function extractVideoId(url) {
+    const match = url.match(/^(https?:\/\/)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)\/(watch\?v=|embed\/|v\/|shorts\/|.+[?&]v=)?([0-9A-Za-z_-]{11})(?=$|[^0-9A-Za-z_-])/);
+    return match ? match[6] : null;
+  }
+
+  // GET by video ID is cacheable: the browser (and any CDN in front of the API) reuses the response
+  // and revalidates it with If-None-Match. Other URLs fall back to the POST endpoint.
+  function fetchFormats(url) {
+    const videoId = extractVideoId(url);
+    if (videoId) {
+      return fetch(`${currentConfig.apiEndpoint}/formats/${encodeURIComponent(videoId)}`);
+    }
+    return fetch(`${currentConfig.apiEndpoint}/formats`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({url: url})
+    });
+  }
+
   // Handle video options selection
   async function handleVideoOptions(url) {
     try {
       showLoading(true);
       hideError();
 
-      const response = await fetch(`${currentConfig.apiEndpoint}/formats`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({url: url})
-      });
+      const response = await fetchFormats(url);
 
       const data = await response.json();
 
@@ -204,6 +293,9 @@ document.addEventListener('DOMContentLoaded', function () {
       const qualitySelector = createQualitySelector(data.available_qualities);
       downloadOptions.appendChild(qualitySelector);
 
+      // Optional clip range
+      downloadOptions.appendChild(createClipSelector());
+
       // Add download button
       const downloadButton = createDownloadButton(url);
       downloadOptions.appendChild(downloadButton);
@@ -230,24 +322,14 @@ document.addEventListener('DOMContentLoaded', function () {
     try {
       showLoading(true);
 
-      const downloadResponse = await fetch(`${currentConfig.apiEndpoint}/download/video`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          url: url,
-          format: format,
-          quality: quality
-        })
+      const data = await runDownloadJob({
+        type: 'video',
+        url: url,
+        format: format,
+        quality: quality,
+        ...clipRange()
       });
 
-      if (!downloadResponse.ok) {
-        throw new Error('Download failed');
-      }
-
-      const data = await downloadResponse.json();
-
       if (data.status === 'success' && data.message) {
         // Clear the previous options
         downloadOptions.innerHTML = '';
@@ -285,6 +367,7 @@ document.addEventListener('DOMContentLoaded', function () {
       showError('Download failed: ' + error.message);
     } finally {
       showLoading(false);
+      showProgress();
     }
   }
 
@@ -294,13 +377,7 @@ document.addEventListener('DOMContentLoaded', function () {
       showLoading(true);
       hideError();
 
-      const response = await fetch(`${currentConfig.apiEndpoint}/formats`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({url: url})
-      });
+      const response = await fetchFormats(url);
 
       const data = await response.json();
 
@@ -326,9 +403,12 @@ document.addEventListener('DOMContentLoaded', function () {
       downloadOptions.appendChild(formatSelector);
 
       // Create quality selection
-      const qualitySelector = createAudioQualitySelector(data.available_qualities);
+      const qualitySelector = createAudioQualitySelector(data.audio_qualities || ['best']);
       downloadOptions.appendChild(qualitySelector);
 
+      // Optional clip range
+      downloadOptions.appendChild(createClipSelector());
+
       // Add download button
       const downloadButton = createAudioDownloadButton(url);
       downloadOptions.appendChild(downloadButton);
@@ -372,10 +452,12 @@ document.addEventListener('DOMContentLoaded', function () {
 
     const select = document.createElement('select');
     select.id = 'audio-quality-select';
-    Object.keys(qualities).forEach(quality => {
+    // Tiers arrive from lowest to highest bitrate; preselect the best one.
+    qualities.forEach(quality => {
       const option = document.createElement('option');
       option.value = quality;
-      option.textContent = quality;
+      option.textContent = quality.charAt(0).toUpperCase() + quality.slice(1);
+      option.selected = quality === 'best';
       select.appendChild(option);
     });
 
@@ -384,6 +466,41 @@ document.addEventListener('DOMContentLoaded', function () {
     return container;
   }
 
+  function createClipSelector() {
+    const container = document.createElement('div');
+    container.className = 'clip-selector download-option';
+
+    const label = document.createElement('label');
+    label.textContent = 'Clip (seconds, optional):';
+
+    const inputs = document.createElement('div');
+    ['start', 'end'].forEach(name => {
+      const input = document.createElement('input');
+      input.type = 'number';
+      input.min = '0';
+      input.step = 'any';
+      input.id = `clip-${name}`;
+      input.placeholder = name.charAt(0).toUpperCase() + name.slice(1);
+      inputs.appendChild(input);
+    });
+
+    container.appendChild(label);
+    container.appendChild(inputs);
+    return container;
+  }
+
+  // Start and end of the requested clip; empty fields default to the start and end of the media.
+  function clipRange() {
+    const range = {};
+    ['start', 'end'].forEach(name => {
+      const input = document.querySelector(`#clip-${name}`);
+      if (input && input.value !== '') {
+        range[name] = Number(input.value);
+      }
+    });
+    return range;
+  }
+
   function createAudioDownloadButton(url) {
     const container = document.createElement('div');
     container.className = 'download-button-container';
@@ -410,24 +527,14 @@ document.addEventListener('DOMContentLoaded', function () {
     try {
       showLoading(true);
 
-      const downloadResponse = await fetch(`${currentConfig.apiEndpoint}/download/audio`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          url: url,
-          format: format,
-          quality: quality
-        })
+      const data = await runDownloadJob({
+        type: 'audio',
+        url: url,
+        format: format,
+        quality: quality,
+        ...clipRange()
       });
 
-      if (!downloadResponse.ok) {
-        throw new Error('Download failed');
-      }
-
-      const data = await downloadResponse.json();
-
       if (data.status === 'success' && data.message) {
         // Clear the previous options
         downloadOptions.innerHTML = '';
@@ -465,6 +572,7 @@ document.addEventListener('DOMContentLoaded', function () {
       showError('Download failed: ' + error.message);
     } finally {
       showLoading(false);
+      showProgress();
     }
   }
 